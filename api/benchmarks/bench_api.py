@@ -0,0 +1,214 @@
+'''
+Benchmarks the API hot paths against a synthetic city, offline: storage is
+an in-memory SQLite database standing in for Firestore and Nominatim is
+replaced by a stub (cities resolve through the bundled gazetteer).
+
+Each scenario runs in a fresh interpreter through Flask's test client and
+reports p50/p95/p99 latency, throughput and peak memory. The results are
+printed as JSON (and written to --output) so runs can be compared across
+commits.
+
+Run from the api folder:
+    python -m benchmarks.bench_api
+    python -m benchmarks.bench_api --establishments 2000 --orders 5000 --scenarios get-est-by-city submit-order
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+import subprocess
+
+SCENARIOS = ['get-est-by-city', 'submit-order', 'submit-orders', 'get-estab-orders', 'login', 'get-all-est']
+
+class StubLocation:
+    def __init__(self, lat, lon, city):
+        self.latitude = lat
+        self.longitude = lon
+        self.raw = {'address': {'city': city, 'road': 'Bench St'}}
+
+class StubGeolocator:
+    '''
+    Answers Nominatim lookups with the synthetic city, without network
+    '''
+
+    def __init__(self, city, lat, lon):
+        self.location = StubLocation(lat, lon, city)
+
+    def reverse(self, query, **kwargs):
+        return self.location
+
+    def geocode(self, query, **kwargs):
+        return self.location
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def make_request(scenario, city, rng, batch=1):
+    '''
+    Builds a function sending one random request of a scenario
+
+    Args:
+        scenario (str): The scenario name
+        city (dict): The synthetic city
+        rng (random.Random): The random generator
+        batch (int): The number of orders per /submit-orders request
+
+    Returns:
+        callable: Takes the test client and returns the response
+    '''
+    ests = city['establishments']
+    users = city['users']
+
+    def near(doc, spread=0.01):
+        return doc['lat'] + rng.uniform(-spread, spread), doc['lon'] + rng.uniform(-spread, spread)
+
+    def random_order():
+        est = rng.choice(ests)
+        lat, lon = near(est)
+        return {'eid': est['eid'], 'uid': rng.choice(users)['uid'], 'lat': lat, 'lon': lon,
+                'items': {str(rng.randint(1, 12)): rng.randint(1, 3)}}
+
+    if scenario == 'get-est-by-city':
+        def send(client):
+            lat, lon = near(rng.choice(users))
+            return client.post('/get-est-by-city', json={'city_id': city['cid'], 'lat': lat, 'lon': lon})
+    elif scenario == 'submit-order':
+        def send(client):
+            return client.post('/submit-order', json={'order': random_order()})
+    elif scenario == 'submit-orders':
+        def send(client):
+            return client.post('/submit-orders', json={'orders': [random_order() for _ in range(batch)]})
+    elif scenario == 'get-estab-orders':
+        def send(client):
+            return client.post('/get-estab-orders', json={'eid': rng.choice(ests)['eid']})
+    elif scenario == 'login':
+        # Returning users, a new user would also seed ten demo establishments in the background
+        def send(client):
+            user = rng.choice(users)
+            return client.post('/login', data={'name': user['name'], 'email': user['email'],
+                                               'lat': str(user['lat']), 'lon': str(user['lon'])})
+    elif scenario == 'get-all-est':
+        def send(client):
+            response = client.post('/get-all-est', json={})
+            response.get_data()
+            return response
+    else:
+        raise ValueError("Unknown scenario: {}".format(scenario))
+    return send
+
+def run_scenario(scenario, config):
+    '''
+    Runs one scenario in the current interpreter (the child of main)
+
+    Args:
+        scenario (str): The scenario name
+        config (dict): The parsed command line options
+
+    Returns:
+        dict: The latency percentiles (ms), throughput (requests/s), errors and peak memory (MB)
+    '''
+    import main as api
+    from benchmarks.synthetic import generate_city, load_city
+
+    city = generate_city(establishments=config['establishments'], users=config['users'],
+                         orders=config['orders'], hotspots=config['hotspots'], seed=config['seed'])
+    center = city['establishments'][0]
+    geolocator = StubGeolocator(city['cid'], center['lat'], center['lon'])
+    api.get_geolocator = lambda: geolocator
+    load_city(api, city)
+
+    client = api.app.test_client()
+    send = make_request(scenario, city, random.Random(config['seed']), config['batch'])
+    for _ in range(config['warmup']):
+        send(client)
+
+    times = []
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(config['requests']):
+        sent = time.perf_counter()
+        response = send(client)
+        times.append((time.perf_counter() - sent) * 1000)
+        errors += response.status_code != 200
+    elapsed = time.perf_counter() - start
+
+    # Allocations are traced on a separate, shorter pass so they do not skew the latencies
+    tracemalloc.start()
+    for _ in range(min(config['requests'], 50)):
+        send(client)
+    peak_alloc = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    try:
+        import resource
+        # kilobytes on Linux, bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1e6 if sys.platform == 'darwin' else 1e3)
+    except ImportError:
+        peak_rss = None
+    return {
+        'requests': len(times),
+        'errors': errors,
+        'p50_ms': round(percentile(times, 50), 3),
+        'p95_ms': round(percentile(times, 95), 3),
+        'p99_ms': round(percentile(times, 99), 3),
+        'mean_ms': round(sum(times) / len(times), 3),
+        'throughput_rps': round(len(times) / elapsed, 1),
+        'orders_per_s': round(len(times) * config['batch'] / elapsed, 1) if scenario == 'submit-orders' else None,
+        'peak_alloc_mb': round(peak_alloc / 1e6, 2),
+        'peak_rss_mb': round(peak_rss, 1) if peak_rss is not None else None
+    }
+
+def git_commit(cwd):
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=cwd, capture_output=True,
+                             text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the API against a synthetic city")
+    parser.add_argument('--establishments', type=int, default=500)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--orders', type=int, default=1000, help="orders placed during the last hour")
+    parser.add_argument('--hotspots', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=200, help="timed requests per scenario")
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch', type=int, default=50, help="orders per /submit-orders request")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--output', help="also write the results to this file")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    config = {key: value for key, value in vars(args).items() if key not in ('scenarios', 'output', 'child')}
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child, config)))
+        return
+
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, STORAGE_BACKEND='sqlite', SQLITE_PATH=':memory:', GEOCACHE_PATH='',
+               GEOCODER_BACKEND='local', EST_CACHE_WATCH='0', CITY_EVENTS_WATCH='0',
+               LOG_LEVEL='WARNING', TRACE_SLOW_MS='0',
+               # The stub answers instantly, the shared Nominatim budget does not apply
+               GEOCODER_RATE_FILE='', GEOCODER_RATE='1000', GEOCODER_BURST='1000')
+    results = {}
+    for scenario in args.scenarios:
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_api', '--child', scenario] + sys.argv[1:],
+                             env=env, cwd=cwd, check=True, capture_output=True, text=True)
+        results[scenario] = json.loads(out.stdout.strip().splitlines()[-1])
+        print("{:>18}: p50 {p50_ms} ms, p95 {p95_ms} ms, p99 {p99_ms} ms, {throughput_rps} req/s".format(
+            scenario, **results[scenario]), file=sys.stderr)
+    report = {'commit': git_commit(cwd), 'python': platform.python_version(), 'config': config,
+              'results': results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
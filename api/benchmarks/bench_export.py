@@ -0,0 +1,63 @@
+'''
+Compares the peak memory of exporting every establishment as one jsonify'd
+list against the streamed /get-all-est responses (JSON array and NDJSON).
+
+Run from the api folder (uses a temporary SQLite database):
+    python -m benchmarks.bench_export
+'''
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+SIZES = [5000, 20000]
+
+CHILD = r'''
+import json, sys, time, tracemalloc
+import main
+from flask import jsonify
+
+mode, n = sys.argv[1], int(sys.argv[2])
+store = main.get_store()
+for start in range(0, n, 1000):
+    store.put_establishments([main.build_establishment(
+        'Establishment %d' % i, main.DEFAULT_MENU, 'city %d' % (i % 50), 40.0, -74.0, '%d Bench St' % i,
+        'A place to eat', ['food'], '', 'uid%d' % i, main.DEFAULT_PROMO, est_id='e%06d' % i)
+        for i in range(start, min(start + 1000, n))])
+client = main.app.test_client()
+tracemalloc.start()
+start = time.perf_counter()
+size = 0
+if mode == 'list':
+    with main.app.app_context():
+        size = len(jsonify(main.get_all_establishments(main.LIST_FIELDS)).get_data())
+else:
+    body = {'format': 'ndjson'} if mode == 'ndjson' else {}
+    response = client.post('/get-all-est', json=body, buffered=False)
+    for chunk in response.response:
+        size += len(chunk)
+    response.close()
+elapsed = time.perf_counter() - start
+print(json.dumps({'bytes': size, 'peak': tracemalloc.get_traced_memory()[1], 'seconds': elapsed}))
+'''
+
+def run(mode, n, path):
+    env = dict(os.environ, STORAGE_BACKEND='sqlite', SQLITE_PATH=path, GEOCACHE_PATH='',
+               GEOCODER_BACKEND='local', EST_CACHE_WATCH='0')
+    out = subprocess.run([sys.executable, '-c', CHILD, mode, str(n)], env=env, check=True,
+                         capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    print("{:>8} {:>8} {:>12} {:>14} {:>10}".format('rows', 'mode', 'bytes', 'peak (MB)', 'time (s)'))
+    for n in SIZES:
+        for mode in ('list', 'array', 'ndjson'):
+            with tempfile.TemporaryDirectory() as tmp:
+                result = run(mode, n, os.path.join(tmp, 'bench.sqlite3'))
+            print("{:>8} {:>8} {:>12} {:>14.1f} {:>10.2f}".format(
+                n, mode, result['bytes'], result['peak'] / 1e6, result['seconds']))
+
+if __name__ == '__main__':
+    main()
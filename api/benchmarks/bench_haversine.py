@@ -0,0 +1,44 @@
+'''
+Compares the scalar radius test used per order against the vectorized one.
+
+Run from the api folder:
+    python -m benchmarks.bench_haversine
+'''
+import time
+import random
+import numpy as np
+from spatial import RADIUS_SLACK, distance_miles, within_radius_mask
+
+SIZES = [100, 10000, 1000000]
+
+def scalar_mask(lat, lon, lats, lons, radius_in_miles):
+    return [distance_miles(lat, lon, lat2, lon2) <= radius_in_miles * RADIUS_SLACK
+            for lat2, lon2 in zip(lats, lons)]
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    random.seed(42)
+    lat, lon = 37.7749, -122.4194
+    print("{:>10} {:>14} {:>14} {:>9}".format('points', 'scalar (ms)', 'vector (ms)', 'speedup'))
+    for n in SIZES:
+        lats = [lat + random.uniform(-0.05, 0.05) for _ in range(n)]
+        lons = [lon + random.uniform(-0.05, 0.05) for _ in range(n)]
+        assert scalar_mask(lat, lon, lats, lons, 1) == within_radius_mask(lat, lon, lats, lons, 1).tolist()
+        repeat = 1 if n >= 1000000 else 5
+        scalar = best_of(lambda: scalar_mask(lat, lon, lats, lons, 1), repeat)
+        # Includes the list -> array conversion the routes pay
+        vector = best_of(lambda: within_radius_mask(lat, lon, lats, lons, 1), repeat)
+        lat_arr, lon_arr = np.asarray(lats), np.asarray(lons)
+        vector_arr = best_of(lambda: within_radius_mask(lat, lon, lat_arr, lon_arr, 1), repeat)
+        print("{:>10} {:>14.3f} {:>14.3f} {:>8.1f}x  (arrays in place: {:.3f} ms)".format(
+            n, scalar * 1000, vector * 1000, scalar / vector, vector_arr * 1000))
+
+if __name__ == '__main__':
+    main()
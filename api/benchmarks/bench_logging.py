@@ -0,0 +1,77 @@
+'''
+Measures the per-request cost of the debug events of /get-est-by-city for a
+city of 500 establishments and 300 open-circle orders (one order check event
+per order and the whole result per request, what used to be printed on
+every call) against the default INFO level and a sampled access log.
+
+Run from the api folder (uses a temporary SQLite database):
+    python -m benchmarks.bench_logging
+'''
+import os
+import sys
+import json
+import tempfile
+import statistics
+import subprocess
+
+ESTABLISHMENTS = 500
+ORDERS = 300
+REQUESTS = 100
+
+MODES = [
+    ('debug', {'LOG_LEVEL': 'DEBUG'}),
+    ('info', {'LOG_LEVEL': 'INFO'}),
+    ('sampled', {'LOG_LEVEL': 'DEBUG', 'LOG_SAMPLE_RATES': '/get-est-by-city=0.01'}),
+]
+
+CHILD = r'''
+import json, random, sys, time
+import main
+
+rng = random.Random(42)
+lat, lon = 40.7128, -74.0060
+ests = [main.build_establishment('Establishment %d' % i, main.DEFAULT_MENU, 'bench city',
+                                 lat + rng.uniform(-0.05, 0.05), lon + rng.uniform(-0.05, 0.05),
+                                 '%d Bench St' % i, 'A place to eat', ['food'], '', 'uid%d' % i,
+                                 main.DEFAULT_PROMO, est_id='e%04d' % i)
+        for i in range(int(sys.argv[1]))]
+main.get_store().put_establishments(ests)
+now = time.time()
+for i in range(int(sys.argv[2])):
+    main.create_order({'1': 1}, 10.0, 'e%04d' % (i % len(ests)), 'buyer%d' % i,
+                      lat + rng.uniform(-0.03, 0.03), lon + rng.uniform(-0.03, 0.03),
+                      'bench city', 'pending', now - rng.uniform(0, 600))
+client = main.app.test_client()
+body = {'city_id': 'bench city', 'lat': lat, 'lon': lon}
+client.post('/get-est-by-city', json=body)
+times = []
+for _ in range(int(sys.argv[3])):
+    start = time.perf_counter()
+    client.post('/get-est-by-city', json=body)
+    times.append((time.perf_counter() - start) * 1000)
+print(json.dumps({'times': times}))
+'''
+
+def run(env, path, log_path):
+    env = dict(os.environ, STORAGE_BACKEND='sqlite', SQLITE_PATH=path, GEOCACHE_PATH='',
+               GEOCODER_BACKEND='local', EST_CACHE_WATCH='0', CITY_EVENTS_WATCH='0',
+               CITY_SNAPSHOT_TTL='0', **env)
+    with open(log_path, 'w') as log_file:
+        out = subprocess.run([sys.executable, '-c', CHILD, str(ESTABLISHMENTS), str(ORDERS), str(REQUESTS)],
+                             env=env, check=True, stdout=subprocess.PIPE, stderr=log_file, text=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    print("{:>8} {:>9} {:>9} {:>14}".format('mode', 'p50 (ms)', 'p95 (ms)', 'log bytes/req'))
+    for mode, env in MODES:
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = os.path.join(tmp, 'log.jsonl')
+            result = run(env, os.path.join(tmp, 'bench.sqlite3'), log_path)
+            log_bytes = os.path.getsize(log_path)
+        times = sorted(result['times'])
+        print("{:>8} {:>9.2f} {:>9.2f} {:>14.0f}".format(
+            mode, statistics.median(times), times[int(len(times) * 0.95) - 1], log_bytes / (REQUESTS + 1)))
+
+if __name__ == '__main__':
+    main()
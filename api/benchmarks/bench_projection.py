@@ -0,0 +1,74 @@
+'''
+Compares /get-est-by-city responses with full establishment documents
+against the projected list (LIST_FIELDS) for a city of 500 establishments,
+with the establishment cache on and off.
+
+Run from the api folder (uses a temporary SQLite database):
+    python -m benchmarks.bench_projection
+'''
+import os
+import sys
+import json
+import tempfile
+import statistics
+import subprocess
+
+ESTABLISHMENTS = 500
+REQUESTS = 50
+
+CHILD = r'''
+import json, random, sys, time
+import main
+
+full = sys.argv[1] == 'full'
+if full:
+    main.LIST_FIELDS = None
+rng = random.Random(42)
+menu = [{'id': str(i), 'name': 'Menu item %d' % i, 'price': 5.0 + i,
+         'description': 'Includes a variety of ingredients prepared fresh every day, item %d.' % i,
+         'category': 'Specials', 'rating': 4.5, 'img': '/assets/burger%d.png' % (i % 4 + 1)}
+        for i in range(1, 13)]
+lat, lon = 40.7128, -74.0060
+ests = [main.build_establishment('Establishment %d' % i, menu, 'bench city',
+                                 lat + rng.uniform(-0.05, 0.05), lon + rng.uniform(-0.05, 0.05),
+                                 '%d Bench St' % i, 'A place to eat', ['food'], '', 'uid%d' % i,
+                                 ['5% OFF', 'Free Beverage'], est_id='e%04d' % i)
+        for i in range(int(sys.argv[2]))]
+main.get_store().put_establishments(ests)
+client = main.app.test_client()
+body = {'city_id': 'bench city', 'lat': lat, 'lon': lon}
+client.post('/get-est-by-city', json=body)
+times = []
+for _ in range(int(sys.argv[3])):
+    start = time.perf_counter()
+    response = client.post('/get-est-by-city', json=body)
+    times.append((time.perf_counter() - start) * 1000)
+menu_bytes = 0 if full else len(client.get('/est-menu/e0000').data)
+print(json.dumps({'bytes': len(response.data), 'times': times, 'menu_bytes': menu_bytes}))
+'''
+
+def run(mode, cache_entries, path):
+    env = dict(os.environ, STORAGE_BACKEND='sqlite', SQLITE_PATH=path, GEOCACHE_PATH='',
+               GEOCODER_BACKEND='local', EST_CACHE_MAX_ENTRIES=str(cache_entries))
+    out = subprocess.run([sys.executable, '-c', CHILD, mode, str(ESTABLISHMENTS), str(REQUESTS)],
+                         env=env, check=True,
+                         capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    print("{:>6} {:>7} {:>12} {:>9} {:>9}".format('mode', 'cache', 'bytes', 'p50 (ms)', 'p95 (ms)'))
+    for cache_entries in (5000, 0):
+        for mode in ('full', 'slim'):
+            with tempfile.TemporaryDirectory() as tmp:
+                result = run(mode, cache_entries, os.path.join(tmp, 'bench.sqlite3'))
+            times = sorted(result['times'])
+            print("{:>6} {:>7} {:>12} {:>9.2f} {:>9.2f}".format(
+                mode, 'on' if cache_entries else 'off', result['bytes'],
+                statistics.median(times), times[int(len(times) * 0.95) - 1]))
+            if result['menu_bytes']:
+                menu_bytes = result['menu_bytes']
+    print("GET /est-menu/<eid>: {} bytes, fetched once per opened establishment".format(menu_bytes))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+'''
+Measures the cold start of the API: importing main.py, creating the app and
+serving the first requests, each in a fresh interpreter.
+
+Run from the api folder (the SQLite backend keeps it offline):
+    STORAGE_BACKEND=sqlite python -m benchmarks.bench_startup
+'''
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+RUNS = 7
+
+CHILD = r'''
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+client = main.app.test_client()
+client.get('/stats')
+first = time.perf_counter()
+client.post('/get-all-est')
+storage = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (first - imported) * 1000,
+    'first_storage_request_ms': (storage - first) * 1000,
+}))
+'''
+
+def run_once():
+    env = dict(os.environ)
+    env.setdefault('GEOCACHE_PATH', '')
+    out = subprocess.run([sys.executable, '-c', CHILD], env=env, check=True,
+                         capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    runs = [run_once() for _ in range(RUNS)]
+    report = {key: round(statistics.median(r[key] for r in runs), 2) for key in runs[0]}
+    report['runs'] = RUNS
+    report['storage_backend'] = os.getenv('STORAGE_BACKEND', 'firestore')
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+'''
+Replays bursts of orders against a running server at a set rate and
+concurrency, then checks the circles the server assigned.
+
+The stream is either synthetic (orders converging on the establishments
+nearest to a position, like a circle filling up) or recorded in a JSON
+lines file of {"at", "eid", "uid", "lat", "lon", "items"} where "at" is the
+offset in seconds from the start. Latencies are measured from the time an
+order was due, so a server that falls behind shows in the tail rather than
+in a lower request rate.
+
+After the run the orders are read back with /get-estab-orders and their
+ts_groups are compared with the circles the CircleRegistry rule gives for
+the same orders in created_at order: every order has to end up with the
+orders it would share a circle with (within a mile of a member, same
+establishment, same 15 minutes).
+
+Run from the api folder against e.g. `gunicorn main:app`:
+    python -m benchmarks.loadgen --url http://localhost:8000 --city "new york" --lat 40.7128 --lon -74.006 \\
+        --orders 2000 --rate 200 --concurrency 32 --establishments 3
+    python -m benchmarks.loadgen --url http://localhost:8000 --replay orders.jsonl --speed 2
+'''
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests as rq
+from circles import CircleRegistry
+from spatial import distance_miles
+
+def nearest_establishments(session, url, city, lat, lon, count):
+    '''
+    Gets the establishments of a city nearest to a position
+
+    Returns:
+        list: Up to count {'eid', 'lat', 'lon'}
+    '''
+    response = session.post(url + '/get-est-by-city', json={'city_id': city, 'lat': lat, 'lon': lon})
+    response.raise_for_status()
+    ests = sorted(response.json()['establishments'],
+                  key=lambda est: distance_miles(lat, lon, est['lat'], est['lon']))
+    return [{'eid': est['eid'], 'lat': est['lat'], 'lon': est['lon']} for est in ests[:count]]
+
+def burst_stream(ests, orders, rate, spread=0.01, users=100, seed=42):
+    '''
+    Generates a burst of orders converging on a few establishments
+
+    Args:
+        ests (list): The establishments ({'eid', 'lat', 'lon'})
+        orders (int): The number of orders
+        rate (float): Orders per second, 0 to send them all at once
+        spread (float): Orders are placed up to this many degrees from their establishment
+        users (int): The number of distinct customers
+        seed (int): The seed of the generator
+
+    Returns:
+        list: The orders, each with its 'at' offset in seconds
+    '''
+    rng = random.Random(seed)
+    stream = []
+    for i in range(orders):
+        est = rng.choice(ests)
+        stream.append({'at': i / rate if rate else 0.0, 'eid': est['eid'], 'uid': 'load{}'.format(rng.randrange(users)),
+                       'lat': est['lat'] + rng.uniform(-spread, spread),
+                       'lon': est['lon'] + rng.uniform(-spread, spread),
+                       'items': {str(rng.randint(1, 12)): rng.randint(1, 3)}})
+    return stream
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else None
+
+def replay(url, stream, concurrency, speed=1.0):
+    '''
+    Sends the orders of a stream, each when it is due
+
+    Args:
+        url (str): The base url of the server
+        stream (list): The orders, sorted by 'at'
+        concurrency (int): The number of requests in flight at most
+        speed (float): Replays the stream this many times faster
+
+    Returns:
+        dict: The latencies (s), the ids of the created orders, the errors and the elapsed time
+    '''
+    local = threading.local()
+    lock = threading.Lock()
+    latencies = []
+    created = []
+    errors = []
+
+    def send(order, due):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = rq.Session()
+        wait = due - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        body = {'order': {key: order[key] for key in ('eid', 'uid', 'lat', 'lon', 'items')}}
+        try:
+            response = session.post(url + '/submit-order', json=body, timeout=30)
+            ok = response.status_code == 200
+            result = response.json() if ok else response.text[:200]
+        except rq.RequestException as e:
+            ok, result = False, str(e)
+        latency = time.perf_counter() - due
+        with lock:
+            latencies.append(latency)
+            if ok:
+                created.append(result['order_id'])
+            else:
+                errors.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for order in stream:
+            due = start + order['at'] / speed
+            # Keeps at most a few orders per worker queued so that the pool paces the stream
+            while due - time.perf_counter() > 1:
+                time.sleep(0.1)
+            pool.submit(send, order, due)
+    return {'latencies': latencies, 'created': created, 'errors': errors,
+            'elapsed': time.perf_counter() - start}
+
+def expected_circles(orders, window=900, radius_in_miles=1):
+    '''
+    Assigns orders to circles with the registry's rule, in created_at order
+
+    Args:
+        orders (list): The orders ({'oid', 'eid', 'lat', 'lon', 'created_at'})
+
+    Returns:
+        dict: oid -> the ts_group the order should have
+    '''
+    registry = CircleRegistry(lambda minutes: [], window=window, radius_in_miles=radius_in_miles,
+                              resync_interval=float('inf'))
+    return {order['oid']: registry.assign(order['eid'], order['lat'], order['lon'], now=order['created_at'])
+            for order in sorted(orders, key=lambda o: o['created_at'])}
+
+def check_circles(session, url, eids, since, created):
+    '''
+    Reads the orders back and compares the server's circles with the expected ones
+
+    Args:
+        session (requests.Session): The HTTP session
+        url (str): The base url of the server
+        eids (iterable): The establishments the stream ordered from
+        since (float): A timestamp before the first order of the run (minus a window,
+            so circles already open when the run started are taken into account)
+        created (list): The ids of the orders created by the run
+
+    Returns:
+        dict: The number of orders checked, missing, in a different circle than expected,
+        the circles and the pairs of orders within a mile that were split (for information:
+        an order joins the earliest circle it reaches, which can split such a pair)
+    '''
+    orders = []
+    for eid in eids:
+        response = session.post(url + '/get-estab-orders', json={'eid': eid, 'since': since})
+        response.raise_for_status()
+        for key, circle in response.json().items():
+            if key.isdigit():
+                orders.extend(circle['orders'])
+    ours = set(created)
+    found = {order['oid'] for order in orders}
+    expected = expected_circles(orders)
+
+    # Orders are compared by the set of orders they share a circle with, ts_groups differ
+    # between the server (time of assignment) and the replay (created_at)
+    def members(assignment):
+        circles = {}
+        for order in orders:
+            circles.setdefault((order['eid'], assignment(order)), set()).add(order['oid'])
+        return {oid: circle for circle in circles.values() for oid in circle}
+    actual_members = members(lambda order: order['ts_group'])
+    expected_members = members(lambda order: expected[order['oid']])
+    mismatched = [oid for oid in ours & found if actual_members[oid] != expected_members[oid]]
+
+    split = 0
+    run_orders = sorted((o for o in orders if o['oid'] in ours), key=lambda o: (o['eid'], o['created_at']))
+    for i, a in enumerate(run_orders):
+        for b in run_orders[i + 1:]:
+            if b['eid'] != a['eid'] or b['created_at'] - a['created_at'] > 900:
+                break
+            if a['ts_group'] != b['ts_group'] and distance_miles(a['lat'], a['lon'], b['lat'], b['lon']) <= 1:
+                split += 1
+    return {'orders_checked': len(ours & found), 'missing': len(ours - found),
+            'circles': len({(o['eid'], o['ts_group']) for o in run_orders}),
+            'mismatched_orders': len(mismatched), 'split_pairs_within_1_mile': split,
+            'mismatched_sample': mismatched[:10]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays order bursts against a running server")
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--replay', help="JSON lines file of orders to replay instead of a synthetic burst")
+    parser.add_argument('--save', help="write the stream to this JSON lines file for later replays")
+    parser.add_argument('--city', help="city of the synthetic burst")
+    parser.add_argument('--lat', type=float)
+    parser.add_argument('--lon', type=float)
+    parser.add_argument('--establishments', type=int, default=3, help="establishments the burst converges on")
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=100, help="orders per second, 0 for all at once")
+    parser.add_argument('--spread', type=float, default=0.01, help="degrees around each establishment")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed factor")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-check', action='store_true', help="skip reading the orders back")
+    args = parser.parse_args()
+
+    session = rq.Session()
+    if args.replay:
+        with open(args.replay) as f:
+            stream = sorted((json.loads(line) for line in f if line.strip()), key=lambda o: o['at'])
+    else:
+        if args.city is None or args.lat is None or args.lon is None:
+            parser.error("--city, --lat and --lon are required without --replay")
+        ests = nearest_establishments(session, args.url, args.city, args.lat, args.lon, args.establishments)
+        if not ests:
+            parser.error("No establishments in {}".format(args.city))
+        stream = burst_stream(ests, args.orders, args.rate, args.spread, seed=args.seed)
+    if args.save:
+        with open(args.save, 'w') as f:
+            for order in stream:
+                f.write(json.dumps(order) + '\n')
+
+    started_at = time.time()
+    result = replay(args.url, stream, args.concurrency, args.speed)
+    latencies = result['latencies']
+    report = {
+        'sent': len(stream),
+        'ok': len(result['created']),
+        'errors': len(result['errors']),
+        'error_sample': result['errors'][:5],
+        'elapsed_s': round(result['elapsed'], 3),
+        'achieved_rps': round(len(result['created']) / result['elapsed'], 1),
+        'latency_ms': {name: round(percentile(latencies, p) * 1000, 2) if latencies else None
+                       for name, p in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))},
+    }
+    if not args.no_check:
+        report['circles'] = check_circles(session, args.url, {o['eid'] for o in stream}, started_at - 900,
+                                          result['created'])
+    print(json.dumps(report, indent=2))
+    if result['errors'] or report.get('circles', {}).get('mismatched_orders') or \
+            report.get('circles', {}).get('missing'):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
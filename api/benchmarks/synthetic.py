@@ -0,0 +1,96 @@
+'''
+Synthetic cities for the benchmarks: establishments, users and recent
+orders clustered around a few hotspots, with the random offsets
+populate_db uses, and the orders grouped into circles by the same rule as
+the live CircleRegistry.
+'''
+import time
+import random
+from circles import CircleRegistry
+
+# Offsets of populate_db around a position, in degrees
+OFFSET = (-0.0200, 0.0300)
+
+def _near(rng, lat, lon, spread=1.0):
+    return (lat + rng.uniform(*OFFSET) * spread, lon + rng.uniform(*OFFSET) * spread)
+
+def generate_city(name='new york', lat=40.7128, lon=-74.0060, establishments=500, users=200,
+                  orders=1000, hotspots=5, window=3600, seed=42, now=None):
+    '''
+    Generates the documents of a synthetic city
+
+    Args:
+        name (str): The city id, a gazetteer city so that it resolves offline
+        lat (float): The latitude of the city center
+        lon (float): The longitude of the city center
+        establishments (int): The number of establishments
+        users (int): The number of users
+        orders (int): The number of orders
+        hotspots (int): The number of clusters establishments, users and orders are drawn around
+        window (float): Orders are created during the last window seconds
+        seed (int): The seed of the generator, the same arguments give the same city
+        now (float): The timestamp the orders end at, defaults to time.time()
+
+    Returns:
+        dict: 'cid', 'establishments' ({'eid', 'uid', 'name', 'lat', 'lon'}), 'users'
+        ({'uid', 'email', 'name', 'lat', 'lon'}) and 'orders' (complete order documents
+        sorted by created_at, with ts_groups)
+    '''
+    rng = random.Random(seed)
+    now = time.time() if now is None else now
+    spots = [_near(rng, lat, lon, spread=3) for _ in range(hotspots)]
+    ests = []
+    for i in range(establishments):
+        e_lat, e_lon = _near(rng, *rng.choice(spots))
+        ests.append({'eid': 'e{:06d}'.format(i), 'uid': 'owner{:06d}'.format(i),
+                     'name': 'Establishment {}'.format(i), 'lat': e_lat, 'lon': e_lon})
+    people = []
+    for i in range(users):
+        u_lat, u_lon = _near(rng, *rng.choice(spots))
+        people.append({'uid': 'u{:06d}'.format(i), 'email': 'user{}@example.com'.format(i),
+                       'name': 'User {}'.format(i), 'lat': u_lat, 'lon': u_lon})
+
+    registry = CircleRegistry(lambda minutes: [], resync_interval=float('inf'))
+    docs = []
+    for i, created_at in enumerate(sorted(now - rng.uniform(0, window) for _ in range(orders))):
+        est = rng.choice(ests)
+        user = rng.choice(people) if people else {'uid': 'u0'}
+        o_lat, o_lon = _near(rng, est['lat'], est['lon'], spread=0.5)
+        items = {str(rng.randint(1, 12)): rng.randint(1, 3)}
+        docs.append({
+            'oid': 'o{:07d}'.format(i),
+            'eid': est['eid'],
+            'total': round(sum(count * 10.0 for count in items.values()), 2),
+            'uid': user['uid'],
+            'lat': o_lat,
+            'lon': o_lon,
+            'cid': name,
+            'status': 'pending',
+            'ts_group': registry.assign(est['eid'], o_lat, o_lon, now=created_at),
+            'order_obj': items,
+            'created_at': created_at
+        })
+    return {'cid': name, 'establishments': ests, 'users': people, 'orders': docs}
+
+def load_city(main, city):
+    '''
+    Writes a synthetic city through the app's storage
+
+    Args:
+        main (module): The imported main module
+        city (dict): The city returned by generate_city
+    '''
+    main.create_city(city['cid'])
+    main.save_menu(main.DEFAULT_MENU)
+    store = main.get_store()
+    ests = [main.build_establishment(est['name'], main.DEFAULT_MENU, city['cid'], est['lat'], est['lon'],
+                                     '{} Bench St'.format(i), 'A place to eat', ['food'], '', est['uid'],
+                                     main.DEFAULT_PROMO, est_id=est['eid'])
+            for i, est in enumerate(city['establishments'])]
+    for i in range(0, len(ests), 500):
+        store.put_establishments(ests[i:i + 500])
+    for user in city['users']:
+        main.create_user(user['uid'], user['email'], user['name'], user['lat'], user['lon'],
+                         city['cid'], 'customer')
+    for order in city['orders']:
+        store.put_order(dict(order))
@@ -0,0 +1,255 @@
+import time
+import heapq
+import threading
+from spatial import within_radius_mask
+
+class CircleRegistry:
+    '''
+    Live registry of the open circles of every establishment.
+
+    A circle is identified by its ts_group and stays open until
+    ts_group + window. An order joins the earliest open circle of its
+    establishment that has a member order within the radius, otherwise it
+    opens a new circle. Expired circles are dropped through a heap ordered
+    by expiry.
+
+    The registry is rebuilt from the orders store (loader) on first use and
+    every resync_interval seconds, so restarted workers and orders written
+    by other workers are picked up. The first time an order would open a
+    circle for an establishment after a resync, the open orders of that
+    establishment are read again (eid_loader), so a circle another worker
+    opened since the resync is joined instead. Later openings for the same
+    establishment rely on that read until the next resync, which keeps the
+    store reads to one per establishment per resync_interval; a circle
+    another worker opens in between is only picked up by the next resync or
+    by observe(). Two workers that open a circle for nearby orders at the
+    same moment, before either order is written, can still each open one.
+    '''
+
+    def __init__(self, loader, window=900, radius_in_miles=1, resync_interval=30, eid_loader=None):
+        self.loader = loader
+        self.eid_loader = eid_loader
+        self.window = window
+        self.radius_in_miles = radius_in_miles
+        self.resync_interval = resync_interval
+        self.joined = 0
+        self.opened = 0
+        self.resyncs = 0
+        self.rechecks = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._circles = {}  # eid -> {ts_group: circle}
+        self._expiry = []  # heap of (expires_at, eid, ts_group)
+        self._local = []  # (added_at, eid, ts_group, lat, lon) written since the last sync
+        self._synced_at = None
+        self._rechecked = set()  # eids read through eid_loader since the last sync
+
+    def _add(self, circles, expiry, eid, ts_group, lat, lon):
+        by_ts = circles.setdefault(eid, {})
+        circle = by_ts.get(ts_group)
+        if circle is None:
+            circle = {'ts_group': ts_group, 'lat': lat, 'lon': lon, 'lats': [], 'lons': []}
+            by_ts[ts_group] = circle
+            heapq.heappush(expiry, (ts_group + self.window, eid, ts_group))
+        circle['lats'].append(lat)
+        circle['lons'].append(lon)
+
+    def _expire(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, eid, ts_group = heapq.heappop(self._expiry)
+            by_ts = self._circles.get(eid)
+            if by_ts is not None:
+                by_ts.pop(ts_group, None)
+                if not by_ts:
+                    del self._circles[eid]
+
+    def resync(self, now=None):
+        '''
+        Rebuilds the registry from the orders store, keeping circles this process
+        opened or joined while the store was being read
+
+        Args:
+            now (float): The current timestamp, defaults to time.time()
+        '''
+        now = time.time() if now is None else now
+        orders = self.loader(self.window // 60)
+        circles = {}
+        expiry = []
+        seen = set()
+        for order in orders:
+            if order.get('ts_group') is None:
+                continue
+            self._add(circles, expiry, order['eid'], order['ts_group'], order['lat'], order['lon'])
+            seen.add((order['eid'], order['ts_group'], order['lat'], order['lon']))
+        with self._lock:
+            for added_at, eid, ts_group, lat, lon in self._local:
+                if (eid, ts_group, lat, lon) not in seen:
+                    self._add(circles, expiry, eid, ts_group, lat, lon)
+            # Writes older than the read are guaranteed to be part of it
+            self._local = [entry for entry in self._local if entry[0] >= now - 60]
+            self._circles = circles
+            self._expiry = expiry
+            self._synced_at = now
+            self._rechecked = set()
+            self.resyncs += 1
+            self._expire(now)
+
+    def assign(self, eid, lat, lon, now=None):
+        '''
+        Assigns an order to a circle, joining an open one or opening a new one
+
+        Args:
+            eid (str): The id of the establishment the order is from
+            lat (float): The latitude of the order
+            lon (float): The longitude of the order
+            now (float): The timestamp of the order, defaults to time.time()
+
+        Returns:
+            float: The ts_group of the circle the order belongs to
+        '''
+        now = time.time() if now is None else now
+        if self._synced_at is None or now - self._synced_at >= self.resync_interval:
+            # Only one thread reads the store, the others keep using the current state
+            if self._sync_lock.acquire(blocking=self._synced_at is None):
+                try:
+                    if self._synced_at is None or now - self._synced_at >= self.resync_interval:
+                        self.resync(now)
+                finally:
+                    self._sync_lock.release()
+        if self.eid_loader is not None:
+            with self._lock:
+                self._expire(now)
+                stale = eid not in self._rechecked and self._match(eid, lat, lon) is None
+                if stale:
+                    self._rechecked.add(eid)
+            if stale:
+                # Another worker may have opened a circle nearby since the last resync
+                self._merge(eid, self.eid_loader(eid, self.window // 60), now)
+        with self._lock:
+            self._expire(now)
+            ts_group = self._match(eid, lat, lon)
+            if ts_group is None:
+                ts_group = now
+                self.opened += 1
+            else:
+                self.joined += 1
+            self._add(self._circles, self._expiry, eid, ts_group, lat, lon)
+            self._local.append((now, eid, ts_group, lat, lon))
+            return ts_group
+
+    def unassign(self, eid, ts_group, lat, lon):
+        '''
+        Takes back an assignment whose order could not be written, dropping the circle
+        if the order opened it
+
+        Args:
+            eid (str): The id of the establishment the order is from
+            ts_group (float): The ts_group assign returned
+            lat (float): The latitude of the order
+            lon (float): The longitude of the order
+        '''
+        with self._lock:
+            for i in range(len(self._local) - 1, -1, -1):
+                if self._local[i][1:] == (eid, ts_group, lat, lon):
+                    del self._local[i]
+                    break
+            by_ts = self._circles.get(eid, {})
+            circle = by_ts.get(ts_group)
+            if circle is None:
+                return
+            for i in range(len(circle['lats']) - 1, -1, -1):
+                if circle['lats'][i] == lat and circle['lons'][i] == lon:
+                    del circle['lats'][i]
+                    del circle['lons'][i]
+                    break
+            if not circle['lats']:
+                # Its entry in the expiry heap finds nothing to drop
+                del by_ts[ts_group]
+                if not by_ts:
+                    del self._circles[eid]
+
+    def _match(self, eid, lat, lon):
+        for circle in sorted(self._circles.get(eid, {}).values(), key=lambda c: c['ts_group']):
+            if within_radius_mask(lat, lon, circle['lats'], circle['lons'], self.radius_in_miles).any():
+                return circle['ts_group']
+        return None
+
+    def _merge(self, eid, orders, now):
+        # Adds the open orders of an establishment the registry does not have yet
+        with self._lock:
+            self.rechecks += 1
+            by_ts = self._circles.get(eid, {})
+            known = {(ts_group, lat, lon) for ts_group, circle in by_ts.items()
+                     for lat, lon in zip(circle['lats'], circle['lons'])}
+            for order in orders:
+                key = (order.get('ts_group'), order['lat'], order['lon'])
+                if key[0] is None or key[0] + self.window <= now or key in known:
+                    continue
+                known.add(key)
+                self._add(self._circles, self._expiry, eid, *key)
+
+    def observe(self, eid, ts_group, lat, lon, now=None):
+        '''
+        Adds an order another process assigned to a circle, ahead of the next resync
+
+        Args:
+            eid (str): The id of the establishment the order is from
+            ts_group (float): The ts_group the order was assigned to
+            lat (float): The latitude of the order
+            lon (float): The longitude of the order
+            now (float): The current timestamp, defaults to time.time()
+        '''
+        now = time.time() if now is None else now
+        with self._lock:
+            if ts_group + self.window > now:
+                self._add(self._circles, self._expiry, eid, ts_group, lat, lon)
+
+    def circle(self, eid, ts_group):
+        '''
+        Gets an open circle
+
+        Args:
+            eid (str): The id of the establishment
+            ts_group (float): The ts_group of the circle
+
+        Returns:
+            dict: {'lat', 'lon', 'ts_group', 'max_ts', 'orders'}, or None if the circle is not open
+        '''
+        with self._lock:
+            c = self._circles.get(eid, {}).get(ts_group)
+            if c is None:
+                return None
+            return {'lat': c['lat'], 'lon': c['lon'], 'ts_group': c['ts_group'],
+                    'max_ts': c['ts_group'] + self.window, 'orders': len(c['lats'])}
+
+    def open_circles(self, eid):
+        '''
+        Gets the open circles of an establishment
+
+        Args:
+            eid (str): The id of the establishment
+
+        Returns:
+            list: A list of {'lat', 'lon', 'ts_group', 'max_ts'} dicts sorted by ts_group
+        '''
+        with self._lock:
+            self._expire(time.time())
+            return [{'lat': c['lat'], 'lon': c['lon'], 'ts_group': c['ts_group'],
+                     'max_ts': c['ts_group'] + self.window}
+                    for c in sorted(self._circles.get(eid, {}).values(), key=lambda c: c['ts_group'])]
+
+    def stats(self):
+        '''
+        Gets the registry counters
+
+        Returns:
+            dict: open circles, joins, opens, resyncs and rechecks of an establishment before opening
+        '''
+        with self._lock:
+            return {
+                'open_circles': sum(len(by_ts) for by_ts in self._circles.values()),
+                'joined': self.joined,
+                'opened': self.opened,
+                'resyncs': self.resyncs,
+                'rechecks': self.rechecks
+            }
@@ -0,0 +1,48 @@
+import os
+import threading
+import functools
+
+_lock = threading.RLock()
+_registry = []
+
+def per_process(factory):
+    '''
+    Turns a client factory into a getter that builds the client on first use
+    and caches it for the current process. A forked child (e.g. a gunicorn
+    worker of a preloaded app) builds its own client instead of reusing the
+    parent's sockets, threads and file handles.
+
+    Args:
+        factory (callable): Function building the client
+
+    Returns:
+        callable: Getter returning the cached client
+    '''
+    state = {'pid': None, 'client': None}
+
+    @functools.wraps(factory)
+    def getter():
+        pid = os.getpid()
+        if state['pid'] != pid:
+            with _lock:
+                if state['pid'] != pid:
+                    state['client'] = factory()
+                    state['pid'] = pid
+        return state['client']
+
+    def reset():
+        with _lock:
+            state['pid'] = None
+            state['client'] = None
+
+    getter.reset = reset
+    getter.is_ready = lambda: state['pid'] == os.getpid()
+    _registry.append(getter)
+    return getter
+
+def reset_clients():
+    '''
+    Drops every cached client so that the next use builds a new one
+    '''
+    for getter in _registry:
+        getter.reset()
@@ -0,0 +1,232 @@
+import threading
+from collections import OrderedDict
+
+class EstablishmentCache:
+    '''
+    Process-level cache of establishment documents keyed by eid, with
+    secondary indexes by uid and cid.
+
+    A uid/cid index is only used once a full query result for it has been
+    stored (fill_by); evicting or invalidating one of its members
+    drops that completeness so the next list read goes to storage again.
+
+    Returned documents are shallow copies: callers may add or replace
+    top-level fields but must not mutate nested values (menu, promo, ...).
+    '''
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._docs = OrderedDict()
+        self._by_index = {'uid': {}, 'cid': {}}  # field -> value -> set of eids
+        self._complete = {'uid': set(), 'cid': set()}
+        self._generation = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, fn):
+        '''
+        Registers a function called with the eid of every changed or invalidated establishment
+
+        Args:
+            fn (callable): The function to be called
+        '''
+        self._listeners.append(fn)
+
+    def _notify(self, eid):
+        for fn in self._listeners:
+            fn(eid)
+
+    def _index(self, doc):
+        for field, index in self._by_index.items():
+            value = doc.get(field)
+            if value is not None:
+                index.setdefault(value, set()).add(doc['eid'])
+
+    def _unindex(self, doc, drop_complete):
+        for field, index in self._by_index.items():
+            value = doc.get(field)
+            eids = index.get(value)
+            if eids is not None:
+                eids.discard(doc['eid'])
+                if not eids:
+                    del index[value]
+            if drop_complete:
+                self._complete[field].discard(value)
+
+    def _store(self, doc):
+        old = self._docs.pop(doc['eid'], None)
+        if old is not None:
+            self._unindex(old, drop_complete=False)
+        self._docs[doc['eid']] = doc
+        self._index(doc)
+        while len(self._docs) > self.max_entries:
+            _, evicted = self._docs.popitem(last=False)
+            self._unindex(evicted, drop_complete=True)
+
+    def generation(self):
+        '''
+        Gets a counter that changes on every write, taken before a storage read
+        so that fill_* can refuse results that may predate a concurrent write
+
+        Returns:
+            int: The current generation
+        '''
+        with self._lock:
+            return self._generation
+
+    def get(self, eid):
+        '''
+        Gets a cached establishment
+
+        Args:
+            eid (str): The id of the establishment
+
+        Returns:
+            dict: A copy of the establishment, or None if it is not cached
+        '''
+        with self._lock:
+            doc = self._docs.get(eid)
+            if doc is None:
+                self.misses += 1
+                return None
+            self._docs.move_to_end(eid)
+            self.hits += 1
+            return dict(doc)
+
+    def get_by(self, field, value):
+        '''
+        Gets every cached establishment with a uid or cid, if the full list is cached
+
+        Args:
+            field (str): 'uid' or 'cid'
+            value (str): The uid or cid
+
+        Returns:
+            list: Copies of the establishments, or None if the list is not cached
+        '''
+        with self._lock:
+            if value not in self._complete[field]:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return [dict(self._docs[eid]) for eid in self._by_index[field].get(value, ())]
+
+    def fill(self, doc, generation=None):
+        '''
+        Stores an establishment read from storage
+
+        Args:
+            doc (dict): The establishment
+            generation (int): The generation taken before the read
+        '''
+        with self._lock:
+            if generation is None or generation == self._generation:
+                self._store(dict(doc))
+
+    def fill_by(self, field, value, docs, generation):
+        '''
+        Stores the full result of a uid or cid query
+
+        Args:
+            field (str): 'uid' or 'cid'
+            value (str): The uid or cid that was queried
+            docs (list): Every establishment returned by the query
+            generation (int): The generation taken before the query
+        '''
+        with self._lock:
+            if generation != self._generation or len(docs) > self.max_entries // 2:
+                return
+            for doc in docs:
+                self._store(dict(doc))
+            self._complete[field].add(value)
+
+    def put(self, doc):
+        '''
+        Stores an establishment this process just wrote
+
+        Args:
+            doc (dict): The full, current establishment
+        '''
+        with self._lock:
+            self._generation += 1
+            old = self._docs.get(doc['eid'])
+            if old is not None:
+                # Lists of the uid/cid it moved away from stay correct, the new ones are kept
+                self._unindex(old, drop_complete=False)
+            self._store(dict(doc))
+        self._notify(doc['eid'])
+
+    def invalidate(self, eid):
+        '''
+        Drops an establishment (and the completeness of its uid/cid lists)
+
+        Args:
+            eid (str): The id of the establishment
+        '''
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            doc = self._docs.pop(eid, None)
+            if doc is not None:
+                self._unindex(doc, drop_complete=True)
+            else:
+                # Unknown members may belong to any cached list
+                self._complete['uid'].clear()
+                self._complete['cid'].clear()
+        self._notify(eid)
+
+    def remove(self, eid):
+        '''
+        Removes an establishment that was deleted
+
+        Args:
+            eid (str): The id of the establishment
+        '''
+        with self._lock:
+            self._generation += 1
+            doc = self._docs.pop(eid, None)
+            if doc is not None:
+                self._unindex(doc, drop_complete=False)
+        self._notify(eid)
+
+    def on_snapshot(self, changes):
+        '''
+        Applies changes made by other workers, as delivered by Storage.watch_establishments
+
+        Args:
+            changes (list): A list of (kind, doc) tuples, kind is 'ADDED', 'MODIFIED' or 'REMOVED'
+        '''
+        for kind, doc in changes:
+            if kind == 'REMOVED':
+                self.remove(doc['eid'])
+                continue
+            with self._lock:
+                self._generation += 1
+                old = self._docs.get(doc['eid'])
+                if old is not None:
+                    self._unindex(old, drop_complete=False)
+                # Only keep documents someone asked for: cached ones and members of cached lists
+                if (old is not None or doc.get('uid') in self._complete['uid']
+                        or doc.get('cid') in self._complete['cid']):
+                    self._store(dict(doc))
+            self._notify(doc['eid'])
+
+    def stats(self):
+        '''
+        Gets the cache counters
+
+        Returns:
+            dict: hits, misses, hit_ratio, invalidations and the number of cached establishments
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'entries': len(self._docs)
+            }
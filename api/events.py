@@ -0,0 +1,216 @@
+import time
+import heapq
+import queue
+import threading
+from collections import OrderedDict, deque
+
+# Put on the queue of a subscriber that fell too far behind, it has to reload its state
+RESET = {'type': 'reset'}
+
+class TooManySubscribers(Exception):
+    '''
+    Raised by EventBus.subscribe when the process already serves max_subscribers
+    '''
+
+class Subscription:
+    '''
+    The queue of events of one subscriber to a channel
+    '''
+
+    def __init__(self, channel, max_queue):
+        self.channel = channel
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.closed = False
+
+    def get(self, timeout):
+        '''
+        Waits for the next event
+
+        Args:
+            timeout (float): The maximum number of seconds to wait
+
+        Returns:
+            dict: The event, or None if there was none within timeout
+        '''
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+class EventBus:
+    '''
+    In-process publish/subscribe of small events by channel (city).
+
+    Publishing never blocks: a subscriber whose queue is full is dropped and
+    gets RESET as its last event. Events can also be scheduled for later
+    (e.g. circle expiries), they are published by one daemon thread.
+
+    The last history events of every channel are kept with the time they were
+    published, so a subscriber that reconnects gets the events it missed
+    since then (or RESET when they are no longer all kept). Workers publish
+    the same event at slightly different times, so replays start overlap
+    seconds earlier and subscribers skip the events they already got.
+    '''
+
+    def __init__(self, max_queue=100, seen_entries=10000, max_subscribers=None, history=500, overlap=2):
+        self.max_queue = max_queue
+        self.seen_entries = seen_entries
+        self.max_subscribers = max_subscribers
+        self.history = history
+        self.overlap = overlap
+        self.started_at = time.time()
+        self.published = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._subscribers = 0
+        self._channels = {}  # channel -> set of subscriptions
+        self._history = {}  # channel -> deque of (published at, event)
+        self._scheduled = []  # heap of (at, seq, channel, event)
+        self._seq = 0
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._timer = None
+
+    def subscribe(self, channel, since=None):
+        '''
+        Subscribes to the events of a channel
+
+        Args:
+            channel (str): The channel
+            since (float): Also delivers the events published after this time, e.g. the
+                time of the last event a reconnecting subscriber got
+
+        Returns:
+            Subscription: The subscription, to be closed with unsubscribe
+
+        Raises:
+            TooManySubscribers: If max_subscribers subscriptions are already open
+        '''
+        sub = Subscription(channel, self.max_queue)
+        with self._lock:
+            if self.max_subscribers is not None and self._subscribers >= self.max_subscribers:
+                self.rejected += 1
+                raise TooManySubscribers()
+            self._subscribers += 1
+            self._channels.setdefault(channel, set()).add(sub)
+            if since is not None:
+                kept = self._history.get(channel, ())
+                if since < self.started_at or (len(kept) == self.history and kept[0][0] > since):
+                    sub._put(RESET)
+                else:
+                    for at, event in kept:
+                        if at > since - self.overlap and not sub._put(event):
+                            break
+        return sub
+
+    def unsubscribe(self, sub):
+        '''
+        Stops delivering events to a subscription
+
+        Args:
+            sub (Subscription): The subscription
+        '''
+        with self._lock:
+            if sub.closed:
+                return
+            subs = self._channels.get(sub.channel)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._channels[sub.channel]
+            self._subscribers -= 1
+            sub.closed = True
+
+    def publish(self, channel, event):
+        '''
+        Delivers an event to every subscriber of a channel
+
+        Args:
+            channel (str): The channel
+            event (dict): The event, with a 'type'
+        '''
+        with self._lock:
+            # Strictly increasing publish times, they identify the events of a channel
+            kept = self._history.setdefault(channel, deque(maxlen=self.history))
+            at = time.time()
+            if kept and at <= kept[-1][0]:
+                at = kept[-1][0] + 1e-6
+            event = dict(event, at=at)
+            kept.append((at, event))
+            subs = list(self._channels.get(channel, ()))
+            self.published += 1
+        for sub in subs:
+            if not sub._put(event):
+                self.unsubscribe(sub)
+                with self._lock:
+                    self.dropped += 1
+                # Make room for the reset so the subscriber's stream ends
+                sub.get(timeout=0)
+                sub._put(RESET)
+
+    def schedule(self, at, channel, event):
+        '''
+        Publishes an event at a later time
+
+        Args:
+            at (float): The timestamp to publish the event at
+            channel (str): The channel
+            event (dict): The event
+        '''
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._scheduled, (at, self._seq, channel, event))
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run_scheduled, daemon=True)
+                self._timer.start()
+            self._wakeup.notify()
+
+    def _run_scheduled(self):
+        while True:
+            with self._lock:
+                while not self._scheduled or self._scheduled[0][0] > time.time():
+                    self._wakeup.wait(self._scheduled[0][0] - time.time() if self._scheduled else None)
+                _, _, channel, event = heapq.heappop(self._scheduled)
+            self.publish(channel, event)
+
+    def first_seen(self, key):
+        '''
+        Remembers a key (e.g. an order id) to publish events only once per key
+
+        Args:
+            key (str): The key
+
+        Returns:
+            bool: True the first time the key is seen
+        '''
+        with self._lock:
+            if key in self._seen:
+                return False
+            self._seen[key] = True
+            while len(self._seen) > self.seen_entries:
+                self._seen.popitem(last=False)
+            return True
+
+    def stats(self):
+        '''
+        Gets the bus counters
+
+        Returns:
+            dict: subscribers, published, dropped and rejected subscribers
+        '''
+        with self._lock:
+            return {
+                'subscribers': self._subscribers,
+                'published': self.published,
+                'dropped': self.dropped,
+                'rejected': self.rejected,
+                'scheduled': len(self._scheduled)
+            }
@@ -0,0 +1,153 @@
+import os
+import time
+import struct
+import tempfile
+import threading
+from singleflight import SingleFlight
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: the bucket is only shared between threads
+    fcntl = None
+
+class GeocodeTimeout(Exception):
+    '''
+    Raised when a geocoding call cannot be started or finished before its deadline
+    '''
+
+class TokenBucket:
+    '''
+    Token bucket whose state lives in a small file guarded by an exclusive
+    lock, so every gunicorn worker on the machine draws from the same budget.
+
+    Callers reserve a token up front (the bucket may go negative) and sleep
+    only until their reservation is due, which keeps callers in FIFO order
+    and spends the provider's budget exactly.
+    '''
+    _STATE = struct.Struct('dd')  # tokens, last refill timestamp
+
+    def __init__(self, rate=1.0, burst=1.0, path=None):
+        self.rate = rate
+        self.burst = burst
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._tokens = burst
+        self._updated = time.time()
+
+    def reserve(self, deadline=None):
+        '''
+        Reserves one token
+
+        Args:
+            deadline (float): time.time() by which the token must be usable, None for no limit
+
+        Returns:
+            float: The number of seconds to wait before the token can be spent
+
+        Raises:
+            GeocodeTimeout: If the token would only be available after the deadline
+        '''
+        with self._thread_lock:
+            if self.path and fcntl:
+                with open(self.path, 'a+b') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    try:
+                        f.seek(0)
+                        raw = f.read(self._STATE.size)
+                        if len(raw) == self._STATE.size:
+                            tokens, updated = self._STATE.unpack(raw)
+                        else:
+                            tokens, updated = self.burst, time.time()
+                        wait, tokens, updated = self._take(tokens, updated, deadline)
+                        f.seek(0)
+                        f.truncate()
+                        f.write(self._STATE.pack(tokens, updated))
+                        f.flush()
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                wait, self._tokens, self._updated = self._take(self._tokens, self._updated, deadline)
+        return wait
+
+    def _take(self, tokens, updated, deadline):
+        now = time.time()
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = max(0.0, (1 - tokens) / self.rate)
+        if deadline is not None and now + wait > deadline:
+            raise GeocodeTimeout("Geocoding rate budget exhausted until after the deadline")
+        return wait, tokens - 1, now
+
+    def acquire(self, deadline=None):
+        '''
+        Waits until one token can be spent
+
+        Args:
+            deadline (float): time.time() by which the token must be usable, None for no limit
+
+        Raises:
+            GeocodeTimeout: If the token would only be available after the deadline
+        '''
+        wait = self.reserve(deadline)
+        if wait > 0:
+            time.sleep(wait)
+
+class GeocodeScheduler:
+    '''
+    Runs geocoding calls under the shared rate limit. Identical lookups in
+    flight at the same time are merged into one provider call.
+    '''
+
+    def __init__(self, bucket, deadline=10.0):
+        self.bucket = bucket
+        self.deadline = deadline
+        self.flights = SingleFlight()
+
+    def run(self, key, fn, deadline=None):
+        '''
+        Runs a geocoding call once the rate budget allows it
+
+        Args:
+            key: A hashable key of the lookup, concurrent calls with the same key are merged
+            fn (callable): The function performing the provider call
+            deadline (float): Seconds the caller is willing to wait, defaults to the scheduler's
+
+        Returns:
+            The result of fn
+
+        Raises:
+            GeocodeTimeout: If the call could not be completed within the deadline
+        '''
+        timeout = self.deadline if deadline is None else deadline
+        expires_at = time.time() + timeout
+
+        def call():
+            self.bucket.acquire(expires_at)
+            return fn()
+
+        try:
+            return self.flights.do(key, call, timeout=timeout)
+        except TimeoutError:
+            raise GeocodeTimeout("Timed out waiting for geocoding result")
+
+    def stats(self):
+        '''
+        Gets the scheduler counters
+
+        Returns:
+            dict: The coalescing counters of the scheduler
+        '''
+        return self.flights.stats()
+
+def scheduler_from_env():
+    '''
+    Builds a GeocodeScheduler configured from the GEOCODER_* environment variables
+
+    Returns:
+        GeocodeScheduler: The configured scheduler
+    '''
+    path = os.getenv('GEOCODER_RATE_FILE', os.path.join(tempfile.gettempdir(), 'foodcircle-geocoder.bucket'))
+    bucket = TokenBucket(
+        rate=float(os.getenv('GEOCODER_RATE', '1')),
+        burst=float(os.getenv('GEOCODER_BURST', '1')),
+        path=path or None)
+    return GeocodeScheduler(bucket, deadline=float(os.getenv('GEOCODER_DEADLINE', '10')))
@@ -0,0 +1,194 @@
+import os
+import time
+import json
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from logs import get_logger
+
+log = get_logger('geocache')
+
+_GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Returned by GeoCache.get when the key is not cached (None is a valid cached value)
+MISS = object()
+
+def geohash_encode(lat, lon, precision=5):
+    '''
+    Encodes a latitude and longitude into a geohash string
+
+    Args:
+        lat (float): The latitude to be encoded
+        lon (float): The longitude to be encoded
+        precision (int): The number of characters of the geohash (5 ~ 4.9km, 7 ~ 150m)
+
+    Returns:
+        str: The geohash of the given point
+    '''
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits = bits << 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(_GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+def normalize_address(address):
+    '''
+    Normalizes an address so that trivially different spellings share a cache entry
+
+    Args:
+        address (str): The address to be normalized
+
+    Returns:
+        str: The lowercased address with collapsed whitespace
+    '''
+    return ' '.join(str(address).lower().replace(',', ' , ').split())
+
+class GeoCache:
+    '''
+    In-process LRU cache with TTL for geocoding results, backed by a SQLite file
+    so that restarted workers start warm.
+
+    Keys are (kind, key) pairs, e.g. ('city', '9q8yy') or ('latlon', '1 market st').
+    '''
+
+    def __init__(self, path=None, max_entries=10000, ttl=7*24*3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            try:
+                self._conn = sqlite3.connect(path, check_same_thread=False)
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS geocache ('
+                    'kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT, stored_at REAL NOT NULL, '
+                    'PRIMARY KEY (kind, key))')
+                self._conn.commit()
+            except sqlite3.Error as e:
+                log.warning('geocache_disk_disabled', path=path, error=str(e))
+                self._conn = None
+
+    def get(self, kind, key):
+        '''
+        Gets a cached value
+
+        Args:
+            kind (str): The kind of lookup ('city', 'address', 'latlon')
+            key (str): The snapped/normalized key of the lookup
+
+        Returns:
+            The cached value, or MISS if it is not cached or expired
+        '''
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is not None:
+                value, stored_at = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end((kind, key))
+                    self.hits += 1
+                    return value
+                del self._entries[(kind, key)]
+            if self._conn is not None:
+                row = self._conn.execute(
+                    'SELECT value, stored_at FROM geocache WHERE kind = ? AND key = ?',
+                    (kind, key)).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    value = json.loads(row[0])
+                    if isinstance(value, list):
+                        value = tuple(value)
+                    self._remember(kind, key, value, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return MISS
+
+    def set(self, kind, key, value):
+        '''
+        Stores a value in memory and on disk
+
+        Args:
+            kind (str): The kind of lookup ('city', 'address', 'latlon')
+            key (str): The snapped/normalized key of the lookup
+            value: A JSON-serializable result (None is allowed)
+        '''
+        now = time.time()
+        with self._lock:
+            self._remember(kind, key, value, now)
+            if self._conn is not None:
+                try:
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO geocache (kind, key, value, stored_at) VALUES (?, ?, ?, ?)',
+                        (kind, key, json.dumps(value), now))
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    log.warning('geocache_disk_write_failed', error=str(e))
+
+    def _remember(self, kind, key, value, stored_at):
+        self._entries[(kind, key)] = (value, stored_at)
+        self._entries.move_to_end((kind, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        '''
+        Drops every cached entry, in memory and on disk
+        '''
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute('DELETE FROM geocache')
+                self._conn.commit()
+
+    def stats(self):
+        '''
+        Gets the hit/miss counters of the cache
+
+        Returns:
+            dict: hits, misses, disk_hits, hit_ratio and the number of in-memory entries
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries)
+            }
+
+def cache_from_env():
+    '''
+    Builds a GeoCache configured from the GEOCACHE_* environment variables
+
+    Returns:
+        GeoCache: The configured cache (disk store disabled when GEOCACHE_PATH is empty)
+    '''
+    path = os.getenv('GEOCACHE_PATH', os.path.join(tempfile.gettempdir(), 'foodcircle-geocache.sqlite3'))
+    return GeoCache(
+        path=path or None,
+        max_entries=int(os.getenv('GEOCACHE_MAX_ENTRIES', '10000')),
+        ttl=float(os.getenv('GEOCACHE_TTL', str(7*24*3600))))
@@ -0,0 +1,15 @@
+import os
+
+# With GUNICORN_PRELOAD=1 the master imports main.py once and forks the workers
+# from it. Clients are cached per process (clients.per_process), so every worker
+# builds its own Firestore/geocoder/HTTP clients right after the fork.
+preload_app = os.getenv('GUNICORN_PRELOAD', '0') == '1'
+
+# Each open /city-events stream holds a thread for a few seconds (CITY_EVENTS_MAX_AGE), and at most
+# CITY_EVENTS_MAX_SUBSCRIBERS of them are open per worker. More than one thread selects the gthread worker
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+def post_fork(server, worker):
+    if preload_app:
+        from main import warm_clients
+        warm_clients()
@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import random
+import logging
+import contextvars
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+ROOT = 'foodie'
+
+# (request_id, route, sampled) of the request being served by this thread, None outside requests
+_request = contextvars.ContextVar('log_request', default=None)
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Formats a record as one line of JSON: ts, level, logger, event, the
+    request_id and route of the request it was logged in and its fields.
+
+    Field values are serialized here, when the record is emitted, and a
+    callable value is called first, so expensive values cost nothing for
+    events that are filtered out.
+    '''
+
+    def format(self, record):
+        entry = {
+            'ts': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage()
+        }
+        ctx = getattr(record, 'request', None)
+        if ctx is not None:
+            entry['request_id'] = ctx[0]
+            entry['route'] = ctx[1]
+        for key, value in getattr(record, 'fields', {}).items():
+            entry[key] = value() if callable(value) else value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+class EventLogger:
+    '''
+    Logs named events with keyword fields, e.g. log.debug('order_priced', eid=eid)
+
+    Events below WARNING are only logged for sampled requests (see
+    start_request), warnings and errors are always logged. A disabled event
+    returns after the level check, before any record is built.
+    '''
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def enabled(self, level):
+        '''
+        Checks whether events of a level would be logged in the current request
+
+        Args:
+            level (int): The level
+
+        Returns:
+            bool: True if they would be logged
+        '''
+        if not self.logger.isEnabledFor(level):
+            return False
+        ctx = _request.get()
+        return level >= WARNING or ctx is None or ctx[2]
+
+    def log(self, level, event, exc_info=False, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        ctx = _request.get()
+        if level < WARNING and ctx is not None and not ctx[2]:
+            return
+        self.logger.log(level, event, exc_info=exc_info, extra={'fields': fields, 'request': ctx})
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+    def exception(self, event, **fields):
+        # To be called from an except block, logs the traceback
+        self.log(ERROR, event, exc_info=True, **fields)
+
+def get_logger(name):
+    '''
+    Gets the event logger of a module
+
+    Args:
+        name (str): The module name, e.g. 'api'
+
+    Returns:
+        EventLogger: The logger, named foodie.<name>
+    '''
+    return EventLogger(ROOT + '.' + name)
+
+def parse_sample_rates(value):
+    '''
+    Parses per-route sample rates
+
+    Args:
+        value (str): Comma separated route=rate pairs, e.g. "/get-est-by-city=0.01,/submit-order=1"
+
+    Returns:
+        dict: The rate (0 to 1) of each route
+
+    Raises:
+        ValueError: If a pair is malformed or a rate is not a number between 0 and 1
+    '''
+    rates = {}
+    for pair in filter(None, (p.strip() for p in (value or '').split(','))):
+        route, sep, rate = pair.rpartition('=')
+        if not sep or not route:
+            raise ValueError("Invalid sample rate: {}".format(pair))
+        rate = float(rate)
+        if not 0 <= rate <= 1:
+            raise ValueError("Sample rate of {} must be between 0 and 1".format(route))
+        rates[route.strip()] = rate
+    return rates
+
+class RequestSampler:
+    '''
+    Decides per request whether its info/debug events are logged
+    '''
+
+    def __init__(self, rates=None, default=1.0):
+        self.rates = rates or {}
+        self.default = default
+
+    def sampled(self, route):
+        rate = self.rates.get(route, self.default)
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+def sampler_from_env():
+    '''
+    Builds the request sampler from LOG_SAMPLE_RATES and LOG_SAMPLE_DEFAULT
+
+    Returns:
+        RequestSampler: The sampler
+    '''
+    return RequestSampler(parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', '')),
+                          float(os.getenv('LOG_SAMPLE_DEFAULT', '1')))
+
+def start_request(request_id, route, sampled):
+    '''
+    Tags the events logged by the current thread with a request until end_request
+
+    Args:
+        request_id (str): The id correlating the events of the request
+        route (str): The route rule being served
+        sampled (bool): Whether info/debug events of the request are logged
+
+    Returns:
+        Token: The token to be passed to end_request
+    '''
+    return _request.set((request_id, route, sampled))
+
+def end_request(token):
+    _request.reset(token)
+
+def configure(level=None, stream=None):
+    '''
+    Sends the events of every foodie.* logger as JSON lines to a stream,
+    replacing the handlers of a previous call
+
+    Args:
+        level (str): The minimum level, LOG_LEVEL (default INFO) if None
+        stream: The stream, stderr if None
+    '''
+    root = logging.getLogger(ROOT)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    root.addHandler(handler)
+    root.setLevel((level or os.getenv('LOG_LEVEL', 'INFO')).upper())
+    root.propagate = False
@@ -4,25 +4,131 @@ import math
 import string
 import random
 import json
+import base64
+import hashlib
+import uuid
+import contextvars
 import requests as rq
-from flask import Flask, jsonify, request, render_template, send_from_directory
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, Flask, current_app, g, jsonify, make_response, request, render_template, send_from_directory
 from flask_cors import CORS, cross_origin
 from dotenv import load_dotenv
-from firebase_admin import credentials, firestore, initialize_app
+from geopy.exc import GeopyError
 from geopy.geocoders import Nominatim
+from geocache import MISS, cache_from_env, geohash_encode, normalize_address
+from reverse_geocoder import resolver_from_env
+from geo_scheduler import GeocodeTimeout, scheduler_from_env
+from circles import CircleRegistry
+from storage import SALES_VERSION, OrdersNotWritten, project, sales_day, storage_from_env
+from clients import per_process
+from pricing import PriceTableCache, price_cart
+from est_cache import EstablishmentCache
+from menus import MenuCache, menu_ref
+from users import UserCache
+from timeline import build_timeline
+from events import EventBus, TooManySubscribers
+from singleflight import CoalescingCache
+from spatial import RADIUS_SLACK, GridIndex, distance_miles, within_radius_mask
+import logs
+import metrics
+import tracing
 load_dotenv()
 
-# Set up Firebase creds & Firestore db
-cred = credentials.Certificate('firebase.json')
-default_app = initialize_app(cred)
-db = firestore.client()
-
 GMAPKEY = os.getenv('GMAP')
 
-# Load Vue.js 3 build
-app = Flask(__name__, static_url_path='', static_folder='frontend/dist')
-cors = CORS(app)
-app.config['CORS_HEADERS'] = 'Content-Type'
+log = logs.get_logger('api')
+
+# Fields of establishments returned by list endpoints, menus are served by /est-menu/<eid>
+LIST_FIELDS = ['eid', 'uid', 'name', 'cid', 'lat', 'lon', 'address', 'description', 'keywords', 'promo', 'e_pic_url']
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_TIMELINE_FRAMES = 1000
+MAX_BULK_ORDERS = 500
+
+# Default menu + promotion just to relax the constraints for the hackathon
+DEFAULT_MENU = [ { "id": "1", "name": "Special Halloween Burger", "price": 10.00, "description": "Includes a special 200g Beef patty with tangy BBQ sauce and smoky bacon.", "category": "Specials", "rating": 5, "img": "/assets/burger1.png", }, { "id": "2", "name": "Mega Ghost Tower Burger", "price": 8.00, "description": "Includes smoked beef brisket with a special ghost pepper sauce.", "category": "Specials", "rating": 4.5, "img": "/assets/burger2.png", }, { "id": "3", "name": "Jr. Burger", "price": 6.00, "description": "Includes a 100g beef patty topped with cheese and no sauce.", "category": "Burgers", "rating": 4.5, "img": "/assets/burger3.png", }, { "id": "4", "name": "Spooky Combo", "price": 13.00, "description": "Special Combo of Burger, Fries, drink, and a dessert.", "category": "Specials", "rating": 4.5, "img": "/assets/burger4.png", }, { "id": "5", "name": "Sushi Combo 1", "price": 15.00, "description": "Includes variety of sushi, sashimi, and special rolls.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo1.png", }, { "id": "6", "name": "Sushi Combo 2", "price": 15.00, "description": "Fresh fish bowled with special sauce and served with rice.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo2.png", }, { "id": "7", "name": "Sushi Combo 3", "price": 15.00, "description": "Includes variety of sushi, sashimi, and special rolls.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo3.png", }, { "id": "8", "name": "Curry Chicken Combo", "price": 12.00, "description": "Combo of butter chicken with naan, rice, and curry. Mildly spicy.", "category": "Platters", "rating": 4.5, "img": "/assets/yummyfoods1.png", }, { "id": "9", "name": "Chicken Tikka Masala", "price": 12.00, "description": "Chicken tikka masala with naan, rice, and curry. Mildly spicy.", "category": "Platters", "rating": 4.5, "img": "/assets/yummyfoods4.png", }, { "id": "10", "name": "Ceasar Salad", "price": 8.00, "description": "Fresh romaine lettuce with ceasar dressing and croutons.", "category": "Salads", "rating": 4.5, "img": "/assets/salad1.png", }, { "id": "11", "name": "Greek Salad", "price": 8.00, "description": "Chopped romaine lettuce with feta cheese, olives, and tomatoes.", "category": "Salads", "rating": 4.5, "img": "/assets/salad2.png", }, { "id": "12", "name": "Sweetness Paradise", "price": 5.00, "description": "Includes a small pudding packed with Amarula cream and liquor.", "category": "Desserts", "rating": 4.5, "img": "/assets/dessert3.png", } ]
+DEFAULT_PROMO = ["5% OFF", "Free Beverage", "10% OFF", "Free Dessert", "Free Entree"]
+
+CITY_GEOHASH_PRECISION = int(os.getenv('GEOCACHE_CITY_PRECISION', '5'))
+ADDRESS_GEOHASH_PRECISION = int(os.getenv('GEOCACHE_ADDRESS_PRECISION', '7'))
+
+# Clients are built on first use and cached per process (see clients.per_process),
+# so importing this module does not connect to Firebase or open any file
+@per_process
+def get_store():
+    # Storage backend, Firestore by default (see STORAGE_BACKEND), metered per route and traced
+    return metrics.MeteredStorage(tracing.TracedStorage(storage_from_env()))
+
+@per_process
+def get_geo_cache():
+    # Geocoding cache, coordinates are snapped to a geohash cell before lookups
+    return cache_from_env()
+
+@per_process
+def get_local_geocoder():
+    # Offline city resolver (GEOCODER_BACKEND=local), Nominatim is the fallback
+    return resolver_from_env()
+
+@per_process
+def get_geolocator():
+    return Nominatim(user_agent="foodie")
+
+@per_process
+def get_geo_scheduler():
+    # Nominatim calls share one rate budget across workers (GEOCODER_RATE per second)
+    return scheduler_from_env()
+
+@per_process
+def get_http_session():
+    return rq.Session()
+
+@per_process
+def get_price_tables():
+    # Compiled id -> price tables, orders are priced without reading the establishment
+    return PriceTableCache(get_menu_items_from_establishment, ttl=float(os.getenv('PRICE_TABLE_TTL', '300')))
+
+@per_process
+def get_est_cache():
+    # Establishments by eid (and by uid/cid), kept fresh by this process' writes
+    # and by a Firestore listener for writes made by other workers
+    cache = EstablishmentCache(max_entries=int(os.getenv('EST_CACHE_MAX_ENTRIES', '5000')))
+    cache.add_listener(get_price_tables().invalidate)
+    if os.getenv('EST_CACHE_WATCH', '1') == '1':
+        cache.watch = get_store().watch_establishments(cache.on_snapshot, time.time())
+    return cache
+
+@per_process
+def get_menu_cache():
+    # Menus by content hash, shared by every establishment with the same menu
+    return MenuCache(get_store().get_menu, max_entries=int(os.getenv('MENU_CACHE_MAX_ENTRIES', '1000')))
+
+@per_process
+def get_user_cache():
+    # Users by uid and email, /login of a returning user is served from memory
+    return UserCache(ttl=float(os.getenv('USER_CACHE_TTL', '60')),
+                     max_entries=int(os.getenv('USER_CACHE_MAX_ENTRIES', '10000')))
+
+@per_process
+def get_city_snapshots():
+    # Concurrent /get-est-by-city calls for a city share one read of its establishments and orders
+    return CoalescingCache(ttl=float(os.getenv('CITY_SNAPSHOT_TTL', '1')))
+
+@per_process
+def get_job_executor():
+    # Background jobs that should not hold up the request (e.g. populate_db)
+    return ThreadPoolExecutor(max_workers=int(os.getenv('JOB_WORKERS', '2')))
+
+@per_process
+def get_tracer():
+    # Chrome traces of sampled and slow requests (TRACE_SAMPLE_RATE, TRACE_SLOW_MS)
+    return tracing.tracer_from_env()
+
+@per_process
+def get_log_sampler():
+    # Share of requests per route whose info/debug events are logged (LOG_SAMPLE_RATES)
+    return logs.sampler_from_env()
+
+routes = Blueprint('api', __name__)
 
 def gen_random_str(str_len=8):
     '''
@@ -78,13 +184,30 @@ def create_establishment(name, menu_obj, city_id, lat, lon, add, desc, keywords,
     # if not isinstance(e_pic_url, str):
     #     raise ValueError("e_pic_url must be a string.")
 
-    est_ref = db.collection('establishments')
-    est_id = gen_random_str()
-    est_ref.document(est_id).set({
-        'eid': est_id,
+    save_menu(menu_obj)
+    est = build_establishment(name, menu_obj, city_id, lat, lon, add, desc, keywords, e_pic_url, uid, promo_obj)
+    get_store().put_establishment(est)
+    get_est_cache().put(est)
+    get_city_snapshots().invalidate(est['cid'])
+    return est['eid']
+
+def build_establishment(name, menu_obj, city_id, lat, lon, add, desc, keywords, e_pic_url, uid, promo_obj, est_id=None):
+    '''
+    Builds the document of a new establishment without writing it. The document
+    only holds a reference to the menu, which is written by save_menu
+
+    Args:
+        (same as create_establishment)
+        est_id (str): The id of the establishment, a random one if None
+
+    Returns:
+        dict: The establishment document
+    '''
+    return {
+        'eid': est_id or gen_random_str(),
         'uid': uid,
         'name': name,
-        'menu': menu_obj,
+        'menu_ref': menu_ref(menu_obj),
         'promo': promo_obj,
         'cid': city_id.lower(),
         'lat': lat,
@@ -93,9 +216,9 @@ def create_establishment(name, menu_obj, city_id, lat, lon, add, desc, keywords,
         'description': desc,
         'keywords': keywords,
         'e_pic_url': e_pic_url,
-        'created_at': time.time()
-    })
-    return est_id
+        'created_at': time.time(),
+        'updated_at': time.time()
+    }
 
 def get_establishment(est_id):
     '''
@@ -113,9 +236,59 @@ def get_establishment(est_id):
     # if not isinstance(est_id, str):
     #     raise ValueError("est_id must be a string.")
 
-    est_ref = db.collection('establishments').document(est_id)
-    est = est_ref.get()
-    return est.to_dict()
+    cache = get_est_cache()
+    est = cache.get(est_id)
+    if est is None:
+        generation = cache.generation()
+        est = get_store().get_establishment(est_id)
+        if est:
+            cache.fill(est, generation)
+    return est
+
+def save_menu(menu_obj):
+    '''
+    Stores a menu once under its content hash, establishments with the same menu share it
+
+    Args:
+        menu_obj (list): The menu items
+
+    Returns:
+        str: The reference of the menu
+    '''
+    ref = menu_ref(menu_obj)
+    cache = get_menu_cache()
+    # Refs this process already wrote or read are known to be stored
+    if ref not in cache:
+        get_store().put_menu(ref, menu_obj)
+        cache.add(ref, menu_obj)
+    return ref
+
+def resolve_menu(est):
+    '''
+    Gets the menu items of an establishment document
+
+    Args:
+        est (dict): The establishment
+
+    Returns:
+        list: A list of all menu item objects, or None if the menu is missing
+    '''
+    if est.get('menu') is not None:
+        return est['menu']  # Written before menus were shared
+    ref = est.get('menu_ref')
+    return get_menu_cache().get(ref) if ref else None
+
+def with_menu(est):
+    '''
+    Gets a copy of an establishment with its menu items, for responses with full documents
+
+    Args:
+        est (dict): The establishment
+
+    Returns:
+        dict: The establishment with a 'menu' field
+    '''
+    return dict(est, menu=resolve_menu(est))
 
 def get_menu_items_from_establishment(est_id):
     '''
@@ -133,11 +306,10 @@ def get_menu_items_from_establishment(est_id):
     # if not isinstance(est_id, str):
     #     raise ValueError("est_id must be a string.")
 
-    est_ref = db.collection('establishments').document(est_id)
-    est = est_ref.get()
-    if not est.exists:
+    est = get_establishment(est_id)
+    if not est:
         return None
-    return est.to_dict()['menu']
+    return resolve_menu(est)
 
 def update_menu_items_from_establishment(est_id, menu_obj):
     '''
@@ -158,12 +330,7 @@ def update_menu_items_from_establishment(est_id, menu_obj):
     # if not isinstance(menu_obj, dict):
     #     raise ValueError("menu_obj must be a dictionary.")
 
-    est_ref = db.collection('establishments').document(est_id)
-    est = est_ref.get()
-    if not est.exists:
-        return None
-    est_ref.update({'menu': menu_obj})
-    return est_ref.get().to_dict()
+    return apply_establishment_changes(est_id, {'menu': menu_obj})
 
 def update_establishment(est_id, changes):
     '''
@@ -187,12 +354,37 @@ def update_establishment(est_id, changes):
     if not any(field in changes for field in ['name', 'menu', 'city_id', 'lat', 'lon', 'address', 'e_pic_url']):
         raise KeyError(
             "changes must contain at least one of the following fields: name, menu, city_id, lat, lon, address, e_pic_url")
-    est_ref = db.collection('establishments').document(est_id)
-    est = est_ref.get()
-    if not est.exists:
+    return apply_establishment_changes(est_id, changes)
+
+def apply_establishment_changes(est_id, changes):
+    '''
+    Writes changes to an establishment and returns the merged document without reading it back
+
+    Args:
+        est_id (str): The id of the establishment to be updated
+        changes (dict): The top-level fields to be replaced, a 'menu' is stored with save_menu
+
+    Returns:
+        dict: The dictionary of the updated establishment, or None if it does not exist
+    '''
+    current = get_establishment(est_id)
+    if not current:
+        return None
+    changes = dict(changes, updated_at=time.time())
+    if 'menu' in changes:
+        changes['menu_ref'] = save_menu(changes.pop('menu'))
+        if current.get('menu') is not None:
+            changes['menu'] = None  # Drop the inline copy of older documents
+    if not get_store().update_establishment(est_id, changes):
+        get_est_cache().invalidate(est_id)
+        get_city_snapshots().invalidate(current.get('cid'))
         return None
-    est_ref.update(changes)
-    return est_ref.get().to_dict()
+    old_cid = current.get('cid')
+    current.update(changes)
+    get_est_cache().put(current)
+    for cid in {old_cid, current.get('cid')}:
+        get_city_snapshots().invalidate(cid)
+    return current
 
 def delete_establishment(est_id):
     '''
@@ -210,30 +402,107 @@ def delete_establishment(est_id):
     # if not isinstance(est_id, str):
     #     raise ValueError("est_id must be a string.")
 
-    est_ref = db.collection('establishments').document(est_id)
-    est_ref.delete()
+    est = get_establishment(est_id)
+    # Touch updated_at first so other workers' listeners see the deletion
+    get_store().update_establishment(est_id, {'updated_at': time.time()})
+    get_store().delete_establishment(est_id)
+    get_est_cache().remove(est_id)
+    if est:
+        get_city_snapshots().invalidate(est.get('cid'))
     return est_id
 
-def get_all_establishments():
+def get_all_establishments(fields=None):
     '''
     Gets all establishments from the database
 
     Args:
-        None
+        fields (list): The fields to be returned of each establishment, all if None
 
     Returns:
         list: A list of all establishment objects
     '''
-    est_ref = db.collection('establishments')
-    ests = est_ref.stream()
-    return [est.to_dict() for est in ests]
+    return get_store().all_establishments(fields)
+
+def encode_cursor(eid):
+    '''
+    Encodes the position after an establishment into an opaque page cursor
+
+    Args:
+        eid (str): The id of the last establishment of a page
+
+    Returns:
+        str: The cursor of the next page
+    '''
+    return base64.urlsafe_b64encode(json.dumps({'after': eid}).encode()).decode()
 
-def get_establishments_by_city(city_id):
+def decode_cursor(cursor):
+    '''
+    Decodes a page cursor made by encode_cursor
+
+    Args:
+        cursor (str): The cursor
+
+    Returns:
+        str: The id of the establishment the page starts after
+
+    Raises:
+        ValueError: If the cursor is not valid
+    '''
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode())).get('after')
+    except (ValueError, AttributeError):
+        after = None
+    if not isinstance(after, str):
+        raise ValueError("Invalid cursor.")
+    return after
+
+def get_establishments_page(page_size=DEFAULT_PAGE_SIZE, cursor=None, fields=None):
+    '''
+    Gets a page of all establishments, ordered by eid
+
+    Args:
+        page_size (int): The number of establishments per page, at most MAX_PAGE_SIZE
+        cursor (str): The cursor returned with the previous page, None for the first page
+        fields (list): The fields to be returned of each establishment, all if None
+
+    Returns:
+        tuple: The establishments of the page and the cursor of the next one (None on the last page)
+
+    Raises:
+        ValueError: If the page size or the cursor are not valid
+    '''
+    if not isinstance(page_size, int) or not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError("page_size must be an integer between 1 and {}.".format(MAX_PAGE_SIZE))
+    after = decode_cursor(cursor) if cursor else None
+    # One more than asked tells if there is a next page without another query
+    ests = get_store().establishments_page(page_size + 1, after, fields)
+    if len(ests) <= page_size:
+        return ests, None
+    ests = ests[:page_size]
+    return ests, encode_cursor(ests[-1]['eid'])
+
+def stream_json_array(items):
+    '''
+    Serializes items into a JSON array piece by piece, for streamed responses
+
+    Args:
+        items (iterable): The JSON serializable items
+
+    Yields:
+        str: The parts of the array
+    '''
+    yield '['
+    for i, item in enumerate(items):
+        yield (',' if i else '') + json.dumps(item, separators=(',', ':'))
+    yield ']'
+
+def get_establishments_by_city(city_id, fields=None):
     '''
     Gets all establishments with city_id from the database
 
     Args:
         city_id (int): The id of the city to get establishments from
+        fields (list): The fields to be returned of each establishment, all if None
 
     Returns:
         list: A list of all establishment objects in the given city
@@ -244,9 +513,19 @@ def get_establishments_by_city(city_id):
     # if not isinstance(city_id, int):
     #     raise ValueError("city_id must be an integer.")
 
-    est_ref = db.collection('establishments')
-    ests = est_ref.where('cid', '==', city_id.lower()).stream()
-    return [est.to_dict() for est in ests]
+    cid = city_id.lower()
+    cache = get_est_cache()
+    ests = cache.get_by('cid', cid)
+    if ests is None:
+        if fields and not cache.max_entries:
+            # Nothing to warm, only fetch the fields that are needed
+            return get_store().establishments_by_city(cid, fields)
+        generation = cache.generation()
+        ests = get_store().establishments_by_city(cid)
+        cache.fill_by('cid', cid, ests, generation)
+    if fields:
+        ests = [project(est, fields) for est in ests]
+    return ests
 
 def get_establishment_by_uid(uid):
     '''
@@ -264,9 +543,34 @@ def get_establishment_by_uid(uid):
     # if not isinstance(uid, str):
     #     raise ValueError("uid must be a string.")
 
-    est_ref = db.collection('establishments')
-    ests = est_ref.where('uid', '==', uid).stream()
-    return [est.to_dict() for est in ests]
+    cache = get_est_cache()
+    ests = cache.get_by('uid', uid)
+    if ests is None:
+        generation = cache.generation()
+        ests = get_store().establishments_by_uid(uid)
+        cache.fill_by('uid', uid, ests, generation)
+    return ests
+
+def nominatim_call(method, query):
+    '''
+    Calls Nominatim, recording the duration of the call
+
+    Args:
+        method (str): 'reverse' or 'geocode'
+        query (str): The "lat, lon" or the address
+
+    Returns:
+        Location: The result of the geolocator
+    '''
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        with tracing.span('nominatim.' + method, 'geocoder'):
+            location = getattr(get_geolocator(), method)(query)
+        outcome = 'ok'
+        return location
+    finally:
+        metrics.GEOCODER_SECONDS.observe(time.perf_counter() - start, 'nominatim', outcome)
 
 # Google maps api get address from lat/lon
 def gmaps_get_address(lat, lon):
@@ -290,8 +594,17 @@ def gmaps_get_address(lat, lon):
 
     url = "https://maps.googleapis.com/maps/api/geocode/json?latlng={},{}&key={}".format(
         lat, lon, GMAPKEY)
-    response = rq.get(url)
-    if response.status_code != 200:
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        with tracing.span('gmaps.geocode', 'geocoder'):
+            response = get_http_session().get(url)
+        # Errors such as REQUEST_DENIED or OVER_QUERY_LIMIT come back as 200 with a status
+        if response.status_code == 200 and response.json().get('status') == 'OK':
+            outcome = 'ok'
+    finally:
+        metrics.GEOCODER_SECONDS.observe(time.perf_counter() - start, 'gmaps', outcome)
+    if outcome != 'ok':
         return None
     return response.json()['results'][0]['formatted_address']
 
@@ -313,14 +626,25 @@ def lat_lon_to_city_name(lat, lon):
     #     raise ValueError("latitude must be a float.")
     # if not isinstance(lon, float):
     #     raise ValueError("longitude must be a float.")
-    time.sleep(1)
-    geolocator = Nominatim(user_agent="foodie")
-    location = geolocator.reverse("{}, {}".format(lat, lon))
-    print(location)
+    local_geocoder = get_local_geocoder()
+    if local_geocoder:
+        city_name = local_geocoder.city_name(lat, lon)
+        if city_name:
+            return city_name
+    cell = geohash_encode(lat, lon, CITY_GEOHASH_PRECISION)
+    city_name = get_geo_cache().get('city', cell)
+    if city_name is not MISS:
+        return city_name
+    with tracing.span('geocode', 'geocoder', kind='city'):
+        location = get_geo_scheduler().run(
+            ('city', cell), lambda: nominatim_call('reverse', "{}, {}".format(lat, lon)))
+    log.debug('reverse_geocoded', kind='city', cell=cell, location=location)
     try:
-        return location.raw['address']['city'].lower()
+        city_name = location.raw['address']['city'].lower()
     except KeyError:
-        return None
+        city_name = None
+    get_geo_cache().set('city', cell, city_name)
+    return city_name
 
 def lat_lon_to_address(lat, lon):
     '''
@@ -340,14 +664,20 @@ def lat_lon_to_address(lat, lon):
     #     raise ValueError("latitude must be a float.")
     # if not isinstance(lon, float):
     #     raise ValueError("longitude must be a float.")
-    time.sleep(1)
-    geolocator = Nominatim(user_agent="foodie")
-    location = geolocator.reverse("{}, {}".format(lat, lon))
-    print(location)
+    cell = geohash_encode(lat, lon, ADDRESS_GEOHASH_PRECISION)
+    address = get_geo_cache().get('address', cell)
+    if address is not MISS:
+        return address
+    with tracing.span('geocode', 'geocoder', kind='address'):
+        location = get_geo_scheduler().run(
+            ('address', cell), lambda: nominatim_call('reverse', "{}, {}".format(lat, lon)))
+    log.debug('reverse_geocoded', kind='address', cell=cell, location=location)
     try:
-        return location.raw['address']['road'].lower()
+        address = location.raw['address']['road'].lower()
     except KeyError:
-        return None
+        address = None
+    get_geo_cache().set('address', cell, address)
+    return address
 
 def create_city(city_name):
     '''
@@ -366,18 +696,17 @@ def create_city(city_name):
     #     raise ValueError("city_name must be a string.")
 
     city_name = city_name.lower()
-    city_ref = db.collection('cities')
-    city = city_ref.document(city_name).get()
+    city = get_store().get_city(city_name)
 
-    if city.exists:
-        return city.to_dict()
+    if city:
+        return city
 
     city_obj = {
         'cid': city_name,
         'ref': gen_random_str(5),
         'created_at': time.time()
     }
-    city_ref.document(city_name).set(city_obj)
+    get_store().put_city(city_obj)
     return city_obj
 
 def address_to_lat_lon(address):
@@ -395,10 +724,15 @@ def address_to_lat_lon(address):
     '''
     # if not isinstance(address, str):
     #     raise ValueError("address must be a string.")
-    time.sleep(1)
-    geolocator = Nominatim(user_agent="foodie")
-    location = geolocator.geocode(address)
-    return (location.latitude, location.longitude)
+    key = normalize_address(address)
+    lat_lon = get_geo_cache().get('latlon', key)
+    if lat_lon is not MISS:
+        return lat_lon
+    with tracing.span('geocode', 'geocoder', kind='latlon'):
+        location = get_geo_scheduler().run(('latlon', key), lambda: nominatim_call('geocode', address))
+    lat_lon = (location.latitude, location.longitude)
+    get_geo_cache().set('latlon', key, lat_lon)
+    return lat_lon
 
 def calculate_order_total(order_obj, eid):
     '''
@@ -412,27 +746,40 @@ def calculate_order_total(order_obj, eid):
         float: The total price of the order
 
     Raises:
-        ValueError: If any of the arguments are not of the correct type
+        ValueError: If the establishment does not exist
     '''
     # if not isinstance(order_obj, dict):
     #     raise ValueError("order_obj must be a dictionary.")
     # if not isinstance(eid, str):
     #     raise ValueError("eid must be a string.")
-    print(order_obj)
-    print(eid)
-    est = get_establishment(eid)
-    menu = est['menu']
-    print(menu)
-    total = 0
-    for pid in order_obj:
-        menu_item = menu[int(pid)-1]
-        if not menu_item:
-            continue
-        total += menu_item['price'] * order_obj[pid]  # price * quantity
-    return total
+    log.debug('order_priced', eid=eid, items=order_obj)
+    prices = get_price_tables().get(eid)
+    if prices is None:
+        raise ValueError("Establishment not found.")
+    return price_cart(prices, order_obj)
+
+def calculate_order_totals(carts):
+    '''
+    Calculates the total price of many orders, compiling each establishment's prices once
+
+    Args:
+        carts (list): A list of {'eid': str, 'items': dict} orders
+
+    Returns:
+        list: A list of {'eid', 'total'} or {'eid', 'message'} dicts in the order of carts
+    '''
+    results = []
+    for cart in carts:
+        eid = cart.get('eid')
+        try:
+            total = round(calculate_order_total(cart.get('items') or {}, eid), 2)
+            results.append({'eid': eid, 'total': total})
+        except (ValueError, TypeError) as e:
+            results.append({'eid': eid, 'message': str(e)})
+    return results
 
 #order_id = create_order(items, total, eid, uid, lat, lon, cid, 'pending')
-def create_order(order_obj, total, est_id, uid, lat, lon, cid, status, ts_group=None):
+def create_order(order_obj, total, est_id, uid, lat, lon, cid, status, ts_group=None, created_at=None):
     '''
     Creates an order in the database
 
@@ -444,6 +791,8 @@ def create_order(order_obj, total, est_id, uid, lat, lon, cid, status, ts_group=
         lon (float): The longitude of the user
         cid (str): The id of the city the order is in
         ts_group (str): The timestamp group the order is in
+        created_at (float): The time the order was assigned to its circle, defaults to now. The
+            order opening a circle is created at its ts_group (see storage.opens_circle)
 
     Returns:
         str: The id of the newly created order
@@ -466,9 +815,8 @@ def create_order(order_obj, total, est_id, uid, lat, lon, cid, status, ts_group=
     # if not isinstance(ts_group, str):
     #     raise ValueError("ts_group must be a string.")
 
-    order_ref = db.collection('orders')
-    order_id = order_ref.document().id
-    order_ref.document(order_id).set({
+    order_id = get_store().new_order_id()
+    get_store().put_order({
         'oid': order_id,
         'eid': est_id,
         'total': total,
@@ -479,36 +827,212 @@ def create_order(order_obj, total, est_id, uid, lat, lon, cid, status, ts_group=
         'status': status,
         'ts_group': ts_group,
         'order_obj': order_obj,
-        'created_at': time.time()
+        'created_at': time.time() if created_at is None else created_at
     })
     return order_id
 
+def create_orders(orders):
+    '''
+    Creates many orders at once: each distinct city (geohash cell) and establishment
+    price table is resolved once, the orders are assigned to circles in the order
+    given (so they can join circles opened earlier in the same batch) and written
+    in batches. Orders whose write failed are taken out of their circles again and
+    get a message instead of an order_id
+
+    Args:
+        orders (list): A list of {'eid', 'uid', 'items', 'lat', 'lon'} orders
+
+    Returns:
+        list: A {'order_id', 'ts_group', 'total'} or {'message'} result per order, in the order of orders
+    '''
+    results = [None] * len(orders)
+    valid = []
+    for i, order in enumerate(orders):
+        try:
+            if not isinstance(order, dict) or not order.get('eid') or not isinstance(order.get('items'), dict):
+                raise ValueError("order must have an eid and items")
+            valid.append((i, order, float(order.get('lat')), float(order.get('lon'))))
+        except (ValueError, TypeError) as e:
+            results[i] = {'message': str(e)}
+
+    cities = {}
+    prices = {}
+    docs = []
+    for i, order, lat, lon in valid:
+        try:
+            eid = order['eid']
+            if eid not in prices:
+                prices[eid] = get_price_tables().get(eid)
+            if prices[eid] is None:
+                raise ValueError("Establishment not found.")
+            total = round(price_cart(prices[eid], order['items']), 2)
+            cell = geohash_encode(lat, lon, CITY_GEOHASH_PRECISION)
+            if cell not in cities:
+                # A failed lookup fails the orders of its cell only
+                try:
+                    cities[cell] = lat_lon_to_city_name(lat, lon)
+                except (GeocodeTimeout, GeopyError) as e:
+                    log.warning('bulk_city_lookup_failed', cell=cell, error=str(e))
+                    cities[cell] = e
+            cid = cities[cell]
+            if isinstance(cid, Exception):
+                raise ValueError("City lookup failed.")
+            if not cid:
+                raise ValueError("City not found.")
+        except (ValueError, TypeError) as e:
+            results[i] = {'message': str(e)}
+            continue
+        now = time.time()
+        docs.append((i, {
+            'oid': get_store().new_order_id(),
+            'eid': eid,
+            'total': total,
+            'uid': order.get('uid'),
+            'lat': lat,
+            'lon': lon,
+            'cid': cid.lower(),
+            'status': 'pending',
+            'ts_group': get_circle_registry().assign(eid, lat, lon, now=now),
+            'order_obj': order['items'],
+            'created_at': now
+        }))
+
+    unwritten = set()
+    try:
+        get_store().put_orders([doc for _, doc in docs])
+    except OrdersNotWritten as e:
+        # The orders that were not written leave their circles, the others are kept
+        log.error('bulk_orders_write_failed', orders=len(e.orders), error=str(e.__cause__))
+        for doc in e.orders:
+            get_circle_registry().unassign(doc['eid'], doc['ts_group'], doc['lat'], doc['lon'])
+            unwritten.add(doc['oid'])
+    for cid in {doc['cid'] for _, doc in docs if doc['oid'] not in unwritten}:
+        get_city_snapshots().invalidate(cid)
+    for i, doc in docs:
+        if doc['oid'] in unwritten:
+            results[i] = {'message': 'Order could not be saved.'}
+            continue
+        publish_order_events(doc)
+        results[i] = {'order_id': doc['oid'], 'ts_group': doc['ts_group'], 'total': doc['total']}
+    return results
+
 # Returns a list of orders that were placed in the last 15 minutes using tsgroup and city_id
 def query_for_city_circles(city_id, minutes=15):
     now = time.time()
     max_time = now - minutes*60
-    orders_ref = db.collection('orders')
-    orders = orders_ref.where('cid', '==', city_id).where(
-        'ts_group', '>', max_time).stream()
-    orders_list_sorted = []
-    for order in orders:
-        orders_list_sorted.append(order.to_dict())
+    orders_list_sorted = get_store().orders_since(max_time, cid=city_id)
     orders_list_sorted.sort(key=lambda x: x['created_at'])
     return orders_list_sorted
 
+def load_city_snapshot(city_id):
+    '''
+    Reads the part of /get-est-by-city that does not depend on the user's position
+
+    Args:
+        city_id (str): The id of the city
+
+    Returns:
+        dict: The city's 'establishments' (LIST_FIELDS), its open circles' 'orders' sorted by
+        created_at, an 'order_index' of their positions and the 'circles' to be drawn
+    '''
+    ests = get_establishments_by_city(city_id, LIST_FIELDS)
+    valid_orders = query_for_city_circles(city_id)
+    order_index = GridIndex(cell_miles=RADIUS_SLACK)
+    for i, order in enumerate(valid_orders):
+        order_index.insert(order['lat'], order['lon'], i)
+
+    circles = []
+    went = {}
+    for order in valid_orders:
+        log.debug('circle_order_checked', oid=order.get('oid'), ts_group=order['ts_group'])
+        lat_plus_lon_hash = str(order['lat']) + str(order['lon'])
+        if order['ts_group'] in went or lat_plus_lon_hash in went:
+            continue
+        else:
+            went[order['ts_group']] = True
+            went[lat_plus_lon_hash] = True
+            circles.append({
+                'lat': order['lat'],
+                'lon': order['lon'],
+                'max_ts': order['ts_group'] + 900
+            })
+    return {'establishments': ests, 'orders': valid_orders, 'order_index': order_index, 'circles': circles}
+
 # Returns a list of orders that were placed in the last 15 minutes using tsgroup and eid
 def query_for_circle_ts_eid(eid, minutes=15):
     now = time.time()
     max_time = now - minutes*60
-    orders_ref = db.collection('orders')
-    orders = orders_ref.where('eid', '==', eid).where(
-        'ts_group', '>', max_time).stream()
-    orders_list_sorted = []
-    for order in orders:
-        orders_list_sorted.append(order.to_dict())
+    orders_list_sorted = get_store().orders_since(max_time, eid=eid)
     orders_list_sorted.sort(key=lambda x: x['ts_group'])
     return orders_list_sorted
 
+# Returns a list of orders of every establishment whose circle is still open
+def query_for_open_circles(minutes=15):
+    now = time.time()
+    max_time = now - minutes*60
+    return get_store().orders_since(max_time)
+
+@per_process
+def get_circle_registry():
+    # Open circles per establishment, used to assign ts_group without reading the orders
+    # Orders of other workers are picked up by the resync, and by a read of the establishment's
+    # open orders before a new circle is opened
+    return CircleRegistry(
+        query_for_open_circles, resync_interval=float(os.getenv('CIRCLE_RESYNC_INTERVAL', '30')),
+        eid_loader=query_for_circle_ts_eid)
+
+@per_process
+def get_event_bus():
+    # Live circle events per city, fed by this process' orders and by a Firestore
+    # listener for the orders placed on other workers
+    # Every open /city-events stream holds a request thread, at most half of them by default
+    max_subscribers = int(os.getenv('CITY_EVENTS_MAX_SUBSCRIBERS',
+                                    str(max(1, int(os.getenv('GUNICORN_THREADS', '8')) // 2))))
+    bus = EventBus(max_queue=int(os.getenv('CITY_EVENTS_QUEUE', '100')), max_subscribers=max_subscribers)
+    if os.getenv('CITY_EVENTS_WATCH', '1') == '1':
+        bus.watch = get_store().watch_orders(lambda orders: on_orders_added(bus, orders), time.time())
+    return bus
+
+def on_orders_added(bus, orders):
+    '''
+    Publishes the events of orders placed on other workers (Storage.watch_orders callback)
+
+    Args:
+        bus (EventBus): The event bus of this process
+        orders (list): The new orders
+    '''
+    registry = get_circle_registry()
+    for order in orders:
+        if order.get('ts_group') is None:
+            continue
+        registry.observe(order['eid'], order['ts_group'], order['lat'], order['lon'])
+        publish_order_events(order, bus)
+
+def publish_order_events(order, bus=None):
+    '''
+    Publishes the circle events of a new order to the subscribers of its city: circle_opened
+    (and a circle_expired when it closes) if the order opened its circle, then order_joined
+    with the number of orders in the circle (popmeter)
+
+    Args:
+        order (dict): The order, with its oid, eid, cid, lat, lon and ts_group
+        bus (EventBus): The event bus, defaults to the one of this process
+    '''
+    bus = bus or get_event_bus()
+    if not bus.first_seen(order['oid']):
+        return
+    circle = get_circle_registry().circle(order['eid'], order['ts_group'])
+    if circle is None:
+        return  # Already expired
+    cid = order['cid']
+    event = {'eid': order['eid'], 'ts_group': circle['ts_group'], 'lat': circle['lat'], 'lon': circle['lon'],
+             'max_ts': circle['max_ts']}
+    if circle['orders'] == 1:
+        bus.publish(cid, dict(event, type='circle_opened'))
+        bus.schedule(circle['max_ts'], cid, dict(event, type='circle_expired'))
+    bus.publish(cid, dict(event, type='order_joined', oid=order['oid'], lat=order['lat'], lon=order['lon'],
+                          popmeter=circle['orders']))
+
 def get_orders_by_establishment(eid):
     '''
     Gets all orders with est_id from the database
@@ -525,9 +1049,77 @@ def get_orders_by_establishment(eid):
     # if not isinstance(eid, str):
     #     raise ValueError("eid must be a string.")
 
-    order_ref = db.collection('orders')
-    orders = order_ref.where('eid', '==', eid).stream()
-    return [order.to_dict() for order in orders]
+    return get_store().orders_by_establishment(eid)
+
+def get_sales_rollup(eid):
+    '''
+    Gets the sales rollup of an establishment, kept up to date by create_order
+
+    Args:
+        eid (str): The id of the establishment
+
+    Returns:
+        dict: overall_total, order_count, circle_count and the first_ts and last_ts of its circles
+    '''
+    store = get_store()
+    rollup = store.get_sales(eid)
+    if rollup is None or rollup.get('version') != SALES_VERSION:
+        # Orders written before rollups (or before this layout) existed are folded in once
+        rollup = store.rebuild_sales(eid)
+    return rollup
+
+def get_sales_window(eid, since, until=None):
+    '''
+    Gets the circles and customers of an establishment between two timestamps, reading
+    only the rollup days the range spans
+
+    Args:
+        eid (str): The id of the establishment
+        since (float): Circles with a ts_group after this timestamp are returned
+        until (float): Circles with a ts_group up to this timestamp are returned, None for no limit
+
+    Returns:
+        tuple: The circles ({'ts_group', 'total', 'orders'}) sorted by ts_group, and the set of
+        uids of the customers of the days the range spans
+    '''
+    days = get_store().sales_days(eid, sales_day(since), sales_day(until) if until is not None else None)
+    circles = sorted((c for day in days for c in day.get('circles', {}).values()
+                      if c['ts_group'] > since and (until is None or c['ts_group'] <= until)),
+                     key=lambda c: c['ts_group'])
+    customers = {uid for day in days for uid in day.get('customers', {})}
+    return circles, customers
+
+def get_establishment_timeline(eid, start=None, end=None, frames=100):
+    '''
+    Gets the orders of an establishment between two timestamps bucketed into frames
+
+    Args:
+        eid (str): The id of the establishment
+        start (float): The start of the range, defaults to 5 seconds before the first circle
+        end (float): The end of the range, defaults to 10 seconds after the last circle expired
+        frames (int): The number of frames, at most MAX_TIMELINE_FRAMES
+
+    Returns:
+        dict: The range ('start', 'end') with the 'circles' and 'frames' of build_timeline
+
+    Raises:
+        ValueError: If the range or the number of frames are not valid
+    '''
+    if not isinstance(frames, int) or not 1 <= frames <= MAX_TIMELINE_FRAMES:
+        raise ValueError("frames must be an integer between 1 and {}.".format(MAX_TIMELINE_FRAMES))
+    if start is None or end is None:
+        rollup = get_sales_rollup(eid)
+        if rollup.get('first_ts') is None:
+            return {'eid': eid, 'start': start, 'end': end, 'circles': [], 'frames': []}
+        start = rollup['first_ts'] - 5 if start is None else start
+        end = rollup['last_ts'] + 910 if end is None else end
+    if not end > start:
+        raise ValueError("end must be after start.")
+    # Orders are created at most 15 minutes after their ts_group, so this range covers [start, end]
+    orders = get_store().orders_since(start - 900, eid=eid, until=end)
+    timeline = build_timeline(orders, start, end, frames)
+    timeline.update({'eid': eid, 'start': start, 'end': end})
+    return timeline
 
 def create_user(uid, email, name, lat, lon, cid, u_type):
     '''
@@ -573,8 +1165,8 @@ def create_user(uid, email, name, lat, lon, cid, u_type):
         'u_type': u_type,
         'created_at': time.time()
     }
-    user_ref = db.collection('users')
-    user_ref.document(uid).set(user_data)
+    get_store().put_user(user_data)
+    get_user_cache().put(user_data)
     return user_data
 
 def edit_user(uid, changes):
@@ -586,7 +1178,7 @@ def edit_user(uid, changes):
         changes (dict): The changes to be made to the user
 
     Returns:
-        str: The id of the edited user
+        str: The id of the edited user, or None if the user does not exist
 
     Raises:
         ValueError: If any of the arguments are not of the correct type
@@ -596,8 +1188,10 @@ def edit_user(uid, changes):
     # if not isinstance(changes, dict):
     #     raise ValueError("changes must be a dictionary.")
 
-    user_ref = db.collection('users')
-    user_ref.document(uid).update(changes)
+    updated = get_store().update_user(uid, changes)
+    get_user_cache().invalidate(uid)
+    if not updated:
+        return None
     return uid
 
 def get_user(uid):
@@ -616,19 +1210,23 @@ def get_user(uid):
     # if not isinstance(uid, str):
     #     raise ValueError("uid must be a string.")
 
-    user_ref = db.collection('users')
-    user = user_ref.document(uid).get()
-    return user.to_dict()
+    user = get_user_cache().get(uid)
+    if user is None:
+        user = get_store().get_user(uid)
+        if user is not None:
+            get_user_cache().put(user)
+    return user
 
 def get_user_by_email(email):
     '''
-    Gets a user from the database
+    Gets a user from the database through the email index (emails are compared
+    normalized). Users created before the index are found by a query and indexed.
 
     Args:
         email (str): The email of the user to be retrieved
 
     Returns:
-        list: the list of user objects with the given email
+        list: the list of user objects with the given email (at most one)
 
     Raises:
         ValueError: If any of the arguments are not of the correct type
@@ -636,9 +1234,21 @@ def get_user_by_email(email):
     # if not isinstance(email, str):
     #     raise ValueError("email must be a string.")
 
-    user_ref = db.collection('users')
-    users = user_ref.where('email', '==', email).stream()
-    return [user.to_dict() for user in users]
+    if not email:
+        return []
+    user = get_user_cache().get_by_email(email)
+    if user is not None:
+        return [user]
+    uid = get_store().uid_by_email(email)
+    if uid is not None:
+        user = get_user(uid)
+        if user is not None:
+            return [user]
+    users = get_store().users_by_email(email)
+    if users:
+        get_store().put_user_email(email, users[0]['uid'])
+        get_user_cache().put(users[0])
+    return users[:1]
 
 # Returns true if the lat1 and lon2 are within the radius of 'radius_in_miles'
 # of the lat2 and lon2
@@ -647,29 +1257,80 @@ def is_within_radius(lat1, lon1, lat2, lon2, radius_in_miles):
     """
         Todo: Add docstring
     """
-    lat1 = math.radians(lat1)
-    lon1 = math.radians(lon1)
-    lat2 = math.radians(lat2)
-    lon2 = math.radians(lon2)
     # Uses the haversine formula to calculate the distance between two points in a sphere
     # Note:  Approximate error in distance 0.3%
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = math.sin(dlat / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    distance = 3959 * c # This is the distance in miles (1rad ~= 3959 miles on earth)
-    print("Distance: " + str(distance))
-    return distance <= radius_in_miles * 1.1
-
-@app.route("/", defaults={'path':''})
+    # For many points at once use spatial.within_radius_mask
+    distance = distance_miles(lat1, lon1, lat2, lon2)
+    log.debug('distance_checked', miles=distance)
+    return distance <= radius_in_miles * RADIUS_SLACK
+
+@routes.before_app_request
+def start_request():
+    # Correlates the events of a request, App Engine's trace id is reused when present
+    request_id = request.headers.get('X-Request-Id')
+    if not request_id:
+        request_id = request.headers.get('X-Cloud-Trace-Context', '').split('/')[0] or uuid.uuid4().hex
+    route = request.url_rule.rule if request.url_rule else request.path
+    g.request_id = request_id
+    g.request_started = time.perf_counter()
+    g.log_token = logs.start_request(request_id, route, get_log_sampler().sampled(route))
+    # Unmatched paths share one label so that scans do not create a series per path
+    g.metrics_route = route if request.url_rule else 'unmatched'
+    g.metrics_token = metrics.set_route(g.metrics_route)
+    metrics.REQUESTS_IN_FLIGHT.inc(g.metrics_route)
+    # X-Trace / X-Profile are only honoured with TRACE_HEADERS=1
+    headers = os.getenv('TRACE_HEADERS', '0') == '1'
+    g.trace_token = get_tracer().start(request_id, route, force=headers and request.headers.get('X-Trace') == '1')
+    if headers and request.headers.get('X-Profile'):
+        try:
+            g.profile = tracing.Profile(request.headers.get('X-Profile').lower())
+        except ValueError:  # Another profiler is already running in this process
+            pass
+
+def finish_trace(status=None):
+    if g.get('profile') is not None:
+        path = g.pop('profile').stop(lambda ext: get_tracer().profile_path(g.request_id, ext))
+        log.warning('profile_dumped', path=path)
+    if g.get('trace_token') is not None:
+        path = get_tracer().finish(g.pop('trace_token'), status=status)
+        if path:
+            log.warning('trace_dumped', path=path,
+                        duration_ms=round((time.perf_counter() - g.request_started) * 1000, 3))
+
+@routes.after_app_request
+def finish_request(response):
+    if 'request_id' in g:
+        response.headers['X-Request-Id'] = g.request_id
+        elapsed = time.perf_counter() - g.request_started
+        metrics.REQUEST_SECONDS.observe(elapsed, g.metrics_route, request.method, str(response.status_code))
+        level = logs.WARNING if response.status_code >= 500 else logs.INFO
+        log.log(level, 'request', method=request.method, status=response.status_code,
+                duration_ms=round(elapsed * 1000, 3))
+        finish_trace(response.status_code)
+    return response
+
+@routes.teardown_app_request
+def end_request(exc):
+    finish_trace()
+    if 'log_token' in g:
+        logs.end_request(g.pop('log_token'))
+    if 'metrics_token' in g:
+        metrics.REQUESTS_IN_FLIGHT.dec(g.metrics_route)
+        metrics.reset_route(g.pop('metrics_token'))
+
+@routes.app_errorhandler(GeocodeTimeout)
+def geocode_timeout_handler(e):
+    return jsonify({'message': str(e)}), 503
+
+@routes.route("/", defaults={'path':''})
 def serve(path):
-    return send_from_directory(app.static_folder,'index.html')
+    return send_from_directory(current_app.static_folder,'index.html')
 
-@app.route("/customer", defaults={'path':''})
+@routes.route("/customer", defaults={'path':''})
 def serve_customer(path):
-    return send_from_directory(app.static_folder,'index.html')
+    return send_from_directory(current_app.static_folder,'index.html')
 
-@app.route('/get-est', methods=['POST'])
+@routes.route('/get-est', methods=['POST'])
 @cross_origin()
 def get_establishment_details():
     uid = request.get_json().get('uid')
@@ -677,21 +1338,19 @@ def get_establishment_details():
         return jsonify({'message': 'Missing uid'}), 400
     est = get_establishment_by_uid(uid)
     if est and est[0]:
-        return jsonify(est[0]), 200
+        return jsonify(with_menu(est[0])), 200
     else:
         return jsonify({'message': 'Establishment not found.'}), 404
 
-@app.route('/create-est', methods=['POST'])
+@routes.route('/create-est', methods=['POST'])
 @cross_origin()
 def create_establishment_route():
     try:
         est = request.get_json().get('establishment')
         uid = request.get_json().get('uid')
         name = est.get('name')
-        # Default menu + promotion just to relax the constraints for the hackathon
-        default_menu = [ { "id": "1", "name": "Special Halloween Burger", "price": 10.00, "description": "Includes a special 200g Beef patty with tangy BBQ sauce and smoky bacon.", "category": "Specials", "rating": 5, "img": "/assets/burger1.png", }, { "id": "2", "name": "Mega Ghost Tower Burger", "price": 8.00, "description": "Includes smoked beef brisket with a special ghost pepper sauce.", "category": "Specials", "rating": 4.5, "img": "/assets/burger2.png", }, { "id": "3", "name": "Jr. Burger", "price": 6.00, "description": "Includes a 100g beef patty topped with cheese and no sauce.", "category": "Burgers", "rating": 4.5, "img": "/assets/burger3.png", }, { "id": "4", "name": "Spooky Combo", "price": 13.00, "description": "Special Combo of Burger, Fries, drink, and a dessert.", "category": "Specials", "rating": 4.5, "img": "/assets/burger4.png", }, { "id": "5", "name": "Sushi Combo 1", "price": 15.00, "description": "Includes variety of sushi, sashimi, and special rolls.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo1.png", }, { "id": "6", "name": "Sushi Combo 2", "price": 15.00, "description": "Fresh fish bowled with special sauce and served with rice.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo2.png", }, { "id": "7", "name": "Sushi Combo 3", "price": 15.00, "description": "Includes variety of sushi, sashimi, and special rolls.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo3.png", }, { "id": "8", "name": "Curry Chicken Combo", "price": 12.00, "description": "Combo of butter chicken with naan, rice, and curry. Mildly spicy.", "category": "Platters", "rating": 4.5, "img": "/assets/yummyfoods1.png", }, { "id": "9", "name": "Chicken Tikka Masala", "price": 12.00, "description": "Chicken tikka masala with naan, rice, and curry. Mildly spicy.", "category": "Platters", "rating": 4.5, "img": "/assets/yummyfoods4.png", }, { "id": "10", "name": "Ceasar Salad", "price": 8.00, "description": "Fresh romaine lettuce with ceasar dressing and croutons.", "category": "Salads", "rating": 4.5, "img": "/assets/salad1.png", }, { "id": "11", "name": "Greek Salad", "price": 8.00, "description": "Chopped romaine lettuce with feta cheese, olives, and tomatoes.", "category": "Salads", "rating": 4.5, "img": "/assets/salad2.png", }, { "id": "12", "name": "Sweetness Paradise", "price": 5.00, "description": "Includes a small pudding packed with Amarula cream and liquor.", "category": "Desserts", "rating": 4.5, "img": "/assets/dessert3.png", } ]
-        menu_obj = est.get('menu', default_menu)
-        promo_obj = est.get('promo', ["5% OFF", "Free Beverage", "10% OFF", "Free Dessert", "Free Entree"])
+        menu_obj = est.get('menu', DEFAULT_MENU)
+        promo_obj = est.get('promo', DEFAULT_PROMO)
         description = est.get('description')
         address = est.get('address')
         keywords = est.get('keywords')
@@ -706,14 +1365,13 @@ def create_establishment_route():
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
-@app.route('/update-est', methods=['POST'])
+@routes.route('/update-est', methods=['POST'])
 @cross_origin()
 def update_establishment_route():
     est_id = request.get_json().get('eid')
     changes = request.get_json().get('changes')
-    changes['promo'] = ["5% OFF", "Free Beverage", "10% OFF", "Free Dessert", "Free Entree"]
-    default_menu = [ { "id": "1", "name": "Special Halloween Burger", "price": 10.00, "description": "Includes a special 200g Beef patty with tangy BBQ sauce and smoky bacon.", "category": "Specials", "rating": 5, "img": "/assets/burger1.png", }, { "id": "2", "name": "Mega Ghost Tower Burger", "price": 8.00, "description": "Includes smoked beef brisket with a special ghost pepper sauce.", "category": "Specials", "rating": 4.5, "img": "/assets/burger2.png", }, { "id": "3", "name": "Jr. Burger", "price": 6.00, "description": "Includes a 100g beef patty topped with cheese and no sauce.", "category": "Burgers", "rating": 4.5, "img": "/assets/burger3.png", }, { "id": "4", "name": "Spooky Combo", "price": 13.00, "description": "Special Combo of Burger, Fries, drink, and a dessert.", "category": "Specials", "rating": 4.5, "img": "/assets/burger4.png", }, { "id": "5", "name": "Sushi Combo 1", "price": 15.00, "description": "Includes variety of sushi, sashimi, and special rolls.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo1.png", }, { "id": "6", "name": "Sushi Combo 2", "price": 15.00, "description": "Fresh fish bowled with special sauce and served with rice.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo2.png", }, { "id": "7", "name": "Sushi Combo 3", "price": 15.00, "description": "Includes variety of sushi, sashimi, and special rolls.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo3.png", }, { "id": "8", "name": "Curry Chicken Combo", "price": 12.00, "description": "Combo of butter chicken with naan, rice, and curry. Mildly spicy.", "category": "Platters", "rating": 4.5, "img": "/assets/yummyfoods1.png", }, { "id": "9", "name": "Chicken Tikka Masala", "price": 12.00, "description": "Chicken tikka masala with naan, rice, and curry. Mildly spicy.", "category": "Platters", "rating": 4.5, "img": "/assets/yummyfoods4.png", }, { "id": "10", "name": "Ceasar Salad", "price": 8.00, "description": "Fresh romaine lettuce with ceasar dressing and croutons.", "category": "Salads", "rating": 4.5, "img": "/assets/salad1.png", }, { "id": "11", "name": "Greek Salad", "price": 8.00, "description": "Chopped romaine lettuce with feta cheese, olives, and tomatoes.", "category": "Salads", "rating": 4.5, "img": "/assets/salad2.png", }, { "id": "12", "name": "Sweetness Paradise", "price": 5.00, "description": "Includes a small pudding packed with Amarula cream and liquor.", "category": "Desserts", "rating": 4.5, "img": "/assets/dessert3.png", } ]
-    changes['menu'] = default_menu
+    changes['promo'] = DEFAULT_PROMO
+    changes['menu'] = DEFAULT_MENU
     try:
         if changes.get('address'):
             lat, lon = address_to_lat_lon(changes.get('address'))
@@ -722,7 +1380,7 @@ def update_establishment_route():
             changes['cid'] = lat_lon_to_city_name(lat, lon)
         est_updated = update_establishment(est_id, changes)
         if est_updated:
-            return jsonify(est_updated), 200
+            return jsonify(with_menu(est_updated)), 200
         else:
             return jsonify({'message': 'Establishment not found.'}), 404
     except KeyError as e:
@@ -730,7 +1388,7 @@ def update_establishment_route():
     except ValueError as e:
         return jsonify({'message': 'Invalid value(s) in establishment update.'}), 400
 
-@app.route('/delete-est', methods=['POST'])
+@routes.route('/delete-est', methods=['POST'])
 @cross_origin()
 def delete_establishment_route():
     est_id = request.form.get('eid')
@@ -741,50 +1399,76 @@ def delete_establishment_route():
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
 
-@app.route('/get-all-est', methods=['POST'])
+@routes.route('/est-menu/<eid>', methods=['GET'])
+@cross_origin()
+def establishment_menu_route(eid):
+    menu = get_menu_items_from_establishment(eid)
+    if menu is None:
+        return jsonify({'message': 'Establishment not found.'}), 404
+    response = make_response(jsonify({'eid': eid, 'menu': menu}))
+    # Clients revalidate with If-None-Match and get a 304 while the menu is unchanged
+    response.set_etag(menu_ref(menu))
+    response.cache_control.public = True
+    response.cache_control.max_age = int(os.getenv('MENU_MAX_AGE', '60'))
+    return response.make_conditional(request)
+
+@routes.route('/get-all-est', methods=['POST'])
 @cross_origin()
 def get_all_establishments_route():
-    return jsonify(get_all_establishments()), 200
-
-@app.route('/get-est-by-city', methods=['POST'])
+    params = request.get_json(silent=True) or {}
+    if params.get('format') == 'ndjson':
+        # One establishment per line, written as it is read from storage
+        lines = (json.dumps(est, separators=(',', ':')) + '\n' for est in get_store().iter_establishments(LIST_FIELDS))
+        return current_app.response_class(lines, mimetype='application/x-ndjson')
+    if 'page_size' in params or 'cursor' in params:
+        try:
+            ests, next_cursor = get_establishments_page(
+                params.get('page_size', DEFAULT_PAGE_SIZE), params.get('cursor'), LIST_FIELDS)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        return jsonify({'establishments': ests, 'next_cursor': next_cursor}), 200
+    # Without paging the response is still one JSON array, but streamed
+    ests = get_store().iter_establishments(LIST_FIELDS)
+    return current_app.response_class(stream_json_array(ests), mimetype='application/json')
+
+@routes.route('/get-est-by-city', methods=['POST'])
 @cross_origin()
 def get_establishments_by_city_route():
     city_id = request.get_json().get('city_id')
     lat = float(request.get_json().get('lat'))
     lon = float(request.get_json().get('lon'))
     try:
-        ests = get_establishments_by_city(city_id)
-        valid_orders = query_for_city_circles(city_id)
+        # Keyed like the cid of establishments and orders, so their writes invalidate it
+        cid = city_id.lower()
+        snapshot = get_city_snapshots().get(cid, lambda: load_city_snapshot(cid))
+        valid_orders = snapshot['orders']
         # Adds a new field to all establishments called 'popmeter' which is a number
-        for est in ests:
-            est['popmeter'] = 0
-            est['max_ts'] = 0
+        # (on copies, the snapshot is shared with concurrent requests)
+        ests = []
+        ests_by_eid = {}
+        for est in snapshot['establishments']:
+            est = dict(est, popmeter=0, max_ts=0)
+            ests.append(est)
+            ests_by_eid[est['eid']] = est
 
         # Now for every valid_order placed in the city we add 1 to the establishment's
         # popmeter if the order was placed at that establishment and 
-        # the given latitude and longitude is within a 1 mile radius of the order's lat and lon
-        circles = []
-        went = {}
-        for order in valid_orders:
-            print("Checking order: ", order)
-            if is_within_radius(lat, lon, order['lat'], order['lon'], 1):
-                for est in ests:
-                    if est['eid'] == order['eid']:
-                        est['popmeter'] += 1 
-                        est['timer'] = math.floor(order['ts_group'] + 900 - time.time()) # For Front-end
-                        est['max_ts'] = order['ts_group'] + 900
-            lat_plus_lon_hash = str(order['lat']) + str(order['lon'])
-            if order['ts_group'] in went or lat_plus_lon_hash in went:
-                continue
-            else:
-                went[order['ts_group']] = True
-                went[lat_plus_lon_hash] = True
-                circles.append({
-                    'lat': order['lat'],
-                    'lon': order['lon'],
-                    'max_ts': order['ts_group'] + 900
-                })
-        print(json.dumps(ests, indent=4, sort_keys=True))
+        # the given latitude and longitude is within a 1 mile radius of the order's lat and lon.
+        # Orders are bucketed in a grid so only the cells around the user are checked,
+        # candidates are visited in created_at order so the latest order sets the timer
+        nearby = [valid_orders[i] for i in sorted(snapshot['order_index'].near(lat, lon, RADIUS_SLACK))]
+        in_radius = within_radius_mask(
+            lat, lon, [o['lat'] for o in nearby], [o['lon'] for o in nearby], 1)
+        for order, within in zip(nearby, in_radius):
+            if within:
+                est = ests_by_eid.get(order['eid'])
+                if est:
+                    est['popmeter'] += 1 
+                    est['timer'] = math.floor(order['ts_group'] + 900 - time.time()) # For Front-end
+                    est['max_ts'] = order['ts_group'] + 900
+
+        circles = snapshot['circles']
+        log.debug('city_establishments', city_id=city_id, establishments=ests)
         if ests:
             return jsonify({"establishments": ests, "circles": circles}), 200
         else:
@@ -792,7 +1476,57 @@ def get_establishments_by_city_route():
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
 
-@app.route('/lat-lon-to-city', methods=['POST'])
+@routes.route('/city-events', methods=['GET'])
+@cross_origin()
+def city_events_route():
+    city_id = request.args.get('city_id')
+    if not city_id:
+        return jsonify({'message': 'Missing city_id'}), 400
+    try:
+        lat, lon = float(request.args.get('lat')), float(request.args.get('lon'))
+    except (TypeError, ValueError):
+        lat = lon = None
+    try:
+        # EventSource sends the id of the last event it got when it reconnects
+        since = float(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    except (TypeError, ValueError):
+        since = None
+    bus = get_event_bus()
+    try:
+        sub = bus.subscribe(city_id.lower(), since=since)
+    except TooManySubscribers:
+        response = jsonify({'message': 'Too many subscribers, retry later'})
+        response.headers['Retry-After'] = os.getenv('CITY_EVENTS_RETRY_AFTER', '10')
+        return response, 503
+    # Streams are held a few seconds only so request threads are not tied up, EventSource
+    # reconnects by itself and gets the events published in between
+    deadline = time.time() + float(os.getenv('CITY_EVENTS_MAX_AGE', '5'))
+
+    def stream():
+        try:
+            yield 'retry: 500\n\n'
+            while time.time() < deadline:
+                event = sub.get(timeout=max(0, deadline - time.time()))
+                if event is None:
+                    continue
+                if event['type'] == 'order_joined' and lat is not None:
+                    # Whether the order counts for this subscriber's popmeter (same test as /get-est-by-city)
+                    nearby = distance_miles(lat, lon, event['lat'], event['lon']) <= RADIUS_SLACK
+                    event = dict(event, nearby=bool(nearby))
+                if 'at' in event:
+                    yield 'id: {!r}\n'.format(event['at'])
+                yield 'event: {}\ndata: {}\n\n'.format(event['type'], json.dumps(event))
+                if event['type'] == 'reset':
+                    return
+        finally:
+            bus.unsubscribe(sub)
+
+    response = current_app.response_class(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@routes.route('/lat-lon-to-city', methods=['POST'])
 @cross_origin()
 def lat_lon_to_city_name_route():
     lat = float(request.form.get('lat'))
@@ -803,7 +1537,7 @@ def lat_lon_to_city_name_route():
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
 
-@app.route('/address-to-lat-lon', methods=['POST'])
+@routes.route('/address-to-lat-lon', methods=['POST'])
 @cross_origin()
 def address_to_lat_lon_route():
     address = request.form.get('address')
@@ -813,7 +1547,55 @@ def address_to_lat_lon_route():
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
 
-@app.route('/get-user', methods=['POST'])
+@routes.route('/price-orders', methods=['POST'])
+@cross_origin()
+def price_orders_route():
+    carts = request.get_json().get('orders')
+    if not isinstance(carts, list):
+        return jsonify({'message': 'orders must be a list'}), 400
+    return jsonify({'totals': calculate_order_totals(carts)}), 200
+
+def component_stats(built_only=False):
+    '''
+    Gets the counters of the caches, the geocoder, the circle registry and the event bus
+
+    Args:
+        built_only (bool): Skip the components this process has not built yet, building some of
+            them connects to the storage backend
+
+    Returns:
+        dict: The stats of each component
+    '''
+    components = {'geocache': get_geo_cache, 'geocoder': get_geo_scheduler, 'circles': get_circle_registry,
+                  'price_tables': get_price_tables, 'establishments': get_est_cache, 'menus': get_menu_cache,
+                  'city_events': get_event_bus, 'city_snapshots': get_city_snapshots, 'traces': get_tracer,
+                  'users': get_user_cache}
+    return {name: getter().stats() for name, getter in components.items()
+            if not built_only or getter.is_ready()}
+
+def component_samples():
+    # /metrics keeps working when the storage backend can't be reached
+    for component, stats in component_stats(built_only=True).items():
+        for stat, value in stats.items():
+            if isinstance(value, (int, float)):
+                yield (component, stat), value
+
+metrics.REGISTRY.add_callback(
+    'foodie_component_stat', 'Counters and ratios of the caches, geocoder and event bus (see /stats)',
+    ('component', 'stat'), component_samples)
+
+@routes.route('/stats', methods=['GET'])
+@cross_origin()
+def stats_route():
+    return jsonify(component_stats()), 200
+
+@routes.route('/metrics', methods=['GET'])
+def metrics_route():
+    response = make_response(metrics.REGISTRY.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+@routes.route('/get-user', methods=['POST'])
 @cross_origin()
 def get_user_route():
     uid = request.form.get('uid')
@@ -823,7 +1605,7 @@ def get_user_route():
     else:
         return jsonify({'message': 'User not found.'}), 404
 
-@app.route('/login', methods=['POST'])
+@routes.route('/login', methods=['POST'])
 @cross_origin()
 def create_user_route():
     name = request.form.get('name')
@@ -840,12 +1622,12 @@ def create_user_route():
         cid = create_city(city_name)
         user_data = create_user(gen_random_str(), email,
                                 name, lat, lon, cid['cid'], "unset")
-        populate_db(user_data['uid'], lat, lon)
+        schedule_populate_db(user_data['uid'], lat, lon, cid['cid'])
         return jsonify(user_data), 200
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
 
-@app.route('/update-user', methods=['POST'])
+@routes.route('/update-user', methods=['POST'])
 @cross_origin()
 def update_user_route():
     # get json data from request
@@ -861,7 +1643,7 @@ def update_user_route():
     except ValueError as e:
         return jsonify({'message': 'Invalid value(s) in user update.'}), 400
 
-@app.route('/submit-order', methods=['POST'])
+@routes.route('/submit-order', methods=['POST'])
 @cross_origin()
 def create_order_route():
     try:
@@ -874,21 +1656,34 @@ def create_order_route():
         cid = lat_lon_to_city_name(lat, lon).lower()
         total = calculate_order_total(items, eid)
         total = round(total, 2)
-        valid_orders = query_for_circle_ts_eid(eid)
-        current_ts = time.time()
-        for order in valid_orders:
-            # Find the first order within 1 mile
-            if is_within_radius(lat, lon, order['lat'], order['lon'], 1):
-                current_ts = order['ts_group']
-                break
-
-        order_id = create_order(items, total, eid, uid, lat, lon, cid, 'pending', current_ts)
+        # Join the earliest open circle with an order within 1 mile, or open a new one
+        now = time.time()
+        current_ts = get_circle_registry().assign(eid, lat, lon, now=now)
+        try:
+            order_id = create_order(items, total, eid, uid, lat, lon, cid, 'pending', current_ts, now)
+        except Exception:
+            get_circle_registry().unassign(eid, current_ts, lat, lon)
+            raise
+        get_city_snapshots().invalidate(cid)
+        publish_order_events({'oid': order_id, 'eid': eid, 'cid': cid, 'lat': lat, 'lon': lon, 'ts_group': current_ts})
         return jsonify({'message': 'Order created successfully', 'order_id': order_id}), 200
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
 
+@routes.route('/submit-orders', methods=['POST'])
+@cross_origin()
+def create_orders_route():
+    orders = (request.get_json(silent=True) or {}).get('orders')
+    if not isinstance(orders, list):
+        return jsonify({'message': 'orders must be a list'}), 400
+    if len(orders) > MAX_BULK_ORDERS:
+        return jsonify({'message': 'At most {} orders per request'.format(MAX_BULK_ORDERS)}), 400
+    results = create_orders(orders)
+    return jsonify({'results': results,
+                    'created': sum('order_id' in result for result in results)}), 200
+
 # Dev Fun
-@app.route('/update-user-by-address', methods=['POST'])
+@routes.route('/update-user-by-address', methods=['POST'])
 @cross_origin()
 def update_user_by_address_route():
     try:
@@ -898,7 +1693,7 @@ def update_user_by_address_route():
         city_name = lat_lon_to_city_name(lat, lon)
         cid = create_city(city_name)
         user_updated = edit_user(uid, {'lat': lat, 'lon': lon, 'cid': cid['cid']})
-        populate_db(uid, lat, lon)
+        schedule_populate_db(uid, lat, lon, cid['cid'])
         if user_updated:
             return jsonify({'lat':lat, 'lon':lon, 'cid': cid['cid']}), 200
         else:
@@ -906,52 +1701,155 @@ def update_user_by_address_route():
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
 
-@app.route('/get-estab-orders', methods=['POST'])
+@routes.route('/get-estab-orders', methods=['POST'])
 @cross_origin()
 def estab_orders_route():
     try:
-        eid = request.get_json().get('eid')
-        orders = get_orders_by_establishment(eid)
-        orders.sort(key=lambda x: (x['ts_group'], x['created_at']))
+        params = request.get_json()
+        eid = params.get('eid')
+        rollup = get_sales_rollup(eid)
+        # Only the circles and orders of the requested window are read, every order by default
+        # or the last SALES_WINDOW seconds if it is set
+        until = params.get('until')
+        since = params.get('since')
+        if since is None:
+            window = os.getenv('SALES_WINDOW')
+            since = (rollup.get('last_ts') or time.time()) - float(window) if window else 0
+        circles, customers = get_sales_window(eid, since, until)
+        orders_by_ts = {}
+        for order in get_store().orders_since(since, eid=eid, until=until):
+            orders_by_ts.setdefault(order['ts_group'], []).append(order)
         circle_gps = {}
-        tsg = set()
-        i = 0
-        overall_total = 0
-        for order in orders:
-            if order['ts_group'] not in tsg:
-                tsg.add(order['ts_group'])
-                i += 1
-                circle_gps[str(i)] = {'orders': [], 'total': 0}
-            circle_gps[str(i)]['orders'].append(order)
-            circle_gps[str(i)]['total'] += order['total']
-            overall_total += order['total']
-        circle_gps['first_ts'] = orders[0]['ts_group'] - 5 # 5 seconds before first order
-        circle_gps['last_ts'] = orders[-1]['ts_group'] + 910 # 10 seconds after last order expires bug-fix
-        circle_gps['overall_total'] = overall_total
+        for i, circle in enumerate(circles):
+            orders = sorted(orders_by_ts.get(circle['ts_group'], []), key=lambda x: x['created_at'])
+            circle_gps[str(i + 1)] = {'orders': orders, 'total': circle['total'], 'count': circle['orders']}
+        circle_gps['first_ts'] = circles[0]['ts_group'] - 5 if circles else since # 5 seconds before first order
+        circle_gps['last_ts'] = circles[-1]['ts_group'] + 910 if circles else since # 10 seconds after last order expires bug-fix
+        circle_gps['overall_total'] = rollup.get('overall_total', 0)
+        circle_gps['order_count'] = rollup.get('order_count', 0)
+        circle_gps['circle_count'] = rollup.get('circle_count', 0)
+        circle_gps['customer_count'] = len(customers)
         return jsonify(circle_gps), 200
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
 
-def populate_db(uid, lat, lon):
-    # populate the database with establishments around the user
+@routes.route('/get-estab-timeline', methods=['POST'])
+@cross_origin()
+def estab_timeline_route():
+    params = request.get_json()
+    eid = params.get('eid')
+    if not eid:
+        return jsonify({'message': 'Missing eid'}), 400
     try:
-        names = ["Best Kitchen", "Gourmet Foods", "Surprise Spot"]
-        menu_obj = [ { "id": "1", "name": "Special Halloween Burger", "price": 10.00, "description": "Includes a special 200g Beef patty with tangy BBQ sauce and smoky bacon.", "category": "Specials", "rating": 5, "img": "/assets/burger1.png", }, { "id": "2", "name": "Mega Ghost Tower Burger", "price": 8.00, "description": "Includes smoked beef brisket with a special ghost pepper sauce.", "category": "Specials", "rating": 4.5, "img": "/assets/burger2.png", }, { "id": "3", "name": "Jr. Burger", "price": 6.00, "description": "Includes a 100g beef patty topped with cheese and no sauce.", "category": "Burgers", "rating": 4.5, "img": "/assets/burger3.png", }, { "id": "4", "name": "Spooky Combo", "price": 13.00, "description": "Special Combo of Burger, Fries, drink, and a dessert.", "category": "Specials", "rating": 4.5, "img": "/assets/burger4.png", }, { "id": "5", "name": "Sushi Combo 1", "price": 15.00, "description": "Includes variety of sushi, sashimi, and special rolls.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo1.png", }, { "id": "6", "name": "Sushi Combo 2", "price": 15.00, "description": "Fresh fish bowled with special sauce and served with rice.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo2.png", }, { "id": "7", "name": "Sushi Combo 3", "price": 15.00, "description": "Includes variety of sushi, sashimi, and special rolls.", "category": "Sushi Combos", "rating": 4.5, "img": "/assets/sushicombo3.png", }, { "id": "8", "name": "Curry Chicken Combo", "price": 12.00, "description": "Combo of butter chicken with naan, rice, and curry. Mildly spicy.", "category": "Platters", "rating": 4.5, "img": "/assets/yummyfoods1.png", }, { "id": "9", "name": "Chicken Tikka Masala", "price": 12.00, "description": "Chicken tikka masala with naan, rice, and curry. Mildly spicy.", "category": "Platters", "rating": 4.5, "img": "/assets/yummyfoods4.png", }, { "id": "10", "name": "Ceasar Salad", "price": 8.00, "description": "Fresh romaine lettuce with ceasar dressing and croutons.", "category": "Salads", "rating": 4.5, "img": "/assets/salad1.png", }, { "id": "11", "name": "Greek Salad", "price": 8.00, "description": "Chopped romaine lettuce with feta cheese, olives, and tomatoes.", "category": "Salads", "rating": 4.5, "img": "/assets/salad2.png", }, { "id": "12", "name": "Sweetness Paradise", "price": 5.00, "description": "Includes a small pudding packed with Amarula cream and liquor.", "category": "Desserts", "rating": 4.5, "img": "/assets/dessert3.png", } ]
-        #menu_obj = [{"id":1,"name":"Burger","description":"Beef patty, lettuce, tomato, onion, pickles, ketchup, mustard, and mayo.","price":5.99,"category":"Main Course","rating":4,"inventoryStatus":"INSTOCK","img":"/assets/burger1.png"},{"id":2,"name":"Pizza","description":"Cheese pizza with your choice of toppings.","price":9.99,"category":"Main Course","rating":3,"inventoryStatus":"LOWSTOCK","img":"/assets/burger2.png"},{"id":3,"name":"Burger","description":"Beef patty, lettuce, tomato, onion, pickles, ketchup, mustard, and mayo.","price":5.99,"category":"Main Course","rating":4,"inventoryStatus":"INSTOCK","img":"/assets/burger3.png"},{"id":4,"name":"Pizza","description":"Cheese pizza with your choice of toppings.","price":9.99,"category":"Main Course","rating":3,"inventoryStatus":"LOWSTOCK","img":"/assets/burger4.png"},{"id":5,"name":"Burger","description":"Beef patty, lettuce, tomato, onion, pickles, ketchup, mustard, and mayo.","price":5.99,"category":"Main Course","rating":4,"inventoryStatus":"INSTOCK","img":"/assets/desserts1.png"},{"id":6,"name":"Pizza","description":"Cheese pizza with your choice of toppings.","price":9.99,"category":"Main Course","rating":3,"inventoryStatus":"LOWSTOCK","img":"/assets/desserts2.png"},{"id":7,"name":"Burger","description":"Beef patty, lettuce, tomato, onion, pickles, ketchup, mustard, and mayo.","price":5.99,"category":"Main Course","rating":4,"inventoryStatus":"INSTOCK","img":"/assets/desserts3.png"},{"id":8,"name":"Pizza","description":"Cheese pizza with your choice of toppings.","price":9.99,"category":"Main Course","rating":3,"inventoryStatus":"LOWSTOCK","img":"/assets/salad1.png"}]
-        promo_obj = ["5% OFF", "Free Beverage", "10% OFF", "Free Dessert", "Free Entree"]
-        description = "Restaurant description"
-        keywords = ["Demo", "Restaurant", "Food"]
-        city_id = lat_lon_to_city_name(lat, lon)
-        address = lat_lon_to_address(lat, lon)
-        e_pic_url = ''
-        for i in range(10):
-            lat += random.uniform(-0.0200, 0.0300)
-            lon += random.uniform(-0.0200, 0.0300)
-            name = random.choice(names)
-            create_establishment(name, menu_obj, city_id, lat, lon, address, description, keywords, e_pic_url, uid, promo_obj)
-        return jsonify({'message': 'Establishments created successfully'}), 200
+        timeline = get_establishment_timeline(eid, params.get('start'), params.get('end'), params.get('frames', 100))
+        return jsonify(timeline), 200
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
 
+def populate_db(uid, lat, lon, city_id=None):
+    '''
+    Populates the database with demo establishments around the user
+
+    The establishment ids and positions are derived from the uid and the
+    geohash cell of the user's position (CITY_GEOHASH_PRECISION), so running
+    it again from the same spot does not add ten more, while a user who moved
+    to another part of the city gets establishments around the new spot. Only
+    the ones that do not exist yet are written (in one batch), existing ones
+    are left as they are, including the user's edits.
+
+    Args:
+        uid (str): The id of the user the establishments belong to
+        lat (float): The latitude of the user
+        lon (float): The longitude of the user
+        city_id (str): The city of the user if the caller already resolved it
+
+    Returns:
+        list: The ids of the establishments that were created
+    '''
+    names = ["Best Kitchen", "Gourmet Foods", "Surprise Spot"]
+    menu_obj = DEFAULT_MENU
+    #menu_obj = [{"id":1,"name":"Burger","description":"Beef patty, lettuce, tomato, onion, pickles, ketchup, mustard, and mayo.","price":5.99,"category":"Main Course","rating":4,"inventoryStatus":"INSTOCK","img":"/assets/burger1.png"},{"id":2,"name":"Pizza","description":"Cheese pizza with your choice of toppings.","price":9.99,"category":"Main Course","rating":3,"inventoryStatus":"LOWSTOCK","img":"/assets/burger2.png"},{"id":3,"name":"Burger","description":"Beef patty, lettuce, tomato, onion, pickles, ketchup, mustard, and mayo.","price":5.99,"category":"Main Course","rating":4,"inventoryStatus":"INSTOCK","img":"/assets/burger3.png"},{"id":4,"name":"Pizza","description":"Cheese pizza with your choice of toppings.","price":9.99,"category":"Main Course","rating":3,"inventoryStatus":"LOWSTOCK","img":"/assets/burger4.png"},{"id":5,"name":"Burger","description":"Beef patty, lettuce, tomato, onion, pickles, ketchup, mustard, and mayo.","price":5.99,"category":"Main Course","rating":4,"inventoryStatus":"INSTOCK","img":"/assets/desserts1.png"},{"id":6,"name":"Pizza","description":"Cheese pizza with your choice of toppings.","price":9.99,"category":"Main Course","rating":3,"inventoryStatus":"LOWSTOCK","img":"/assets/desserts2.png"},{"id":7,"name":"Burger","description":"Beef patty, lettuce, tomato, onion, pickles, ketchup, mustard, and mayo.","price":5.99,"category":"Main Course","rating":4,"inventoryStatus":"INSTOCK","img":"/assets/desserts3.png"},{"id":8,"name":"Pizza","description":"Cheese pizza with your choice of toppings.","price":9.99,"category":"Main Course","rating":3,"inventoryStatus":"LOWSTOCK","img":"/assets/salad1.png"}]
+    promo_obj = DEFAULT_PROMO
+    description = "Restaurant description"
+    keywords = ["Demo", "Restaurant", "Food"]
+    if not city_id:
+        city_id = lat_lon_to_city_name(lat, lon)
+    address = lat_lon_to_address(lat, lon)
+    e_pic_url = ''
+    save_menu(menu_obj)
+    seed = "{}:{}".format(uid, geohash_encode(lat, lon, CITY_GEOHASH_PRECISION))
+    rnd = random.Random(seed)
+    ests = []
+    for i in range(10):
+        lat += rnd.uniform(-0.0200, 0.0300)
+        lon += rnd.uniform(-0.0200, 0.0300)
+        name = rnd.choice(names)
+        est_id = hashlib.sha1("{}:{}".format(seed, i).encode()).hexdigest()[:8]
+        ests.append(build_establishment(
+            name, menu_obj, city_id, lat, lon, address, description, keywords, e_pic_url, uid, promo_obj, est_id))
+    added = get_store().add_establishments(ests)
+    for est in added:
+        get_est_cache().put(est)
+    get_city_snapshots().invalidate(city_id.lower())
+    return [est['eid'] for est in added]
+
+def schedule_populate_db(uid, lat, lon, city_id=None):
+    '''
+    Runs populate_db in the background job executor
+
+    Args:
+        (same as populate_db)
+
+    Returns:
+        Future: The future of the populate_db job
+    '''
+    request_id = g.get('request_id') or uuid.uuid4().hex
+
+    def job():
+        # Traced on its own, the request that scheduled it has returned by then
+        token = get_tracer().start(request_id + '-populate_db', 'populate_db')
+        try:
+            return populate_db(uid, lat, lon, city_id)
+        except Exception:
+            log.exception('populate_db_failed', uid=uid)
+            raise
+        finally:
+            if token is not None:
+                get_tracer().finish(token)
+    # Runs in a copy of the request's context so its log events carry the request id
+    return get_job_executor().submit(contextvars.copy_context().run, job)
+
+def create_app():
+    '''
+    Creates the Flask app serving the API and the Vue.js 3 build
+
+    Clients (Firestore, geocoders, HTTP session) are not created here but on
+    first use, in the process that uses them.
+
+    Returns:
+        Flask: The app
+    '''
+    # Load Vue.js 3 build
+    app = Flask(__name__, static_url_path='', static_folder='frontend/dist')
+    logs.configure()
+    CORS(app)
+    app.config['CORS_HEADERS'] = 'Content-Type'
+    app.register_blueprint(routes)
+    return app
+
+def warm_clients():
+    '''
+    Builds the clients of the current process ahead of the first request
+    (used by gunicorn's post_fork hook when the app is preloaded)
+    '''
+    get_store()
+    get_geo_cache()
+    get_local_geocoder()
+    get_geolocator()
+    get_geo_scheduler()
+    get_http_session()
+
+app = create_app()
+
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=8080, debug=True)
\ No newline at end of file
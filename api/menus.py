@@ -0,0 +1,92 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+def menu_ref(menu):
+    '''
+    Gets the content hash a menu is stored under
+
+    Args:
+        menu (list): The menu items
+
+    Returns:
+        str: The hex sha1 of the menu serialized with sorted keys
+    '''
+    return hashlib.sha1(json.dumps(menu, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+class MenuCache:
+    '''
+    Bounded LRU of menus keyed by their content hash. A ref always names the
+    same menu, so entries never go stale and there is nothing to invalidate.
+
+    Returned menus are shared between callers and must not be mutated.
+    '''
+
+    def __init__(self, loader, max_entries=1000):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._menus = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, ref):
+        with self._lock:
+            return ref in self._menus
+
+    def _store(self, ref, menu):
+        self._menus[ref] = menu
+        self._menus.move_to_end(ref)
+        while len(self._menus) > self.max_entries:
+            self._menus.popitem(last=False)
+
+    def get(self, ref):
+        '''
+        Gets a menu, loading it from storage on a miss
+
+        Args:
+            ref (str): The content hash of the menu
+
+        Returns:
+            list: The menu items, or None if no menu is stored under ref
+        '''
+        with self._lock:
+            menu = self._menus.get(ref)
+            if menu is not None:
+                self._menus.move_to_end(ref)
+                self.hits += 1
+                return menu
+            self.misses += 1
+        menu = self.loader(ref)
+        if menu is not None:
+            with self._lock:
+                self._store(ref, menu)
+        return menu
+
+    def add(self, ref, menu):
+        '''
+        Stores a menu this process just wrote
+
+        Args:
+            ref (str): The content hash of the menu
+            menu (list): The menu items
+        '''
+        with self._lock:
+            self._store(ref, menu)
+
+    def stats(self):
+        '''
+        Gets the cache counters
+
+        Returns:
+            dict: hits, misses, hit_ratio and the number of cached menus
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._menus)
+            }
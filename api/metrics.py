@@ -0,0 +1,295 @@
+import time
+import bisect
+import weakref
+import threading
+import contextvars
+
+# Seconds, from a cached lookup to a slow geocoder call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Route being served by the current thread, labels the storage counters
+_route = contextvars.ContextVar('metrics_route', default='')
+
+def set_route(route):
+    '''
+    Labels the storage operations of the current thread with a route until reset_route
+
+    Args:
+        route (str): The route rule being served
+
+    Returns:
+        Token: The token to be passed to reset_route
+    '''
+    return _route.set(route)
+
+def reset_route(token):
+    _route.reset(token)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=''):
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Registry:
+    '''
+    Counters, gauges and histograms recorded without a shared lock.
+
+    Every thread records into its own shard (a dict only that thread writes),
+    the shards are only summed when the metrics are collected. The shard of
+    a finished thread is merged into a retired shard, so threads come and go
+    without losing counts or growing the list of shards.
+    '''
+
+    def __init__(self):
+        self._metrics = []
+        self._callbacks = []
+        self._shards = []
+        self._retired = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            weakref.finalize(threading.current_thread(), self._retire, shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            self._shards.remove(shard)
+            _merge(self._retired, shard)
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+
+    def add_callback(self, name, help, labelnames, fn):
+        '''
+        Adds a gauge whose samples are read when the metrics are collected
+
+        Args:
+            name (str): The metric name
+            help (str): The description
+            labelnames (tuple): The label names
+            fn (callable): Returns an iterable of (label values, value)
+        '''
+        self._callbacks.append((name, help, labelnames, fn))
+
+    def collect(self):
+        '''
+        Sums the shards of every thread
+
+        Returns:
+            dict: (metric name, label values) -> value (or histogram bucket list)
+        '''
+        with self._lock:
+            shards = [dict(shard) for shard in self._shards]
+            totals = {}
+            _merge(totals, self._retired)
+        for shard in shards:
+            _merge(totals, shard)
+        return totals
+
+    def render(self):
+        '''
+        Renders every metric in the Prometheus text exposition format
+
+        Returns:
+            str: The metrics
+        '''
+        totals = self.collect()
+        by_metric = {}
+        for (name, labels), value in totals.items():
+            by_metric.setdefault(name, []).append((labels, value))
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            for labels, value in sorted(by_metric.get(metric.name, ()), key=lambda s: s[0]):
+                lines.extend(metric.samples(labels, value))
+        for name, help, labelnames, fn in self._callbacks:
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} gauge'.format(name))
+            for labels, value in fn():
+                lines.append('{}{} {}'.format(name, _labels(labelnames, labels), _number(value)))
+        return '\n'.join(lines) + '\n'
+
+def _merge(into, shard):
+    for key, value in shard.items():
+        if isinstance(value, list):
+            current = into.get(key)
+            if current is None:
+                into[key] = list(value)
+            else:
+                for i, v in enumerate(value):
+                    current[i] += v
+        else:
+            into[key] = into.get(key, 0) + value
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, registry, name, help, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+
+    def inc(self, *labels, amount=1):
+        shard = self.registry._shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def samples(self, labels, value):
+        return ['{}{} {}'.format(self.name, _labels(self.labelnames, labels), _number(value))]
+
+class Gauge(Counter):
+    '''
+    A gauge moved up and down by the same threads (e.g. requests in flight),
+    its value is the sum of every thread's moves
+    '''
+    type = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames, buckets):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self.registry._shard()
+        key = (self.name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            # One count per bucket and +Inf, then the sum and the count
+            counts = shard[key] = [0] * (len(self.buckets) + 3)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def time(self, *labels):
+        '''
+        Observes the duration of a with block
+
+        Args:
+            *labels: The label values
+        '''
+        return _Timer(self, labels)
+
+    def samples(self, labels, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(
+                self.name, _labels(self.labelnames, labels, 'le="{}"'.format(_number(bound))), cumulative))
+        lines.append('{}_sum{} {}'.format(self.name, _labels(self.labelnames, labels), _number(counts[-2])))
+        lines.append('{}_count{} {}'.format(self.name, _labels(self.labelnames, labels), counts[-1]))
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'foodie_request_seconds', 'Time to build the response of a request', ('route', 'method', 'status'))
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    'foodie_requests_in_flight', 'Requests being served', ('route',))
+STORAGE_READS = REGISTRY.counter(
+    'foodie_storage_reads_total', 'Documents read from storage (a read returning nothing counts 1)',
+    ('route', 'method'))
+STORAGE_WRITES = REGISTRY.counter(
+    'foodie_storage_writes_total', 'Documents written to storage', ('route', 'method'))
+STORAGE_SECONDS = REGISTRY.histogram(
+    'foodie_storage_call_seconds', 'Duration of storage calls', ('method',))
+GEOCODER_SECONDS = REGISTRY.histogram(
+    'foodie_geocoder_call_seconds', 'Duration of calls to geocoding providers', ('provider', 'outcome'))
+
+# Methods that write, the rest of the public methods read (watch_* and new_order_id do neither)
+_WRITES = ('put_', 'add_', 'update_', 'delete_', 'rebuild_')
+_UNMETERED = ('watch_', 'new_order_id')
+
+class MeteredStorage:
+    '''
+    Wraps a storage backend to count the documents every route reads and
+    writes and to time each call
+    '''
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getattr__(self, name):
+        attr = getattr(self.store, name)
+        if name.startswith('_') or name.startswith(_UNMETERED) or not callable(attr):
+            return attr
+        wrapped = self._wrap(name, attr)
+        setattr(self, name, wrapped)
+        return wrapped
+
+    def _wrap(self, name, fn):
+        write = name.startswith(_WRITES)
+
+        def metered(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                STORAGE_SECONDS.observe(time.perf_counter() - start, name)
+            if write:
+                docs = len(args[0]) if args and isinstance(args[0], list) else 1
+                STORAGE_WRITES.inc(_route.get(), name, amount=docs)
+            elif name.startswith('iter_'):
+                return _counted(result, _route.get(), name)
+            else:
+                docs = len(result) if isinstance(result, list) else 1
+                STORAGE_READS.inc(_route.get(), name, amount=max(docs, 1))
+            return result
+        return metered
+
+def _counted(docs, route, name):
+    # Streams are often consumed after the request returned, so the route is captured up front
+    count = 0
+    try:
+        for doc in docs:
+            count += 1
+            yield doc
+    finally:
+        STORAGE_READS.inc(route, name, amount=max(count, 1))
@@ -0,0 +1,123 @@
+import time
+import threading
+from collections import OrderedDict
+
+def compile_price_table(menu):
+    '''
+    Compiles a menu into a flat menu item id -> price mapping. Items without
+    an id are keyed by their 1-based position in the menu, as orders were
+    priced before menu items had ids; empty slots map to None.
+
+    Args:
+        menu (list): The menu items of an establishment
+
+    Returns:
+        dict: The price of every menu item keyed by its id (or position) as a string
+    '''
+    prices = {}
+    for position, item in enumerate(menu or [], start=1):
+        if not item:
+            prices.setdefault(str(position), None)
+            continue
+        prices[str(item.get('id', position))] = item['price']
+    return prices
+
+def price_cart(prices, cart):
+    '''
+    Prices a cart against a compiled price table
+
+    Args:
+        prices (dict): The price table from compile_price_table
+        cart (dict): The quantity of every ordered menu item keyed by its id
+
+    Returns:
+        float: The total price of the cart, empty menu slots are skipped
+
+    Raises:
+        ValueError: If an item is not on the menu
+    '''
+    total = 0
+    for pid, quantity in cart.items():
+        if str(pid) not in prices:
+            raise ValueError("Menu item {} not found.".format(pid))
+        price = prices[str(pid)]
+        if price is None:
+            continue
+        total += price * quantity  # price * quantity
+    return total
+
+class PriceTableCache:
+    '''
+    Bounded LRU of compiled price tables keyed by eid. Tables are dropped when
+    this process changes the establishment (invalidate) and after ttl seconds
+    so edits made by other workers are picked up.
+    '''
+
+    def __init__(self, loader, max_entries=5000, ttl=300):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, eid):
+        '''
+        Gets the price table of an establishment, compiling it on a miss
+
+        Args:
+            eid (str): The id of the establishment
+
+        Returns:
+            dict: The price table, or None if the establishment does not exist
+        '''
+        now = time.time()
+        with self._lock:
+            entry = self._tables.get(eid)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._tables.move_to_end(eid)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            version = self._versions.get(eid, 0)
+        menu = self.loader(eid)
+        if menu is None:
+            return None
+        prices = compile_price_table(menu)
+        with self._lock:
+            # Don't cache a table compiled from a menu that was changed meanwhile
+            if self._versions.get(eid, 0) == version:
+                self._tables[eid] = (prices, now)
+                self._tables.move_to_end(eid)
+                while len(self._tables) > self.max_entries:
+                    self._tables.popitem(last=False)
+        return prices
+
+    def invalidate(self, eid):
+        '''
+        Drops the price table of an establishment after its menu changed
+
+        Args:
+            eid (str): The id of the establishment
+        '''
+        with self._lock:
+            self._tables.pop(eid, None)
+            self._versions[eid] = self._versions.get(eid, 0) + 1
+
+    def stats(self):
+        '''
+        Gets the cache counters
+
+        Returns:
+            dict: hits, misses, hit_ratio and the number of cached tables
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._tables)
+            }
@@ -0,0 +1,118 @@
+import os
+import csv
+import math
+
+EARTH_RADIUS_MILES = 3959
+DEFAULT_GAZETTEER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cities.csv')
+
+def _to_unit_vector(lat, lon):
+    lat = math.radians(lat)
+    lon = math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+def _miles_to_chord(miles):
+    # Straight-line distance through the unit sphere for an arc of 'miles'
+    return 2 * math.sin(min(miles / EARTH_RADIUS_MILES, math.pi) / 2)
+
+def _chord_to_miles(chord):
+    return 2 * math.asin(min(chord / 2, 1.0)) * EARTH_RADIUS_MILES
+
+class KDTree:
+    '''
+    Static 3-d tree over points on the unit sphere. Chord distance between
+    unit vectors grows with the great-circle distance, so euclidean range
+    queries on the vectors are exact range queries on the earth.
+    '''
+
+    def __init__(self, points):
+        # points: list of ((x, y, z), payload)
+        self._root = self._build(list(points), 0)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        return (points[mid], axis,
+                self._build(points[:mid], depth + 1),
+                self._build(points[mid + 1:], depth + 1))
+
+    def within(self, vec, radius):
+        '''
+        Gets every payload within a chord distance of a unit vector
+
+        Args:
+            vec (tuple): The (x, y, z) unit vector to search around
+            radius (float): The chord distance to search
+
+        Returns:
+            list: A list of (chord_distance, payload) tuples
+        '''
+        found = []
+        stack = [self._root]
+        r2 = radius * radius
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            (point, payload), axis, left, right = node
+            d2 = sum((point[i] - vec[i]) ** 2 for i in range(3))
+            if d2 <= r2:
+                found.append((math.sqrt(d2), payload))
+            diff = vec[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            stack.append(near)
+            if diff * diff <= r2:
+                stack.append(far)
+        return found
+
+class LocalReverseGeocoder:
+    '''
+    Offline point-to-city resolver built from a gazetteer CSV with the
+    columns name, lat, lon, radius_mi (the approximate extent of the city).
+    '''
+
+    def __init__(self, gazetteer_path=DEFAULT_GAZETTEER):
+        cities = []
+        with open(gazetteer_path, newline='') as f:
+            for row in csv.DictReader(f):
+                cities.append({
+                    'name': row['name'].strip().lower(),
+                    'lat': float(row['lat']),
+                    'lon': float(row['lon']),
+                    'radius_mi': float(row.get('radius_mi') or 10)
+                })
+        self.cities = cities
+        self.max_radius = max((c['radius_mi'] for c in cities), default=0)
+        self._tree = KDTree((_to_unit_vector(c['lat'], c['lon']), c) for c in cities)
+
+    def city_name(self, lat, lon):
+        '''
+        Resolves a latitude and longitude to the nearest city covering it
+
+        Args:
+            lat (float): The latitude to be resolved
+            lon (float): The longitude to be resolved
+
+        Returns:
+            str: The lowercased city name, or None if no city in the gazetteer covers the point
+        '''
+        candidates = self._tree.within(_to_unit_vector(lat, lon), _miles_to_chord(self.max_radius))
+        best = None
+        for chord, city in candidates:
+            miles = _chord_to_miles(chord)
+            if miles <= city['radius_mi'] and (best is None or miles < best[0]):
+                best = (miles, city['name'])
+        return best[1] if best else None
+
+def resolver_from_env():
+    '''
+    Builds the local resolver when GEOCODER_BACKEND is 'local'
+
+    Returns:
+        LocalReverseGeocoder: The resolver, or None when Nominatim is the only backend
+    '''
+    if os.getenv('GEOCODER_BACKEND', 'nominatim').lower() != 'local':
+        return None
+    return LocalReverseGeocoder(os.getenv('GEOCODER_GAZETTEER', DEFAULT_GAZETTEER))
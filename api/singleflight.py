@@ -0,0 +1,155 @@
+import time
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    '''
+    Merges concurrent calls that share a key: the first caller runs the
+    function, every caller that arrives while it is in flight waits for
+    and shares the same result (or exception).
+    '''
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def do(self, key, fn, timeout=None):
+        '''
+        Runs fn once per key among concurrent callers
+
+        Args:
+            key: A hashable key identifying the call
+            fn (callable): The function to be run by the first caller
+            timeout (float): Seconds a follower waits for the leader, None to wait forever
+
+        Returns:
+            The result of fn
+
+        Raises:
+            TimeoutError: If a follower waited longer than timeout
+            Exception: Any exception raised by fn, re-raised in every caller
+        '''
+        with self._lock:
+            self.calls += 1
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._in_flight[key] = call
+            else:
+                self.shared += 1
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                call.done.set()
+        elif not call.done.wait(timeout):
+            raise TimeoutError("Timed out waiting for in-flight call {}".format(key))
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        '''
+        Gets the coalescing counters
+
+        Returns:
+            dict: calls, shared (calls served by another caller's flight) and the coalescing ratio
+        '''
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'shared': self.shared,
+                'coalescing_ratio': self.shared / self.calls if self.calls else 0.0,
+                'in_flight': len(self._in_flight)
+            }
+
+class CoalescingCache:
+    '''
+    SingleFlight with a short-lived memo of the results: callers arriving
+    while a key is in flight share that call, callers arriving within ttl
+    seconds after it finished reuse its result.
+    '''
+
+    def __init__(self, ttl=1.0, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.flights = SingleFlight()
+        self._results = {}  # key -> (result, finished_at, version)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, fn, timeout=None):
+        '''
+        Gets the result of fn for a key, running it at most once per ttl among all callers
+
+        Args:
+            key: A hashable key identifying the call
+            fn (callable): The function computing the result
+            timeout (float): Seconds a follower waits for the leader, None to wait forever
+
+        Returns:
+            The (shared) result of fn, callers must not mutate it
+        '''
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+                self.hits += 1
+                return entry[0]
+            version = self._versions.get(key, 0)
+
+        def call():
+            result = fn()
+            with self._lock:
+                # A result computed before an invalidate is shared by its flight but not kept
+                if self._versions.get(key, 0) == version:
+                    if len(self._results) >= self.max_entries:
+                        now = time.monotonic()
+                        self._results = {k: e for k, e in self._results.items() if now - e[1] <= self.ttl}
+                    self._results[key] = (result, time.monotonic(), version)
+            return result
+        return self.flights.do(key, call, timeout=timeout)
+
+    def invalidate(self, key):
+        '''
+        Drops the memoized result of a key after the data behind it changed
+
+        Args:
+            key: The key
+        '''
+        with self._lock:
+            self._results.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def stats(self):
+        '''
+        Gets the coalescing counters
+
+        Returns:
+            dict: calls, memo hits, shared flights, loads and the coalescing ratio (share of calls
+            that did not run fn)
+        '''
+        flights = self.flights.stats()
+        with self._lock:
+            calls = self.hits + flights['calls']
+            loads = flights['calls'] - flights['shared']
+            return {
+                'calls': calls,
+                'hits': self.hits,
+                'shared': flights['shared'],
+                'loads': loads,
+                'coalescing_ratio': (calls - loads) / calls if calls else 0.0,
+                'in_flight': flights['in_flight']
+            }
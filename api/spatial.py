@@ -0,0 +1,141 @@
+import math
+from collections import defaultdict
+import numpy as np
+
+EARTH_RADIUS_MILES = 3959
+MILES_PER_DEGREE_LAT = math.radians(1) * EARTH_RADIUS_MILES
+RADIUS_SLACK = 1.1 # Radius tests accept points up to 10% beyond the radius
+
+def distance_miles(lat1, lon1, lat2, lon2):
+    '''
+    Gets the haversine distance between two points (approximate error 0.3%)
+
+    Args:
+        lat1 (float): The latitude of the first point
+        lon1 (float): The longitude of the first point
+        lat2 (float): The latitude of the second point
+        lon2 (float): The longitude of the second point
+
+    Returns:
+        float: The distance in miles
+    '''
+    lat1 = math.radians(lat1)
+    lon1 = math.radians(lon1)
+    lat2 = math.radians(lat2)
+    lon2 = math.radians(lon2)
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = math.sin(dlat / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return EARTH_RADIUS_MILES * c
+
+def distances_miles(lat, lon, lats, lons):
+    '''
+    Gets the haversine distances from one origin to many points in a single vectorized pass
+
+    Args:
+        lat (float): The latitude of the origin
+        lon (float): The longitude of the origin
+        lats (array-like): The latitudes of the points
+        lons (array-like): The longitudes of the points
+
+    Returns:
+        numpy.ndarray: The distance in miles to every point
+    '''
+    lat1 = math.radians(lat)
+    lon1 = math.radians(lon)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lons, dtype=np.float64))
+    a = np.sin((lat2 - lat1) / 2)**2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_MILES * c
+
+def within_radius_mask(lat, lon, lats, lons, radius_in_miles):
+    '''
+    Tests many points against a radius around one origin, with the same slack as is_within_radius
+
+    Args:
+        lat (float): The latitude of the origin
+        lon (float): The longitude of the origin
+        lats (array-like): The latitudes of the points
+        lons (array-like): The longitudes of the points
+        radius_in_miles (float): The radius around the origin
+
+    Returns:
+        numpy.ndarray: A boolean mask, True for the points within the radius
+    '''
+    return distances_miles(lat, lon, lats, lons) <= radius_in_miles * RADIUS_SLACK
+
+class GridIndex:
+    '''
+    Buckets points into square cells of a fixed size in degrees so that a
+    radius query only visits the cells overlapping the query's bounding box.
+
+    Queries return candidates; callers still apply the exact distance test.
+    '''
+
+    def __init__(self, cell_miles=1.1):
+        self.cell_deg = cell_miles / MILES_PER_DEGREE_LAT
+        self._cells = defaultdict(list)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def insert(self, lat, lon, item):
+        '''
+        Adds an item to the index
+
+        Args:
+            lat (float): The latitude of the item
+            lon (float): The longitude of the item
+            item: The payload returned by queries
+        '''
+        self._cells[self._cell(lat, lon)].append(item)
+        self._size += 1
+
+    def near(self, lat, lon, radius_in_miles):
+        '''
+        Gets every item that may be within a radius of a point
+
+        Args:
+            lat (float): The latitude of the query point
+            lon (float): The longitude of the query point
+            radius_in_miles (float): The search radius
+
+        Returns:
+            list: The items of every cell overlapping the radius' bounding box
+        '''
+        angle = radius_in_miles / EARTH_RADIUS_MILES
+        dlat = math.degrees(angle)
+        cos_lat = math.cos(math.radians(lat))
+        if cos_lat <= math.sin(angle) or angle >= math.pi / 2:
+            return self.all()  # The circle contains a pole
+        dlon = math.degrees(math.asin(math.sin(angle) / cos_lat))
+        if lon - dlon < -180 or lon + dlon > 180:
+            return self.all()  # The circle crosses the antimeridian
+        lat_lo, lon_lo = self._cell(lat - dlat, lon - dlon)
+        lat_hi, lon_hi = self._cell(lat + dlat, lon + dlon)
+        if (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1) > len(self._cells):
+            # Sparse index, scanning the occupied cells is cheaper than the box
+            return [item for (i, j), items in self._cells.items()
+                    if lat_lo <= i <= lat_hi and lon_lo <= j <= lon_hi for item in items]
+        found = []
+        for i in range(lat_lo, lat_hi + 1):
+            for j in range(lon_lo, lon_hi + 1):
+                items = self._cells.get((i, j))
+                if items:
+                    found.extend(items)
+        return found
+
+    def all(self):
+        '''
+        Gets every item in the index
+
+        Returns:
+            list: All items, in no particular order
+        '''
+        return [item for items in self._cells.values() for item in items]
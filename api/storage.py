@@ -0,0 +1,892 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+
+class OrdersNotWritten(Exception):
+    '''
+    Raised by Storage.put_orders when a write fails, with the orders that were not
+    written (orders is a suffix of the orders given, the ones before it are written)
+    '''
+
+    def __init__(self, orders):
+        super().__init__('{} orders not written'.format(len(orders)))
+        self.orders = orders
+
+def project(doc, fields):
+    '''
+    Keeps only some top-level fields of a document
+
+    Args:
+        doc (dict): The document
+        fields (list): The fields to be kept
+
+    Returns:
+        dict: A new dict with the fields present in doc
+    '''
+    return {field: doc[field] for field in fields if field in doc}
+
+def normalize_email(email):
+    '''
+    Gets the key of an email in the email -> uid index
+
+    Args:
+        email (str): The email
+
+    Returns:
+        str: The email without surrounding whitespace, lowercased
+    '''
+    return email.strip().lower()
+
+def circle_key(ts_group):
+    '''
+    Gets the key of a circle in a sales rollup (map keys can't be floats or contain dots)
+
+    Args:
+        ts_group (float): The ts_group of the circle
+
+    Returns:
+        str: The ts_group in milliseconds
+    '''
+    return str(int(round(ts_group * 1000)))
+
+# Version of the rollup layout, rollups of another version are rebuilt when they are read
+SALES_VERSION = 2
+
+def sales_day(ts):
+    '''
+    Gets the key of the day document a circle is counted in
+
+    Args:
+        ts (float): The ts_group of the circle
+
+    Returns:
+        str: The UTC day of ts, YYYYMMDD
+    '''
+    return time.strftime('%Y%m%d', time.gmtime(ts))
+
+def opens_circle(order):
+    '''
+    Tells whether an order opened its circle: the first order of a circle is
+    created at the circle's ts_group (see create_order)
+
+    Args:
+        order (dict): The order
+
+    Returns:
+        bool: True if the order opened its circle
+    '''
+    return order.get('ts_group') is not None and order.get('created_at') == order['ts_group']
+
+def add_sale(rollup, days, order):
+    '''
+    Adds an order to a sales rollup and to the day its circle is counted in, in place.
+    A circle is counted by the order that opened it (opens_circle) on every backend,
+    so the count does not depend on which day documents were read first
+
+    Args:
+        rollup (dict): The rollup of the order's establishment
+        days (dict): The day documents of the establishment by sales_day, missing days are added
+        order (dict): The order
+    '''
+    rollup['overall_total'] = rollup.get('overall_total', 0) + order['total']
+    rollup['order_count'] = rollup.get('order_count', 0) + 1
+    ts_group = order.get('ts_group')
+    if ts_group is None:
+        return
+    rollup['first_ts'] = min(rollup.get('first_ts') or ts_group, ts_group)
+    rollup['last_ts'] = max(rollup.get('last_ts') or ts_group, ts_group)
+    day = days.setdefault(sales_day(ts_group), {'day': sales_day(ts_group), 'circles': {}, 'customers': {}})
+    key = circle_key(ts_group)
+    if key not in day['circles']:
+        day['circles'][key] = {'ts_group': ts_group, 'total': 0, 'orders': 0}
+    if opens_circle(order):
+        rollup['circle_count'] = rollup.get('circle_count', 0) + 1
+    day['circles'][key]['total'] += order['total']
+    day['circles'][key]['orders'] += 1
+    if order.get('uid'):
+        day['customers'][order['uid']] = True
+
+def sales_rollup(eid, orders):
+    '''
+    Builds the sales rollup of an establishment from all of its orders
+
+    Args:
+        eid (str): The id of the establishment
+        orders (list): Every order of the establishment
+
+    Returns:
+        tuple: The rollup (current SALES_VERSION) and its day documents by sales_day
+    '''
+    rollup = {'eid': eid, 'overall_total': 0, 'order_count': 0, 'circle_count': 0, 'first_ts': None,
+              'last_ts': None, 'version': SALES_VERSION}
+    days = {}
+    opened = set()
+    for order in orders:
+        add_sale(rollup, days, order)
+        if opens_circle(order):
+            opened.add(circle_key(order['ts_group']))
+    # Orders written before the opening order was created at its ts_group have no opener,
+    # their circles are counted once each
+    rollup['circle_count'] += sum(1 for day in days.values() for key in day['circles'] if key not in opened)
+    return rollup, days
+
+class Storage:
+    '''
+    Interface of the establishments, orders, users, cities, menus and sales collections.
+
+    Documents are plain dicts. Getters return None when a document does not
+    exist and list queries return new lists, so callers may mutate results.
+    List queries that take fields only return those fields of each document.
+    '''
+
+    # Establishments
+    def put_establishment(self, est):
+        raise NotImplementedError
+
+    def get_establishment(self, eid):
+        raise NotImplementedError
+
+    def update_establishment(self, eid, changes):
+        '''
+        Returns:
+            bool: False if the establishment does not exist
+        '''
+        raise NotImplementedError
+
+    def put_establishments(self, ests):
+        '''
+        Writes many establishments at once (replacing existing ones with the same eid)
+        '''
+        for est in ests:
+            self.put_establishment(est)
+
+    def add_establishments(self, ests):
+        '''
+        Writes the establishments whose eid does not exist yet, leaving existing ones untouched
+
+        Returns:
+            list: The establishments that were written
+        '''
+        added = [est for est in ests if self.get_establishment(est['eid']) is None]
+        self.put_establishments(added)
+        return added
+
+    def delete_establishment(self, eid):
+        raise NotImplementedError
+
+    def all_establishments(self, fields=None):
+        raise NotImplementedError
+
+    def establishments_page(self, page_size, after=None, fields=None):
+        '''
+        Gets establishments ordered by eid, starting after an eid
+
+        Returns:
+            list: At most page_size establishments, fewer only on the last page
+        '''
+        raise NotImplementedError
+
+    def iter_establishments(self, fields=None):
+        '''
+        Yields every establishment without holding the whole collection in memory
+        '''
+        after = None
+        while True:
+            page = self.establishments_page(500, after, fields)
+            yield from page
+            if len(page) < 500:
+                return
+            after = page[-1]['eid']
+
+    def establishments_by_city(self, cid, fields=None):
+        raise NotImplementedError
+
+    def establishments_by_uid(self, uid):
+        raise NotImplementedError
+
+    def watch_establishments(self, callback, since):
+        '''
+        Calls callback with a list of (kind, doc) changes ('ADDED', 'MODIFIED', 'REMOVED')
+        for establishments written by other processes with updated_at > since
+
+        Returns:
+            The watch handle, or None if the backend has no other writers to watch
+        '''
+        return None
+
+    # Orders
+    def new_order_id(self):
+        raise NotImplementedError
+
+    def put_order(self, order):
+        '''
+        Writes an order and adds it to the sales rollup of its establishment in one atomic write
+        '''
+        raise NotImplementedError
+
+    def put_orders(self, orders):
+        '''
+        Writes many orders and adds them to the sales rollups, in as few atomic writes as
+        the backend allows
+
+        Raises:
+            OrdersNotWritten: If a write failed, with the orders that were not written
+        '''
+        for i, order in enumerate(orders):
+            try:
+                self.put_order(order)
+            except Exception as e:
+                raise OrdersNotWritten(orders[i:]) from e
+
+    def orders_by_establishment(self, eid):
+        raise NotImplementedError
+
+    def orders_since(self, ts_group_after, cid=None, eid=None, until=None):
+        '''
+        Returns:
+            list: The orders with ts_group > ts_group_after (and <= until), optionally only of one
+            city or establishment
+        '''
+        raise NotImplementedError
+
+    def watch_orders(self, callback, since):
+        '''
+        Calls callback with the list of orders added with created_at > since, including
+        orders written by other processes
+
+        Returns:
+            The watch handle, or None if the backend has no other writers to watch
+        '''
+        return None
+
+    # Sales rollups: overall_total, order_count, circle_count and the first and last ts_group of
+    # an establishment, and per day (sales_day) its circles (circle_key -> ts_group, total, orders)
+    # and customers (uid -> True)
+    def get_sales(self, eid):
+        raise NotImplementedError
+
+    def sales_days(self, eid, first_day, last_day=None):
+        '''
+        Gets the day documents of an establishment's rollup
+
+        Args:
+            eid (str): The id of the establishment
+            first_day (str): The first sales_day
+            last_day (str): The last sales_day, None for the latest
+
+        Returns:
+            list: The day documents in the range, in no particular order
+        '''
+        raise NotImplementedError
+
+    def rebuild_sales(self, eid):
+        '''
+        Rebuilds a rollup and its days from all orders of the establishment, for establishments
+        with orders written before rollups (or before the current SALES_VERSION) existed
+
+        Returns:
+            dict: The rollup
+        '''
+        raise NotImplementedError
+
+    # Users, with an index of their normalized email kept by put_user and update_user
+    def put_user(self, user):
+        raise NotImplementedError
+
+    def get_user(self, uid):
+        raise NotImplementedError
+
+    def update_user(self, uid, changes):
+        '''
+        Returns:
+            bool: False if the user does not exist
+        '''
+        raise NotImplementedError
+
+    def users_by_email(self, email):
+        raise NotImplementedError
+
+    def uid_by_email(self, email):
+        '''
+        Looks an email up in the email index (a point read)
+
+        Returns:
+            str: The uid, None if the email is not indexed (e.g. users created before the index)
+        '''
+        raise NotImplementedError
+
+    def put_user_email(self, email, uid):
+        '''
+        Indexes the email of an existing user
+        '''
+        raise NotImplementedError
+
+    # Cities
+    def get_city(self, cid):
+        raise NotImplementedError
+
+    def put_city(self, city):
+        raise NotImplementedError
+
+    # Menus, keyed by the hash of their content
+    def put_menu(self, ref, menu):
+        '''
+        Stores a menu under its content hash, a no-op if it is already stored
+        '''
+        raise NotImplementedError
+
+    def get_menu(self, ref):
+        raise NotImplementedError
+
+class FirestoreStorage(Storage):
+    '''
+    Storage on the Firestore collections establishments, orders, users, cities, menus and sales
+    '''
+
+    def __init__(self, client):
+        self.db = client
+
+    def put_establishment(self, est):
+        self.db.collection('establishments').document(est['eid']).set(est)
+
+    def put_establishments(self, ests):
+        # A batch holds at most 500 writes
+        for i in range(0, len(ests), 500):
+            batch = self.db.batch()
+            for est in ests[i:i + 500]:
+                batch.set(self.db.collection('establishments').document(est['eid']), est)
+            batch.commit()
+
+    def add_establishments(self, ests):
+        from google.cloud import firestore
+        refs = [self.db.collection('establishments').document(est['eid']) for est in ests]
+
+        @firestore.transactional
+        def add(transaction):
+            # The reads make the transaction retry if one of them is created meanwhile
+            existing = {snapshot.id for snapshot in transaction.get_all(refs) if snapshot.exists}
+            added = [est for est in ests if est['eid'] not in existing]
+            for est in added:
+                transaction.create(self.db.collection('establishments').document(est['eid']), est)
+            return added
+
+        return add(self.db.transaction())
+
+    def get_establishment(self, eid):
+        est = self.db.collection('establishments').document(eid).get()
+        return est.to_dict() if est.exists else None
+
+    def update_establishment(self, eid, changes):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.db.collection('establishments').document(eid).update(changes)
+        except NotFound:
+            return False
+        return True
+
+    def delete_establishment(self, eid):
+        self.db.collection('establishments').document(eid).delete()
+
+    def all_establishments(self, fields=None):
+        query = self.db.collection('establishments')
+        if fields:
+            query = query.select(fields)
+        return [est.to_dict() for est in query.stream()]
+
+    def establishments_page(self, page_size, after=None, fields=None):
+        query = self.db.collection('establishments').order_by('eid')
+        if fields:
+            query = query.select(list(dict.fromkeys(['eid'] + list(fields))))
+        if after is not None:
+            query = query.start_after({'eid': after})
+        return [est.to_dict() for est in query.limit(page_size).stream()]
+
+    def iter_establishments(self, fields=None):
+        query = self.db.collection('establishments')
+        if fields:
+            query = query.select(fields)
+        for est in query.stream():
+            yield est.to_dict()
+
+    def establishments_by_city(self, cid, fields=None):
+        query = self.db.collection('establishments').where('cid', '==', cid)
+        if fields:
+            query = query.select(fields)
+        return [est.to_dict() for est in query.stream()]
+
+    def establishments_by_uid(self, uid):
+        ests = self.db.collection('establishments').where('uid', '==', uid).stream()
+        return [est.to_dict() for est in ests]
+
+    def watch_establishments(self, callback, since):
+        query = self.db.collection('establishments').where('updated_at', '>', since)
+
+        def on_snapshot(col_snapshot, changes, read_time):
+            callback([(change.type.name, change.document.to_dict()) for change in changes])
+
+        return query.on_snapshot(on_snapshot)
+
+    def new_order_id(self):
+        return self.db.collection('orders').document().id
+
+    def _sale_increments(self, eid, orders):
+        # The merge of the orders of one establishment into its rollup and day documents,
+        # as one write per document: the orders are added up with add_sale, like on every
+        # backend, and written as increments
+        from google.cloud.firestore import Increment, Maximum, Minimum
+        added = {}
+        days = {}
+        for order in orders:
+            add_sale(added, days, order)
+        sale = {'eid': eid, 'overall_total': Increment(added['overall_total']),
+                'order_count': Increment(added['order_count']),
+                'circle_count': Increment(added.get('circle_count', 0))}
+        if added.get('first_ts') is not None:
+            sale['first_ts'] = Minimum(added['first_ts'])
+            sale['last_ts'] = Maximum(added['last_ts'])
+        for day in days.values():
+            day['circles'] = {key: {'ts_group': circle['ts_group'], 'total': Increment(circle['total']),
+                                    'orders': Increment(circle['orders'])}
+                              for key, circle in day['circles'].items()}
+        return sale, days
+
+    def _days_ref(self, eid):
+        return self.db.collection('sales').document(eid).collection('days')
+
+    def _commit_orders(self, orders):
+        by_eid = {}
+        batch = self.db.batch()
+        for order in orders:
+            batch.set(self.db.collection('orders').document(order['oid']), order)
+            by_eid.setdefault(order['eid'], []).append(order)
+        for eid, eid_orders in by_eid.items():
+            sale, days = self._sale_increments(eid, eid_orders)
+            batch.set(self.db.collection('sales').document(eid), sale, merge=True)
+            for key, day in days.items():
+                batch.set(self._days_ref(eid).document(key), day, merge=True)
+        batch.commit()
+
+    def put_order(self, order):
+        self._commit_orders([order])
+
+    def put_orders(self, orders):
+        # A batch holds at most 500 writes: the orders, one rollup write per establishment
+        # and one per day of its circles
+        chunk = []
+        docs = set()
+        for i, order in enumerate(orders):
+            order_docs = {order['eid']}
+            if order.get('ts_group') is not None:
+                order_docs.add((order['eid'], sales_day(order['ts_group'])))
+            if len(chunk) + len(docs | order_docs) + 1 > 500:
+                self._commit_chunk(chunk, orders[i - len(chunk):])
+                chunk = []
+                docs = set()
+            chunk.append(order)
+            docs |= order_docs
+        if chunk:
+            self._commit_chunk(chunk, orders[len(orders) - len(chunk):])
+
+    def _commit_chunk(self, chunk, unwritten):
+        # The batches before this one are committed, this one and the rest are not
+        try:
+            self._commit_orders(chunk)
+        except Exception as e:
+            raise OrdersNotWritten(unwritten) from e
+
+    def orders_by_establishment(self, eid):
+        orders = self.db.collection('orders').where('eid', '==', eid).stream()
+        return [order.to_dict() for order in orders]
+
+    def orders_since(self, ts_group_after, cid=None, eid=None, until=None):
+        query = self.db.collection('orders')
+        if cid is not None:
+            query = query.where('cid', '==', cid)
+        if eid is not None:
+            query = query.where('eid', '==', eid)
+        query = query.where('ts_group', '>', ts_group_after)
+        if until is not None:
+            query = query.where('ts_group', '<=', until)
+        return [order.to_dict() for order in query.stream()]
+
+    def watch_orders(self, callback, since):
+        query = self.db.collection('orders').where('created_at', '>', since)
+
+        def on_snapshot(col_snapshot, changes, read_time):
+            orders = [change.document.to_dict() for change in changes if change.type.name == 'ADDED']
+            if orders:
+                callback(orders)
+
+        return query.on_snapshot(on_snapshot)
+
+    def get_sales(self, eid):
+        sales = self.db.collection('sales').document(eid).get()
+        return sales.to_dict() if sales.exists else None
+
+    def sales_days(self, eid, first_day, last_day=None):
+        query = self._days_ref(eid).where('day', '>=', first_day)
+        if last_day is not None:
+            query = query.where('day', '<=', last_day)
+        return [day.to_dict() for day in query.stream()]
+
+    def rebuild_sales(self, eid):
+        from google.cloud import firestore
+        sales_ref = self.db.collection('sales').document(eid)
+        orders_query = self.db.collection('orders').where('eid', '==', eid)
+
+        @firestore.transactional
+        def rebuild(transaction):
+            # Reading the rollup makes the transaction retry if an order is added meanwhile
+            sales_ref.get(transaction=transaction)
+            orders = [order.to_dict() for order in transaction.get(orders_query)]
+            rollup, days = sales_rollup(eid, orders)
+            transaction.set(sales_ref, rollup)
+            for key, day in days.items():
+                transaction.set(self._days_ref(eid).document(key), day)
+            return rollup
+        return rebuild(self.db.transaction())
+
+    def _email_ref(self, email):
+        # Emails may contain characters document ids can't, the index is keyed by their hash
+        key = hashlib.sha1(normalize_email(email).encode()).hexdigest()
+        return self.db.collection('user_emails').document(key)
+
+    def put_user(self, user):
+        batch = self.db.batch()
+        batch.set(self.db.collection('users').document(user['uid']), user)
+        if user.get('email'):
+            batch.set(self._email_ref(user['email']), {'email': normalize_email(user['email']), 'uid': user['uid']})
+        batch.commit()
+
+    def get_user(self, uid):
+        user = self.db.collection('users').document(uid).get()
+        return user.to_dict() if user.exists else None
+
+    def update_user(self, uid, changes):
+        from google.api_core.exceptions import NotFound
+        if 'email' not in changes:
+            try:
+                self.db.collection('users').document(uid).update(changes)
+            except NotFound:
+                return False
+            return True
+
+        from google.cloud import firestore
+        user_ref = self.db.collection('users').document(uid)
+
+        @firestore.transactional
+        def update(transaction):
+            user = user_ref.get(transaction=transaction)
+            if not user.exists:
+                return False
+            old_email = user.to_dict().get('email')
+            old_ref = self._email_ref(old_email) if old_email else None
+            old_index = old_ref.get(transaction=transaction) if old_ref else None
+            transaction.update(user_ref, changes)
+            if old_index is not None and old_index.exists and old_index.to_dict().get('uid') == uid:
+                transaction.delete(old_ref)
+            if changes['email']:
+                transaction.set(self._email_ref(changes['email']),
+                                {'email': normalize_email(changes['email']), 'uid': uid})
+            return True
+        return update(self.db.transaction())
+
+    def users_by_email(self, email):
+        users = self.db.collection('users').where('email', '==', email).stream()
+        return [user.to_dict() for user in users]
+
+    def uid_by_email(self, email):
+        index = self._email_ref(email).get()
+        return index.to_dict()['uid'] if index.exists else None
+
+    def put_user_email(self, email, uid):
+        self._email_ref(email).set({'email': normalize_email(email), 'uid': uid})
+
+    def get_city(self, cid):
+        city = self.db.collection('cities').document(cid).get()
+        return city.to_dict() if city.exists else None
+
+    def put_city(self, city):
+        self.db.collection('cities').document(city['cid']).set(city)
+
+    def put_menu(self, ref, menu):
+        # Documents with the same ref hold the same menu, so rewriting one changes nothing
+        self.db.collection('menus').document(ref).set({'ref': ref, 'items': menu})
+
+    def get_menu(self, ref):
+        menu = self.db.collection('menus').document(ref).get()
+        return menu.to_dict()['items'] if menu.exists else None
+
+class SQLiteStorage(Storage):
+    '''
+    Storage in a local SQLite database (':memory:' by default). Documents are
+    kept as JSON next to indexed columns for the fields queries filter on.
+    '''
+
+    _SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS establishments (eid TEXT PRIMARY KEY, uid TEXT, cid TEXT, doc TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS establishments_cid ON establishments (cid)',
+        'CREATE INDEX IF NOT EXISTS establishments_uid ON establishments (uid)',
+        'CREATE TABLE IF NOT EXISTS orders (oid TEXT PRIMARY KEY, eid TEXT, cid TEXT, uid TEXT, '
+        'ts_group REAL, created_at REAL, doc TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS orders_eid_ts_group ON orders (eid, ts_group)',
+        'CREATE INDEX IF NOT EXISTS orders_cid_ts_group ON orders (cid, ts_group)',
+        'CREATE INDEX IF NOT EXISTS orders_ts_group ON orders (ts_group)',
+        'CREATE INDEX IF NOT EXISTS orders_uid ON orders (uid)',
+        'CREATE TABLE IF NOT EXISTS users (uid TEXT PRIMARY KEY, email TEXT, doc TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS users_email ON users (email)',
+        'CREATE TABLE IF NOT EXISTS user_emails (email TEXT PRIMARY KEY, uid TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS cities (cid TEXT PRIMARY KEY, doc TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS menus (ref TEXT PRIMARY KEY, doc TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS sales (eid TEXT PRIMARY KEY, doc TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS sales_days (eid TEXT, day TEXT, doc TEXT NOT NULL, PRIMARY KEY (eid, day))',
+    ]
+
+    def __init__(self, path=':memory:'):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            for statement in self._SCHEMA:
+                self._conn.execute(statement)
+            self._conn.commit()
+
+    def _write(self, sql, params):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def _one(self, sql, params):
+        with self._lock:
+            row = self._conn.execute(sql, params).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _all(self, sql, params=(), fields=None):
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        docs = [json.loads(row[0]) for row in rows]
+        if fields:
+            docs = [project(doc, fields) for doc in docs]
+        return docs
+
+    def put_establishment(self, est):
+        self._write('INSERT OR REPLACE INTO establishments (eid, uid, cid, doc) VALUES (?, ?, ?, ?)',
+                    (est['eid'], est.get('uid'), est.get('cid'), json.dumps(est)))
+
+    def put_establishments(self, ests):
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO establishments (eid, uid, cid, doc) VALUES (?, ?, ?, ?)',
+                [(est['eid'], est.get('uid'), est.get('cid'), json.dumps(est)) for est in ests])
+            self._conn.commit()
+
+    def add_establishments(self, ests):
+        with self._lock:
+            added = []
+            for est in ests:
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO establishments (eid, uid, cid, doc) VALUES (?, ?, ?, ?)',
+                    (est['eid'], est.get('uid'), est.get('cid'), json.dumps(est)))
+                if cursor.rowcount:
+                    added.append(est)
+            self._conn.commit()
+        return added
+
+    def get_establishment(self, eid):
+        return self._one('SELECT doc FROM establishments WHERE eid = ?', (eid,))
+
+    def update_establishment(self, eid, changes):
+        with self._lock:
+            row = self._conn.execute('SELECT doc FROM establishments WHERE eid = ?', (eid,)).fetchone()
+            if not row:
+                return False
+            est = json.loads(row[0])
+            est.update(changes)
+            self._conn.execute('UPDATE establishments SET uid = ?, cid = ?, doc = ? WHERE eid = ?',
+                               (est.get('uid'), est.get('cid'), json.dumps(est), eid))
+            self._conn.commit()
+        return True
+
+    def delete_establishment(self, eid):
+        self._write('DELETE FROM establishments WHERE eid = ?', (eid,))
+
+    def all_establishments(self, fields=None):
+        return self._all('SELECT doc FROM establishments', fields=fields)
+
+    def establishments_page(self, page_size, after=None, fields=None):
+        if fields:
+            fields = list(dict.fromkeys(['eid'] + list(fields)))
+        return self._all('SELECT doc FROM establishments WHERE eid > ? ORDER BY eid LIMIT ?',
+                         ('' if after is None else after, page_size), fields)
+
+    def establishments_by_city(self, cid, fields=None):
+        return self._all('SELECT doc FROM establishments WHERE cid = ?', (cid,), fields)
+
+    def establishments_by_uid(self, uid):
+        return self._all('SELECT doc FROM establishments WHERE uid = ?', (uid,))
+
+    def new_order_id(self):
+        return uuid.uuid4().hex[:20]
+
+    def put_order(self, order):
+        self.put_orders([order])
+
+    def put_orders(self, orders):
+        with self._lock:
+            try:
+                self._put_orders(orders)
+            except Exception as e:
+                # One transaction, none of the orders is written
+                self._conn.rollback()
+                raise OrdersNotWritten(orders) from e
+
+    def _put_orders(self, orders):
+        rollups = {}
+        days = {}  # eid -> {day: day document}
+        for order in orders:
+            self._conn.execute('INSERT OR REPLACE INTO orders (oid, eid, cid, uid, ts_group, created_at, doc) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (order['oid'], order.get('eid'), order.get('cid'), order.get('uid'),
+                                order.get('ts_group'), order.get('created_at'), json.dumps(order)))
+            eid = order['eid']
+            if eid not in rollups:
+                row = self._conn.execute('SELECT doc FROM sales WHERE eid = ?', (eid,)).fetchone()
+                rollups[eid] = json.loads(row[0]) if row else {'eid': eid}
+                days[eid] = {}
+            if order.get('ts_group') is not None and sales_day(order['ts_group']) not in days[eid]:
+                row = self._conn.execute('SELECT doc FROM sales_days WHERE eid = ? AND day = ?',
+                                         (eid, sales_day(order['ts_group']))).fetchone()
+                if row:
+                    days[eid][sales_day(order['ts_group'])] = json.loads(row[0])
+            add_sale(rollups[eid], days[eid], order)
+        for eid, rollup in rollups.items():
+            self._conn.execute('INSERT OR REPLACE INTO sales (eid, doc) VALUES (?, ?)', (eid, json.dumps(rollup)))
+            self._conn.executemany('INSERT OR REPLACE INTO sales_days (eid, day, doc) VALUES (?, ?, ?)',
+                                   [(eid, key, json.dumps(day)) for key, day in days[eid].items()])
+        self._conn.commit()
+
+    def orders_by_establishment(self, eid):
+        return self._all('SELECT doc FROM orders WHERE eid = ?', (eid,))
+
+    def orders_since(self, ts_group_after, cid=None, eid=None, until=None):
+        sql = 'SELECT doc FROM orders WHERE ts_group > ?'
+        params = [ts_group_after]
+        if until is not None:
+            sql += ' AND ts_group <= ?'
+            params.append(until)
+        if cid is not None:
+            sql += ' AND cid = ?'
+            params.append(cid)
+        if eid is not None:
+            sql += ' AND eid = ?'
+            params.append(eid)
+        return self._all(sql, params)
+
+    def get_sales(self, eid):
+        return self._one('SELECT doc FROM sales WHERE eid = ?', (eid,))
+
+    def sales_days(self, eid, first_day, last_day=None):
+        sql = 'SELECT doc FROM sales_days WHERE eid = ? AND day >= ?'
+        params = [eid, first_day]
+        if last_day is not None:
+            sql += ' AND day <= ?'
+            params.append(last_day)
+        return self._all(sql, params)
+
+    def rebuild_sales(self, eid):
+        with self._lock:
+            rows = self._conn.execute('SELECT doc FROM orders WHERE eid = ?', (eid,)).fetchall()
+            rollup, days = sales_rollup(eid, [json.loads(row[0]) for row in rows])
+            self._conn.execute('INSERT OR REPLACE INTO sales (eid, doc) VALUES (?, ?)', (eid, json.dumps(rollup)))
+            self._conn.execute('DELETE FROM sales_days WHERE eid = ?', (eid,))
+            self._conn.executemany('INSERT INTO sales_days (eid, day, doc) VALUES (?, ?, ?)',
+                                   [(eid, key, json.dumps(day)) for key, day in days.items()])
+            self._conn.commit()
+        return rollup
+
+    def put_user(self, user):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO users (uid, email, doc) VALUES (?, ?, ?)',
+                               (user['uid'], user.get('email'), json.dumps(user)))
+            if user.get('email'):
+                self._conn.execute('INSERT OR REPLACE INTO user_emails (email, uid) VALUES (?, ?)',
+                                   (normalize_email(user['email']), user['uid']))
+            self._conn.commit()
+
+    def get_user(self, uid):
+        return self._one('SELECT doc FROM users WHERE uid = ?', (uid,))
+
+    def update_user(self, uid, changes):
+        with self._lock:
+            row = self._conn.execute('SELECT doc FROM users WHERE uid = ?', (uid,)).fetchone()
+            if not row:
+                return False
+            user = json.loads(row[0])
+            old_email = user.get('email')
+            user.update(changes)
+            self._conn.execute('UPDATE users SET email = ?, doc = ? WHERE uid = ?',
+                               (user.get('email'), json.dumps(user), uid))
+            if 'email' in changes:
+                if old_email:
+                    self._conn.execute('DELETE FROM user_emails WHERE email = ? AND uid = ?',
+                                       (normalize_email(old_email), uid))
+                if changes['email']:
+                    self._conn.execute('INSERT OR REPLACE INTO user_emails (email, uid) VALUES (?, ?)',
+                                       (normalize_email(changes['email']), uid))
+            self._conn.commit()
+        return True
+
+    def users_by_email(self, email):
+        return self._all('SELECT doc FROM users WHERE email = ?', (email,))
+
+    def uid_by_email(self, email):
+        with self._lock:
+            row = self._conn.execute('SELECT uid FROM user_emails WHERE email = ?',
+                                     (normalize_email(email),)).fetchone()
+        return row[0] if row else None
+
+    def put_user_email(self, email, uid):
+        self._write('INSERT OR REPLACE INTO user_emails (email, uid) VALUES (?, ?)', (normalize_email(email), uid))
+
+    def get_city(self, cid):
+        return self._one('SELECT doc FROM cities WHERE cid = ?', (cid,))
+
+    def put_city(self, city):
+        self._write('INSERT OR REPLACE INTO cities (cid, doc) VALUES (?, ?)', (city['cid'], json.dumps(city)))
+
+    def put_menu(self, ref, menu):
+        self._write('INSERT OR IGNORE INTO menus (ref, doc) VALUES (?, ?)', (ref, json.dumps(menu)))
+
+    def get_menu(self, ref):
+        return self._one('SELECT doc FROM menus WHERE ref = ?', (ref,))
+
+def storage_from_env():
+    '''
+    Builds the storage backend selected by STORAGE_BACKEND ('firestore' or 'sqlite')
+
+    Returns:
+        Storage: The configured backend
+
+    Raises:
+        ValueError: If STORAGE_BACKEND is not a known backend
+    '''
+    backend = os.getenv('STORAGE_BACKEND', 'firestore').lower()
+    if backend == 'sqlite':
+        return SQLiteStorage(os.getenv('SQLITE_PATH', ':memory:'))
+    if backend == 'firestore':
+        import firebase_admin
+        from firebase_admin import credentials
+        from google.cloud import firestore
+        try:
+            app = firebase_admin.get_app()
+        except ValueError:
+            app = firebase_admin.initialize_app(
+                credentials.Certificate(os.getenv('FIREBASE_CREDENTIALS', 'firebase.json')))
+        # A new client rather than firebase_admin.firestore.client(), which is cached on the
+        # app and would hand a forked worker the parent's gRPC channel
+        return FirestoreStorage(firestore.Client(
+            credentials=app.credential.get_credential(), project=app.project_id))
+    raise ValueError("Unknown STORAGE_BACKEND: " + backend)
@@ -0,0 +1,55 @@
+import os
+import sys
+import pytest
+
+# Offline configuration: in-memory SQLite storage, the bundled gazetteer and no listeners.
+# Set before main is imported, clients read it when they are built.
+os.environ.update(STORAGE_BACKEND='sqlite', SQLITE_PATH=':memory:', GEOCACHE_PATH='', GEOCODER_BACKEND='local',
+                  EST_CACHE_WATCH='0', CITY_EVENTS_WATCH='0', LOG_LEVEL='WARNING', TRACE_SLOW_MS='0',
+                  GEOCODER_RATE_FILE='', GEOCODER_RATE='1000', GEOCODER_BURST='1000')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from clients import reset_clients
+
+class StubLocation:
+    def __init__(self, lat, lon, city):
+        self.latitude = lat
+        self.longitude = lon
+        self.raw = {'address': {'city': city, 'road': 'Test St'}}
+
+class StubGeolocator:
+    def __init__(self, city='new york', lat=40.7128, lon=-74.0060):
+        self.location = StubLocation(lat, lon, city)
+
+    def reverse(self, query, **kwargs):
+        return self.location
+
+    def geocode(self, query, **kwargs):
+        return self.location
+
+@pytest.fixture
+def api(monkeypatch):
+    '''
+    The main module with fresh clients (a new, empty database) and a geolocator that does
+    not use the network
+    '''
+    reset_clients()
+    geolocator = StubGeolocator()
+    monkeypatch.setattr(main, 'get_geolocator', lambda: geolocator)
+    yield main
+    reset_clients()
+
+@pytest.fixture
+def client(api):
+    return api.app.test_client()
+
+@pytest.fixture
+def establishment(api):
+    '''
+    An establishment with the default menu in New York
+    '''
+    api.create_city('new york')
+    eid = api.create_establishment('Test Kitchen', api.DEFAULT_MENU, 'new york', 40.7128, -74.0060, '1 test st',
+                                   'A place to eat', ['food'], '', 'owner', api.DEFAULT_PROMO)
+    return api.get_establishment(eid)
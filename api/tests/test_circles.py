@@ -0,0 +1,93 @@
+import pytest
+from circles import CircleRegistry
+from storage import SQLiteStorage
+
+NOW = 1700000000.0
+
+def registry(**kwargs):
+    return CircleRegistry(lambda minutes: [], resync_interval=float('inf'), **kwargs)
+
+def test_orders_within_a_mile_share_a_circle():
+    circles = registry()
+    first = circles.assign('e1', 40.7128, -74.0060, now=NOW)
+    assert first == NOW
+    # About 0.7 miles north
+    assert circles.assign('e1', 40.7228, -74.0060, now=NOW + 60) == first
+    assert circles.circle('e1', first)['orders'] == 2
+
+def test_orders_farther_than_a_mile_open_a_new_circle():
+    circles = registry()
+    first = circles.assign('e1', 40.7128, -74.0060, now=NOW)
+    second = circles.assign('e1', 40.7428, -74.0060, now=NOW + 60)
+    assert second != first
+    assert circles.circle('e1', first)['orders'] == 1
+    assert circles.circle('e1', second)['orders'] == 1
+
+def test_circles_are_per_establishment():
+    circles = registry()
+    first = circles.assign('e1', 40.7128, -74.0060, now=NOW)
+    assert circles.assign('e2', 40.7128, -74.0060, now=NOW + 1) != first
+
+def test_a_member_extends_the_reach_of_its_circle():
+    circles = registry()
+    first = circles.assign('e1', 40.7128, -74.0060, now=NOW)
+    circles.assign('e1', 40.7228, -74.0060, now=NOW + 1)
+    # More than a mile from the first order but within a mile of the second
+    assert circles.assign('e1', 40.7328, -74.0060, now=NOW + 2) == first
+
+def test_circles_expire_after_the_window():
+    circles = registry()
+    first = circles.assign('e1', 40.7128, -74.0060, now=NOW)
+    assert circles.assign('e1', 40.7128, -74.0060, now=NOW + 899) == first
+    assert circles.assign('e1', 40.7128, -74.0060, now=NOW + 900) == NOW + 900
+    assert circles.circle('e1', first) is None
+
+def test_the_earliest_open_circle_is_joined():
+    circles = registry()
+    first = circles.assign('e1', 40.7128, -74.0060, now=NOW)
+    circles.assign('e1', 40.7428, -74.0060, now=NOW + 1)
+    # Within a mile of both circles
+    assert circles.assign('e1', 40.7278, -74.0060, now=NOW + 2) == first
+
+def test_resync_loads_circles_from_the_store():
+    orders = [{'eid': 'e1', 'ts_group': NOW, 'lat': 40.7128, 'lon': -74.0060}]
+    circles = CircleRegistry(lambda minutes: orders)
+    assert circles.assign('e1', 40.7130, -74.0060, now=NOW + 10) == NOW
+
+def test_a_circle_opened_by_another_worker_is_joined_before_opening_one():
+    store = SQLiteStorage()
+    loader = lambda minutes: store.orders_since(NOW - minutes * 60)
+    eid_loader = lambda eid, minutes: store.orders_since(NOW - minutes * 60, eid=eid)
+    worker_a = CircleRegistry(loader, resync_interval=float('inf'), eid_loader=eid_loader)
+    worker_b = CircleRegistry(loader, resync_interval=float('inf'), eid_loader=eid_loader)
+    worker_b.assign('e2', 0.0, 0.0, now=NOW)  # worker b synced before a's order exists
+
+    ts_group = worker_a.assign('e1', 40.7128, -74.0060, now=NOW + 1)
+    store.put_order({'oid': 'o1', 'eid': 'e1', 'total': 10.0, 'uid': 'u1', 'lat': 40.7128, 'lon': -74.0060,
+                     'ts_group': ts_group, 'created_at': ts_group})
+
+    assert worker_b.assign('e1', 40.7138, -74.0060, now=NOW + 2) == ts_group
+    assert worker_b.circle('e1', ts_group)['orders'] == 2
+    assert worker_b.stats()['rechecks'] == 2
+
+def test_the_establishment_is_read_again_only_once_per_resync():
+    reads = []
+    def eid_loader(eid, minutes):
+        reads.append(eid)
+        return []
+    circles = CircleRegistry(lambda minutes: [], resync_interval=30, eid_loader=eid_loader)
+    circles.assign('e1', 40.7128, -74.0060, now=NOW)
+    circles.assign('e1', 40.7428, -74.0060, now=NOW + 1)
+    circles.assign('e2', 40.7128, -74.0060, now=NOW + 2)
+    assert reads == ['e1', 'e2']
+    # After the next resync the first opening reads the store again
+    circles.assign('e1', 40.7728, -74.0060, now=NOW + 31)
+    assert reads == ['e1', 'e2', 'e1']
+
+@pytest.mark.parametrize('radius', [0.5, 1, 2])
+def test_the_radius_is_configurable(radius):
+    circles = registry(radius_in_miles=radius)
+    first = circles.assign('e1', 40.7128, -74.0060, now=NOW)
+    # 1 degree of latitude is about 69 miles
+    assert circles.assign('e1', 40.7128 + 0.9 * radius / 69, -74.0060, now=NOW + 1) == first
+    assert circles.assign('e1', 40.7128 - 1.5 * radius / 69, -74.0060, now=NOW + 2) != first
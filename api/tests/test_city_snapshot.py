@@ -0,0 +1,24 @@
+def by_city(client, city_id='New York'):
+    response = client.post('/get-est-by-city', json={'city_id': city_id, 'lat': 40.7128, 'lon': -74.0060})
+    return response.get_json()
+
+def names(client):
+    return [est['name'] for est in by_city(client)['establishments']]
+
+def test_establishment_writes_invalidate_the_city_snapshot(api, establishment, client, monkeypatch):
+    monkeypatch.setattr(api.get_city_snapshots(), 'ttl', 600)
+    assert names(client) == ['Test Kitchen']
+    api.apply_establishment_changes(establishment['eid'], {'name': 'Renamed'})
+    assert names(client) == ['Renamed']
+    api.delete_establishment(establishment['eid'])
+    assert names(client) == []
+
+def test_a_mixed_case_first_caller_caches_the_circles_of_the_city(api, establishment, client, monkeypatch):
+    monkeypatch.setattr(api.get_city_snapshots(), 'ttl', 600)
+    response = client.post('/submit-order', json={'order': {
+        'eid': establishment['eid'], 'uid': 'u1', 'items': {'1': 1}, 'lat': 40.7128, 'lon': -74.0060}})
+    assert response.status_code == 200
+    for city_id in ['New York', 'new york']:
+        body = by_city(client, city_id)
+        assert len(body['circles']) == 1
+        assert body['establishments'][0]['popmeter'] == 1
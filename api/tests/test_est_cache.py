@@ -0,0 +1,53 @@
+from est_cache import EstablishmentCache
+
+def est(eid, uid='owner', cid='new york', name='Kitchen'):
+    return {'eid': eid, 'uid': uid, 'cid': cid, 'name': name}
+
+def filled(docs, field, value):
+    cache = EstablishmentCache()
+    cache.fill_by(field, value, docs, cache.generation())
+    return cache
+
+def test_a_filled_city_list_is_served_from_the_cache():
+    cache = filled([est('e1'), est('e2')], 'cid', 'new york')
+    assert sorted(doc['eid'] for doc in cache.get_by('cid', 'new york')) == ['e1', 'e2']
+    assert cache.get_by('cid', 'boston') is None
+
+def test_invalidating_a_member_drops_its_city_and_owner_lists():
+    cache = filled([est('e1'), est('e2', uid='other')], 'cid', 'new york')
+    cache.fill_by('uid', 'owner', [est('e1')], cache.generation())
+    cache.invalidate('e1')
+    assert cache.get('e1') is None
+    assert cache.get_by('cid', 'new york') is None
+    assert cache.get_by('uid', 'owner') is None
+    assert cache.get('e2')['eid'] == 'e2'
+
+def test_invalidating_an_unknown_establishment_drops_every_list():
+    cache = filled([est('e1')], 'cid', 'new york')
+    cache.invalidate('e9')
+    assert cache.get_by('cid', 'new york') is None
+
+def test_a_put_moves_an_establishment_between_cities():
+    cache = filled([est('e1'), est('e2')], 'cid', 'new york')
+    cache.fill_by('cid', 'boston', [], cache.generation())
+    cache.put(est('e1', cid='boston'))
+    assert [doc['eid'] for doc in cache.get_by('cid', 'new york')] == ['e2']
+    assert [doc['eid'] for doc in cache.get_by('cid', 'boston')] == ['e1']
+
+def test_a_fill_older_than_a_write_is_refused():
+    cache = EstablishmentCache()
+    generation = cache.generation()
+    cache.put(est('e1', name='New'))
+    cache.fill(est('e1', name='Old'), generation)
+    cache.fill_by('cid', 'new york', [est('e1', name='Old')], generation)
+    assert cache.get('e1')['name'] == 'New'
+    assert cache.get_by('cid', 'new york') is None
+
+def test_invalidation_notifies_listeners():
+    cache = EstablishmentCache()
+    invalidated = []
+    cache.add_listener(invalidated.append)
+    cache.put(est('e1'))
+    cache.invalidate('e1')
+    cache.remove('e1')
+    assert invalidated == ['e1', 'e1', 'e1']
@@ -0,0 +1,23 @@
+import random
+from spatial import RADIUS_SLACK, GridIndex, distance_miles
+
+def random_points(rng, count, lat=40.7128, lon=-74.0060, spread=0.05):
+    return ([lat + rng.uniform(-spread, spread) for _ in range(count)],
+            [lon + rng.uniform(-spread, spread) for _ in range(count)])
+
+def test_grid_candidates_include_every_point_within_the_radius():
+    rng = random.Random(3)
+    lats, lons = random_points(rng, 2000)
+    index = GridIndex(cell_miles=RADIUS_SLACK)
+    for i, (lat, lon) in enumerate(zip(lats, lons)):
+        index.insert(lat, lon, i)
+    for lat, lon in zip(*random_points(rng, 20)):
+        within = {i for i, (p_lat, p_lon) in enumerate(zip(lats, lons)) if distance_miles(lat, lon, p_lat, p_lon) <= 1}
+        assert within <= set(index.near(lat, lon, 1))
+
+def test_grid_keeps_every_item():
+    index = GridIndex()
+    for i in range(10):
+        index.insert(40.7 + i * 0.1, -74.0, i)
+    assert len(index) == 10
+    assert sorted(index.all()) == list(range(10))
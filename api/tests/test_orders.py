@@ -0,0 +1,86 @@
+import pytest
+from geo_scheduler import GeocodeTimeout
+
+def order(eid, lat=40.7128, lon=-74.0060, **fields):
+    return dict({'eid': eid, 'uid': 'u1', 'lat': lat, 'lon': lon, 'items': {'1': 2, '3': 1}}, **fields)
+
+def test_bulk_orders_report_errors_per_order(api, establishment, client, monkeypatch):
+    city_name = api.lat_lon_to_city_name
+
+    def lat_lon_to_city_name(lat, lon):
+        if lat < 0:
+            raise GeocodeTimeout("Timed out waiting for geocoding result")
+        return city_name(lat, lon)
+
+    monkeypatch.setattr(api, 'lat_lon_to_city_name', lat_lon_to_city_name)
+    eid = establishment['eid']
+    response = client.post('/submit-orders', json={'orders': [
+        order(eid),
+        'not an order',
+        order(eid, items=None),
+        order('missing'),
+        order(eid, lat=-33.8688, lon=151.2093),
+        order(eid, lat='north'),
+        order(eid, lat=40.7138),
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    results = body['results']
+    assert body['created'] == 2
+    assert len(results) == 7
+    assert results[0]['total'] == 26.0
+    assert results[1] == {'message': 'order must have an eid and items'}
+    assert results[2] == {'message': 'order must have an eid and items'}
+    assert results[3] == {'message': 'Establishment not found.'}
+    assert results[4] == {'message': 'City lookup failed.'}
+    assert 'message' in results[5]
+    # Orders of one batch join each other's circles
+    assert results[6]['ts_group'] == results[0]['ts_group']
+
+    rollup = api.get_sales_rollup(eid)
+    assert (rollup['order_count'], rollup['overall_total'], rollup['circle_count']) == (2, 52.0, 1)
+    stored = {o['oid']: o for o in api.get_orders_by_establishment(eid)}
+    assert set(stored) == {results[0]['order_id'], results[6]['order_id']}
+    assert all(o['cid'] == 'new york' for o in stored.values())
+
+def test_bulk_orders_match_single_orders(api, establishment, client):
+    eid = establishment['eid']
+    single = client.post('/submit-order', json={'order': order(eid, lat=40.80)})
+    assert single.status_code == 200
+    bulk = client.post('/submit-orders', json={'orders': [order(eid, lat=40.8005)]}).get_json()['results'][0]
+    assert bulk['ts_group'] == api.get_store().orders_since(0, eid=eid)[0]['ts_group']
+
+@pytest.mark.parametrize('body', [{}, {'orders': {'eid': 'e1'}}, {'orders': 'e1'}])
+def test_bulk_orders_must_be_a_list(client, body):
+    response = client.post('/submit-orders', json=body)
+    assert response.status_code == 400
+
+def test_bulk_orders_are_capped(api, client):
+    response = client.post('/submit-orders', json={'orders': [order('e1')] * (api.MAX_BULK_ORDERS + 1)})
+    assert response.status_code == 400
+
+def test_an_empty_batch_creates_nothing(client):
+    response = client.post('/submit-orders', json={'orders': []})
+    assert response.get_json() == {'results': [], 'created': 0}
+
+def test_a_failed_write_leaves_no_circle_behind(api, establishment, client, monkeypatch):
+    import sqlite3
+    import storage
+
+    def add_sale(rollup, days, order):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    eid = establishment['eid']
+    with monkeypatch.context() as m:
+        m.setattr(storage, 'add_sale', add_sale)
+        response = client.post('/submit-orders', json={'orders': [order(eid), order(eid, lat=40.7138)]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body == {'results': [{'message': 'Order could not be saved.'}] * 2, 'created': 0}
+    assert api.get_orders_by_establishment(eid) == []
+    assert api.get_circle_registry().open_circles(eid) == []
+
+    # The next order opens its own circle instead of joining one of an order that does not exist
+    result = client.post('/submit-orders', json={'orders': [order(eid)]}).get_json()['results'][0]
+    assert api.get_circle_registry().circle(eid, result['ts_group'])['orders'] == 1
+    assert api.get_sales_rollup(eid)['circle_count'] == 1
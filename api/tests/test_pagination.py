@@ -0,0 +1,52 @@
+import base64
+import json
+import pytest
+
+def test_cursor_round_trip(api):
+    assert api.decode_cursor(api.encode_cursor('e000042')) == 'e000042'
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    base64.urlsafe_b64encode(b'not json').decode(),
+    base64.urlsafe_b64encode(json.dumps({'before': 'e1'}).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({'after': 42}).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps(['e1']).encode()).decode(),
+    42,
+])
+def test_invalid_cursors_are_rejected(api, cursor):
+    with pytest.raises(ValueError):
+        api.decode_cursor(cursor)
+
+def add_establishments(api, count):
+    ests = [api.build_establishment('Est {}'.format(i), api.DEFAULT_MENU, 'new york', 40.7, -74.0, 'a', 'd', [], '',
+                                    'owner', api.DEFAULT_PROMO, est_id='e{:04d}'.format(i))
+            for i in range(count)]
+    api.get_store().put_establishments(ests)
+    return [est['eid'] for est in ests]
+
+def test_pages_cover_every_establishment_once(api, client):
+    eids = add_establishments(api, 25)
+    seen = []
+    body = {'page_size': 10}
+    while True:
+        response = client.post('/get-all-est', json=body)
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page['establishments']) <= 10
+        assert all('menu' not in est for est in page['establishments'])
+        seen.extend(est['eid'] for est in page['establishments'])
+        if page['next_cursor'] is None:
+            break
+        body = {'page_size': 10, 'cursor': page['next_cursor']}
+    assert seen == sorted(eids)
+
+def test_the_last_full_page_has_no_next_cursor(api):
+    add_establishments(api, 10)
+    ests, next_cursor = api.get_establishments_page(10)
+    assert len(ests) == 10 and next_cursor is None
+
+@pytest.mark.parametrize('body', [{'cursor': 'garbage'}, {'page_size': 0}, {'page_size': 1001}, {'page_size': '10'}])
+def test_invalid_page_requests_are_400(client, body):
+    response = client.post('/get-all-est', json=body)
+    assert response.status_code == 400
+    assert 'message' in response.get_json()
@@ -0,0 +1,11 @@
+def test_populate_db_seeds_once_per_spot(api):
+    first = api.populate_db('u1', 40.7128, -74.0060, 'new york')
+    assert len(first) == 10
+    # Same geohash cell: nothing new, the existing establishments are kept
+    assert api.populate_db('u1', 40.7129, -74.0061, 'new york') == []
+    # Another part of the city is seeded around the new spot
+    moved = api.populate_db('u1', 40.7831, -73.9712, 'new york')
+    assert len(moved) == 10
+    assert not set(moved) & set(first)
+    lats = [api.get_establishment(eid)['lat'] for eid in moved]
+    assert all(abs(lat - 40.7831) < 0.31 for lat in lats)
@@ -0,0 +1,29 @@
+import pytest
+from pricing import compile_price_table, price_cart
+
+def test_items_are_priced_by_id():
+    prices = compile_price_table([{'id': '7', 'price': 4.0}, {'id': '3', 'price': 2.5}])
+    assert price_cart(prices, {'3': 2, 7: 1}) == 9.0
+
+def test_items_without_an_id_are_priced_by_position():
+    prices = compile_price_table([{'price': 4.0}, None, {'price': 2.5}])
+    assert prices == {'1': 4.0, '2': None, '3': 2.5}
+    # Empty menu slots are skipped
+    assert price_cart(prices, {'1': 1, '2': 5, '3': 2}) == 9.0
+
+def test_an_item_not_on_the_menu_is_rejected():
+    prices = compile_price_table([{'id': '1', 'price': 4.0}])
+    with pytest.raises(ValueError):
+        price_cart(prices, {'2': 1})
+
+def test_price_orders_with_a_menu_without_ids(api, client):
+    eid = api.create_establishment('No Ids', [{'name': 'Soup', 'price': 3.0}, {'name': 'Pie', 'price': 5.0}],
+                                   'new york', 40.7128, -74.0060, '1 test st', '', [], '', 'owner', [])
+    response = client.post('/price-orders', json={'orders': [
+        {'eid': eid, 'items': {'1': 1, '2': 2}},
+        {'eid': eid, 'items': {'3': 1}}
+    ]})
+    assert response.status_code == 200
+    totals = response.get_json()['totals']
+    assert totals[0] == {'eid': eid, 'total': 13.0}
+    assert 'message' in totals[1]
@@ -0,0 +1,143 @@
+import random
+import pytest
+from storage import SALES_VERSION, FirestoreStorage, SQLiteStorage, opens_circle, sales_day
+from circles import CircleRegistry
+
+DAY = 86400
+START = 1700000000.0
+
+def make_orders(count=300, days=3, seed=7):
+    '''
+    Orders of two establishments over a few days, assigned to circles like create_order does
+    '''
+    rng = random.Random(seed)
+    circles = CircleRegistry(lambda minutes: [], resync_interval=float('inf'))
+    orders = []
+    for i, now in enumerate(sorted(START + rng.uniform(0, days * DAY) for _ in range(count))):
+        eid = rng.choice(['e1', 'e2'])
+        lat, lon = 40.7 + rng.uniform(-0.05, 0.05), -74.0 + rng.uniform(-0.05, 0.05)
+        orders.append({'oid': 'o{:05d}'.format(i), 'eid': eid, 'total': float(rng.randint(5, 40)),
+                       'uid': 'u{}'.format(rng.randrange(40)), 'lat': lat, 'lon': lon, 'cid': 'new york',
+                       'ts_group': circles.assign(eid, lat, lon, now=now), 'created_at': now})
+    return orders
+
+def all_days(store, eid):
+    return {day['day']: day for day in store.sales_days(eid, '0')}
+
+def test_increments_match_a_rebuild():
+    store = SQLiteStorage()
+    orders = make_orders()
+    for order in orders[:100]:
+        store.put_order(order)
+    store.put_orders(orders[100:])
+    for eid in ('e1', 'e2'):
+        incremental, incremental_days = store.get_sales(eid), all_days(store, eid)
+        rebuilt = store.rebuild_sales(eid)
+        assert rebuilt['version'] == SALES_VERSION
+        for field in ('order_count', 'circle_count', 'first_ts', 'last_ts'):
+            assert incremental[field] == rebuilt[field]
+        assert incremental['overall_total'] == pytest.approx(rebuilt['overall_total'])
+        assert incremental_days == all_days(store, eid)
+
+def test_rollup_totals():
+    store = SQLiteStorage()
+    orders = make_orders()
+    store.put_orders(orders)
+    e1 = [order for order in orders if order['eid'] == 'e1']
+    rollup = store.rebuild_sales('e1')
+    assert rollup['order_count'] == len(e1)
+    assert rollup['overall_total'] == pytest.approx(sum(order['total'] for order in e1))
+    assert rollup['circle_count'] == len({order['ts_group'] for order in e1})
+    assert rollup['circle_count'] == sum(opens_circle(order) for order in e1)
+    assert rollup['first_ts'] == min(order['ts_group'] for order in e1)
+    assert rollup['last_ts'] == max(order['ts_group'] for order in e1)
+
+def test_circles_and_customers_are_bucketed_by_day():
+    store = SQLiteStorage()
+    orders = make_orders()
+    store.put_orders(orders)
+    e1 = [order for order in orders if order['eid'] == 'e1']
+    days = all_days(store, 'e1')
+    assert set(days) == {sales_day(order['ts_group']) for order in e1}
+    for key, day in days.items():
+        in_day = [order for order in e1 if sales_day(order['ts_group']) == key]
+        assert set(day['customers']) == {order['uid'] for order in in_day}
+        assert sum(circle['orders'] for circle in day['circles'].values()) == len(in_day)
+    # The establishment document does not grow with the number of circles or customers
+    assert set(store.get_sales('e1')) <= {'eid', 'overall_total', 'order_count', 'circle_count', 'first_ts',
+                                          'last_ts', 'version'}
+
+def test_sales_days_only_returns_the_range():
+    store = SQLiteStorage()
+    store.put_orders(make_orders())
+    first = sales_day(START + DAY)
+    assert {day['day'] for day in store.sales_days('e1', first, first)} == {first}
+
+def test_a_rollup_of_an_older_layout_is_rebuilt_on_read(api, establishment, client):
+    store = api.get_store()
+    # An order written before rollups existed
+    store._write('INSERT INTO orders (oid, eid, cid, uid, ts_group, created_at, doc) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                 ('o1', establishment['eid'], 'new york', 'u1', START, START,
+                  '{"oid": "o1", "eid": "%s", "total": 12.5, "uid": "u1", "ts_group": %r, "created_at": %r, '
+                  '"lat": 40.7, "lon": -74.0}' % (establishment['eid'], START, START)))
+    store._write('INSERT INTO sales (eid, doc) VALUES (?, ?)',
+                 (establishment['eid'], '{"eid": "%s", "circles": {}, "customers": {}}' % establishment['eid']))
+    response = client.post('/get-estab-orders', json={'eid': establishment['eid']})
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body['order_count'], body['overall_total'], body['circle_count'], body['customer_count']) == (1, 12.5, 1, 1)
+    assert store.get_sales(establishment['eid'])['version'] == SALES_VERSION
+
+def estab_orders(client, eid):
+    body = client.post('/get-estab-orders', json={'eid': eid}).get_json()
+    return body, [body[key] for key in body if key.isdigit()]
+
+def test_estab_orders_returns_every_order_by_default(api, establishment, client):
+    orders = [dict(order, eid=establishment['eid']) for order in make_orders(count=200, days=4)]
+    api.get_store().put_orders(orders)
+    body, circles = estab_orders(client, establishment['eid'])
+    assert len(circles) == len({order['ts_group'] for order in orders})
+    assert sum(len(circle['orders']) for circle in circles) == len(orders)
+    assert body['customer_count'] == len({order['uid'] for order in orders})
+
+def test_estab_orders_returns_the_window(api, establishment, client, monkeypatch):
+    monkeypatch.setenv('SALES_WINDOW', str(DAY))
+    store = api.get_store()
+    orders = [dict(order, eid=establishment['eid']) for order in make_orders(count=200, days=4)]
+    store.put_orders(orders)
+    last = max(order['ts_group'] for order in orders)
+    body, circles = estab_orders(client, establishment['eid'])
+    in_window = [order for order in orders if order['ts_group'] > last - DAY]
+    assert len(circles) == len({order['ts_group'] for order in in_window})
+    assert sum(circle['count'] for circle in circles) == len(in_window)
+    assert sum(len(circle['orders']) for circle in circles) == len(in_window)
+    assert body['order_count'] == len(orders)
+    assert body['circle_count'] == len({order['ts_group'] for order in orders})
+
+def sqlite_circle_count(batches):
+    store = SQLiteStorage()
+    for batch in batches:
+        store.put_orders(batch)
+    return store.get_sales('e1')['circle_count']
+
+def firestore_circle_count(batches):
+    # The increments each commit would apply to the rollup document
+    store = FirestoreStorage(None)
+    return sum(store._sale_increments('e1', batch)[0]['circle_count']._value for batch in batches)
+
+@pytest.mark.parametrize('circle_count', [sqlite_circle_count, firestore_circle_count])
+def test_every_backend_counts_circles_the_same_way(circle_count):
+    orders = [order for order in make_orders() if order['eid'] == 'e1']
+    # A circle whose orders are split over batches and a joining order written before its opener
+    orders[1], orders[2] = orders[2], orders[1]
+    batches = [orders[i:i + 7] for i in range(0, len(orders), 7)]
+    assert circle_count(batches) == len({order['ts_group'] for order in orders})
+
+def test_a_rebuild_counts_the_circles_of_orders_without_an_opener():
+    store = SQLiteStorage()
+    # Written before the opening order was created at its ts_group
+    store.put_orders([{'oid': 'o1', 'eid': 'e1', 'total': 5.0, 'uid': 'u1', 'lat': 40.7, 'lon': -74.0,
+                       'ts_group': START, 'created_at': START + 0.01},
+                      {'oid': 'o2', 'eid': 'e1', 'total': 5.0, 'uid': 'u2', 'lat': 40.7, 'lon': -74.0,
+                       'ts_group': START, 'created_at': START + 60}])
+    assert store.rebuild_sales('e1')['circle_count'] == 1
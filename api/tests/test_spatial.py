@@ -0,0 +1,24 @@
+import random
+import numpy as np
+from spatial import RADIUS_SLACK, distance_miles, distances_miles, within_radius_mask
+
+def random_points(rng, count, lat=40.7128, lon=-74.0060, spread=0.05):
+    return ([lat + rng.uniform(-spread, spread) for _ in range(count)],
+            [lon + rng.uniform(-spread, spread) for _ in range(count)])
+
+def test_distances_match_the_scalar_haversine():
+    rng = random.Random(1)
+    lats, lons = random_points(rng, 500, spread=5)
+    expected = [distance_miles(40.7128, -74.0060, lat, lon) for lat, lon in zip(lats, lons)]
+    np.testing.assert_allclose(distances_miles(40.7128, -74.0060, lats, lons), expected, rtol=1e-9)
+
+def test_within_radius_mask_matches_the_scalar_haversine():
+    rng = random.Random(2)
+    lats, lons = random_points(rng, 2000)
+    for radius in (0.5, 1, 2):
+        expected = [distance_miles(40.7128, -74.0060, lat, lon) <= radius * RADIUS_SLACK
+                    for lat, lon in zip(lats, lons)]
+        assert within_radius_mask(40.7128, -74.0060, lats, lons, radius).tolist() == expected
+
+def test_within_radius_mask_of_no_points_is_empty():
+    assert within_radius_mask(40.7128, -74.0060, [], [], 1).tolist() == []
@@ -0,0 +1,27 @@
+from users import UserCache
+
+def test_user_cache_invalidation_by_uid():
+    cache = UserCache(ttl=60)
+    cache.put({'uid': 'u1', 'email': 'Ann@Example.com '})
+    assert cache.get_by_email('ann@example.com')['uid'] == 'u1'
+    cache.invalidate('u1')
+    assert cache.get('u1') is None
+    assert cache.get_by_email('ann@example.com') is None
+
+def test_user_cache_entries_expire():
+    cache = UserCache(ttl=0)
+    cache.put({'uid': 'u1', 'email': 'ann@example.com'})
+    assert cache.get('u1') is None
+
+def test_an_email_change_drops_the_old_email():
+    cache = UserCache(ttl=60)
+    cache.put({'uid': 'u1', 'email': 'ann@example.com'})
+    cache.put({'uid': 'u1', 'email': 'ann@work.com'})
+    assert cache.get_by_email('ann@example.com') is None
+    assert cache.get_by_email('ann@work.com')['uid'] == 'u1'
+
+def test_edit_user_invalidates_the_cached_user(api):
+    api.create_user('u1', 'ann@example.com', 'Ann', 40.7, -74.0, 'new york', 'customer')
+    assert api.get_user('u1')['u_type'] == 'customer'
+    api.edit_user('u1', {'u_type': 'owner'})
+    assert api.get_user('u1')['u_type'] == 'owner'
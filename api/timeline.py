@@ -0,0 +1,52 @@
+def build_timeline(orders, start, end, frames):
+    '''
+    Buckets the orders of an establishment into equally long frames for the replay view
+
+    Args:
+        orders (list): The orders, at least every one created between start and end
+        start (float): The timestamp the replay starts at
+        end (float): The timestamp the replay ends at
+        frames (int): The number of frames
+
+    Returns:
+        dict: 'circles', every circle with orders in the range ({'id', 'ts_group', 'lat', 'lon',
+        'total', 'orders'} where lat/lon are the position of its first order), and 'frames',
+        each with its 'end' timestamp, the cumulative 'revenue', 'orders' and 'circles' since
+        start and the 'new_orders' created during the frame
+    '''
+    step = (end - start) / frames
+    orders = sorted((order for order in orders if start <= order['created_at'] <= end),
+                    key=lambda order: order['created_at'])
+    circles = {}
+    for order in orders:
+        circle = circles.get(order['ts_group'])
+        if circle is None:
+            circle = {'ts_group': order['ts_group'], 'lat': order['lat'], 'lon': order['lon'],
+                      'total': 0, 'orders': 0}
+            circles[order['ts_group']] = circle
+        circle['total'] += order['total']
+        circle['orders'] += 1
+    for i, circle in enumerate(sorted(circles.values(), key=lambda c: c['ts_group'])):
+        circle['id'] = i + 1
+        circle['total'] = round(circle['total'], 2)
+
+    timeline = []
+    revenue = 0
+    count = 0
+    seen = set()
+    i = 0
+    for frame in range(frames):
+        frame_end = end if frame == frames - 1 else start + (frame + 1) * step
+        new_orders = []
+        while i < len(orders) and orders[i]['created_at'] <= frame_end:
+            order = orders[i]
+            revenue += order['total']
+            count += 1
+            seen.add(order['ts_group'])
+            new_orders.append({'oid': order['oid'], 'lat': order['lat'], 'lon': order['lon'],
+                               'total': order['total'], 'created_at': order['created_at'],
+                               'circle': circles[order['ts_group']]['id']})
+            i += 1
+        timeline.append({'end': frame_end, 'revenue': round(revenue, 2), 'orders': count,
+                         'circles': len(seen), 'new_orders': new_orders})
+    return {'circles': sorted(circles.values(), key=lambda c: c['id']), 'frames': timeline}
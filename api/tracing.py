@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import re
+import random
+import tempfile
+import threading
+import contextvars
+from collections import deque
+
+# Trace of the request being served by the current thread, None when it is not traced
+_trace = contextvars.ContextVar('trace', default=None)
+
+def _file_name(prefix, request_id, ext):
+    # Request ids come from a header, only a safe subset of it ends up in the file name
+    return '{}-{}-{}.{}'.format(prefix, int(time.time()), re.sub(r'[^A-Za-z0-9_-]', '', request_id)[:64], ext)
+
+class Trace:
+    '''
+    The spans of one request, appended by whatever thread runs them
+    '''
+
+    def __init__(self, request_id, route, forced=False):
+        self.request_id = request_id
+        self.route = route
+        self.forced = forced
+        self.start = time.perf_counter()
+        self.spans = []  # (name, cat, start, end, thread id, args)
+
+    def to_chrome(self):
+        '''
+        Converts the spans to Chrome trace events (chrome://tracing, ui.perfetto.dev)
+
+        Returns:
+            dict: The trace, timestamps in microseconds since the request started
+        '''
+        pid = os.getpid()
+        events = [{'name': name, 'cat': cat, 'ph': 'X', 'pid': pid, 'tid': tid,
+                   'ts': round((start - self.start) * 1e6, 1), 'dur': round((end - start) * 1e6, 1),
+                   'args': args}
+                  for name, cat, start, end, tid, args in self.spans]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'request_id': self.request_id, 'route': self.route}}
+
+class _Span:
+    __slots__ = ('trace', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, trace, name, cat, args):
+        self.trace = trace
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.trace.spans.append(
+            (self.name, self.cat, self.start, time.perf_counter(), threading.get_ident(), self.args))
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(name, cat='app', **args):
+    '''
+    Times a with block as a span of the current request's trace, does nothing
+    when the request is not traced
+
+    Args:
+        name (str): The span name, e.g. 'nominatim.reverse'
+        cat (str): The category ('route', 'storage', 'geocoder', 'app')
+        **args: Values shown with the span
+    '''
+    trace = _trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, cat, args)
+
+class TracedStorage:
+    '''
+    Wraps a storage backend to record every call as a span
+    '''
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getattr__(self, name):
+        attr = getattr(self.store, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def traced(*args, **kwargs):
+            with span(name, 'storage'):
+                return attr(*args, **kwargs)
+        setattr(self, name, traced)
+        return traced
+
+class Tracer:
+    '''
+    Collects the spans of requests and writes the trace of the sampled,
+    forced or slow ones as Chrome trace JSON files
+    '''
+
+    def __init__(self, sample_rate=0.0, slow_ms=1000, directory=None, max_files=200):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'foodie-traces')
+        self.max_files = max_files
+        self.traced = 0
+        self.dumped = 0
+        self._files = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    def start(self, request_id, route, force=False):
+        '''
+        Starts collecting the spans of the current request
+
+        Args:
+            request_id (str): The id of the request
+            route (str): The route rule being served
+            force (bool): Dump the trace whatever its duration
+
+        Returns:
+            Token: The token to be passed to finish, None if the request is not traced
+        '''
+        if not (force or self.enabled):
+            return None
+        forced = force or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        with self._lock:
+            self.traced += 1
+        return _trace.set(Trace(request_id, route, forced))
+
+    def finish(self, token, **args):
+        '''
+        Stops collecting spans, adds the span of the whole request and dumps
+        the trace if it was sampled or slow
+
+        Args:
+            token (Token): The token returned by start
+            **args: Values shown with the request span (e.g. the status)
+
+        Returns:
+            str: The path of the trace file, None if it was not dumped
+        '''
+        trace = _trace.get()
+        _trace.reset(token)
+        end = time.perf_counter()
+        trace.spans.append((trace.route, 'route', trace.start, end, threading.get_ident(), args))
+        elapsed_ms = (end - trace.start) * 1000
+        if not trace.forced and not (self.slow_ms > 0 and elapsed_ms >= self.slow_ms):
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, _file_name('trace', trace.request_id, 'json'))
+        with open(path, 'w') as f:
+            json.dump(trace.to_chrome(), f, default=str)
+        self._keep(path)
+        return path
+
+    def _keep(self, path):
+        with self._lock:
+            self.dumped += 1
+            self._files.append(path)
+            while len(self._files) > self.max_files:
+                try:
+                    os.remove(self._files.popleft())
+                except OSError:
+                    pass
+
+    def profile_path(self, request_id, ext):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, _file_name('profile', request_id, ext))
+        self._keep(path)
+        return path
+
+    def stats(self):
+        '''
+        Gets the tracer counters
+
+        Returns:
+            dict: traced requests and dumped files
+        '''
+        with self._lock:
+            return {'traced': self.traced, 'dumped': self.dumped}
+
+def tracer_from_env():
+    '''
+    Builds the tracer from TRACE_SAMPLE_RATE, TRACE_SLOW_MS and TRACE_DIR
+
+    Returns:
+        Tracer: The tracer
+    '''
+    return Tracer(sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', '0')),
+                  slow_ms=float(os.getenv('TRACE_SLOW_MS', '1000')),
+                  directory=os.getenv('TRACE_DIR') or None)
+
+class Profile:
+    '''
+    A cProfile (or pyinstrument, when installed) profile of the current thread
+    '''
+
+    def __init__(self, kind='cprofile'):
+        self.kind = kind
+        if kind == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                self.kind = 'cprofile'
+            else:
+                self.profiler = Profiler()
+                self.profiler.start()
+                return
+        import cProfile
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop(self, path_for):
+        '''
+        Stops profiling and writes the profile
+
+        Args:
+            path_for (callable): Gets the path of the file from its extension
+
+        Returns:
+            str: The path of the profile (.prof for pstats/snakeviz, .html for pyinstrument)
+        '''
+        if self.kind == 'pyinstrument':
+            self.profiler.stop()
+            path = path_for('html')
+            with open(path, 'w') as f:
+                f.write(self.profiler.output_html())
+            return path
+        self.profiler.disable()
+        path = path_for('prof')
+        self.profiler.dump_stats(path)
+        return path
@@ -0,0 +1,120 @@
+import time
+import threading
+from collections import OrderedDict
+from storage import normalize_email
+
+class UserCache:
+    '''
+    Bounded LRU of user documents keyed by uid, with their normalized emails
+    pointing to the uid. Entries expire after ttl seconds, so edits made by
+    other workers show up at most ttl seconds late; edits made by this
+    process invalidate the user right away.
+
+    Returned documents are shared between callers and must not be mutated.
+    '''
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._users = OrderedDict()  # uid -> (user, expires_at)
+        self._uids = {}  # normalized email -> uid
+        self._lock = threading.Lock()
+
+    def _lookup(self, uid):
+        entry = self._users.get(uid)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            self._drop(uid)
+            return None
+        self._users.move_to_end(uid)
+        return entry[0]
+
+    def _drop(self, uid):
+        user, _ = self._users.pop(uid)
+        if user.get('email'):
+            key = normalize_email(user['email'])
+            if self._uids.get(key) == uid:
+                del self._uids[key]
+
+    def get(self, uid):
+        '''
+        Gets a cached user
+
+        Args:
+            uid (str): The id of the user
+
+        Returns:
+            dict: The user, None on a miss
+        '''
+        with self._lock:
+            user = self._lookup(uid)
+            if user is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return user
+
+    def get_by_email(self, email):
+        '''
+        Gets a cached user by email
+
+        Args:
+            email (str): The email, normalized here
+
+        Returns:
+            dict: The user, None on a miss
+        '''
+        with self._lock:
+            uid = self._uids.get(normalize_email(email))
+            user = self._lookup(uid) if uid is not None else None
+            if user is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return user
+
+    def put(self, user):
+        '''
+        Caches a user read from or written to storage
+
+        Args:
+            user (dict): The user
+        '''
+        with self._lock:
+            if user['uid'] in self._users:
+                self._drop(user['uid'])
+            self._users[user['uid']] = (user, time.monotonic() + self.ttl)
+            if user.get('email'):
+                self._uids[normalize_email(user['email'])] = user['uid']
+            while len(self._users) > self.max_entries:
+                self._drop(next(iter(self._users)))
+
+    def invalidate(self, uid):
+        '''
+        Drops a user after it changed
+
+        Args:
+            uid (str): The id of the user
+        '''
+        with self._lock:
+            if uid in self._users:
+                self._drop(uid)
+
+    def stats(self):
+        '''
+        Gets the cache counters
+
+        Returns:
+            dict: hits, misses, hit_ratio and the number of cached users
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._users)
+            }
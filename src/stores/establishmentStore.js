@@ -7,11 +7,15 @@ export const useEstablishmentStore = defineStore(
     state: () => ({
       establishment: {},
       allEstablishments: [],
+      menus: {},
       circles: [],
+      cityEvents: null,
+      cityEventsKey: null,
+      cityEventsRetry: null,
+      cityEventsSubscribers: [],
       orders: {},
       first_ts: 0,
       last_ts: 0,
-      filtered_orders: {},
       amtOrders: 0,
       amtCustomers: 0,
       loading: false,
@@ -73,6 +77,93 @@ export const useEstablishmentStore = defineStore(
             this.circles = response.data.circles;
           });
       },
+      getMenu(eid) {
+        // List endpoints leave menus out, they are fetched once per establishment
+        if (!this.menus[eid]) {
+          this.menus[eid] = axios.get('/est-menu/' + eid)
+            .then((response) => response.data.menu)
+            .catch((error) => {
+              delete this.menus[eid];
+              throw error;
+            });
+        }
+        return this.menus[eid];
+      },
+      subscribeCityEvents(city_name, lat, lon, subscriber = 'default') {
+        // One stream per page, shared by the components showing the city's circles and popmeters
+        if (!this.cityEventsSubscribers.includes(subscriber)) {
+          this.cityEventsSubscribers.push(subscriber);
+        }
+        let key = [city_name, lat, lon].join(',');
+        if (this.cityEventsKey === key && (this.cityEvents || this.cityEventsRetry)) {
+          return this.cityEvents;
+        }
+        return this.openCityEvents(city_name, lat, lon);
+      },
+      unsubscribeCityEvents(subscriber = 'default') {
+        this.cityEventsSubscribers = this.cityEventsSubscribers.filter(s => s !== subscriber);
+        if (this.cityEventsSubscribers.length === 0) {
+          this.closeCityEvents();
+        }
+      },
+      openCityEvents(city_name, lat, lon) {
+        // Circles and popmeters are pushed by the server instead of polling /get-est-by-city
+        this.closeCityEvents();
+        this.cityEventsKey = [city_name, lat, lon].join(',');
+        let params = new URLSearchParams({ city_id: city_name, lat: lat, lon: lon });
+        let source = new EventSource('/city-events?' + params.toString());
+        // Reconnects replay the last few seconds, orders already counted are skipped
+        let joined = new Set();
+        source.addEventListener('circle_opened', (e) => {
+          let circle = JSON.parse(e.data);
+          if (!this.circles.find(c => c.lat === circle.lat && c.lon === circle.lon)) {
+            this.circles.push({ lat: circle.lat, lon: circle.lon, max_ts: circle.max_ts });
+          }
+        });
+        source.addEventListener('order_joined', (e) => {
+          let order = JSON.parse(e.data);
+          if (joined.has(order.oid)) {
+            return;
+          }
+          joined.add(order.oid);
+          let establishment = this.allEstablishments.find(est => est.eid === order.eid);
+          if (order.nearby && establishment) {
+            establishment.popmeter += 1;
+            establishment.max_ts = order.max_ts;
+            establishment.timer = Math.floor(order.max_ts - Date.now() / 1000);
+          }
+        });
+        source.addEventListener('circle_expired', (e) => {
+          let circle = JSON.parse(e.data);
+          this.circles = this.circles.filter(c => !(c.lat === circle.lat && c.lon === circle.lon));
+        });
+        source.addEventListener('reset', () => {
+          // Events were missed, reload the state (the stream reconnects by itself)
+          this.getEstablishmentsByCity(city_name, lat, lon);
+        });
+        source.onerror = () => {
+          if (source.readyState === EventSource.CLOSED && this.cityEvents === source) {
+            // The server turned the stream down (e.g. 503, too many subscribers), try again later
+            this.cityEvents = null;
+            this.cityEventsRetry = setTimeout(() => {
+              this.cityEventsRetry = null;
+              this.getEstablishmentsByCity(city_name, lat, lon);
+              this.openCityEvents(city_name, lat, lon);
+            }, 10000 + Math.random() * 5000);
+          }
+        };
+        this.cityEvents = source;
+        return source;
+      },
+      closeCityEvents() {
+        clearTimeout(this.cityEventsRetry);
+        this.cityEventsRetry = null;
+        this.cityEventsKey = null;
+        if (this.cityEvents) {
+          this.cityEvents.close();
+          this.cityEvents = null;
+        }
+      },
       submitOrder(order) {
         this.loadingMsg = 'Submitting order...';
         this.loading = true;
@@ -80,7 +171,9 @@ export const useEstablishmentStore = defineStore(
           .then((response) => {
             this.loading = false;
             this.$toast.add({ severity: 'success', summary: 'Success', detail: 'Order submitted.', life: 2000 });
-            this.getEstablishmentsByCity(order.cid, order.lat, order.lon);
+            if (!this.cityEvents) {
+              this.getEstablishmentsByCity(order.cid, order.lat, order.lon);
+            }
           });
       },
       getEstablishmentOrders(eid) {
@@ -89,44 +182,22 @@ export const useEstablishmentStore = defineStore(
         this.loadingOrders = true;
         axios.post('/get-estab-orders', { eid: eid })
           .then((response) => {
-            this.orders = response.data; // orders is a dict { 1: {order: [], total: 0}, 2: {order: [], total: 0}, ... first_ts: 0, last_ts: 0 }
+            // orders is a dict { 1: {orders: [], total: 0, count: 0}, 2: ..., first_ts: 0, last_ts: 0, overall_total: 0,
+            // order_count: 0, circle_count: 0, customer_count: 0 }, the numbered circles are all of them unless the
+            // server sets SALES_WINDOW, and customer_count counts the customers of the days they span
+            this.orders = response.data;
             this.first_ts = response.data.first_ts;
             this.last_ts = response.data.last_ts;
-            let amtOrders = 0;
-            let uniqueCustomers = new Set();
-            for (let key in response.data) {
-              if (key != 'first_ts' && key != 'last_ts' && key != 'overall_total') {
-                amtOrders += response.data[key].orders.length;
-                for (let order of response.data[key].orders) {
-                  if (order.uid) {
-                    uniqueCustomers.add(order.uid);
-                  }
-                }
-              }
-            }
-            this.amtOrders = amtOrders;
-            this.amtCustomers = uniqueCustomers.size;
+            this.amtOrders = response.data.order_count;
+            this.amtCustomers = response.data.customer_count;
             this.loading = false;
             this.loadingOrders = false;
           });
       },
-      async getOrdersBetweenFirstAndLastTs(fts, lts) {
-        let len = Object.keys(this.orders).length - 3;
-        let filtered_orders = {};
-        for (let i = 1; i <= len; i++) {
-          let order = this.orders["" + i].orders;
-          for( let j = 0; j < order.length; j++) {
-            if (order[j].created_at >= fts - 5 && order[j].created_at <= lts + 5) {
-              if (!filtered_orders["" + i]) {
-                filtered_orders["" + i] = {'orders': [], 'total': 0};
-              }
-              filtered_orders["" + i].orders.push(order[j]);
-              filtered_orders["" + i].total += order[j].total;
-            }
-          }
-        }
-        this.filtered_orders = filtered_orders;
-        return filtered_orders;
+      getTimeline(eid, start, end, frames) {
+        // Orders between start and end, bucketed by the server into frames with cumulative totals
+        return axios.post('/get-estab-timeline', { eid: eid, start: start, end: end, frames: frames })
+          .then((response) => response.data);
       },
     }
   })
\ No newline at end of file